@@ -4,5 +4,194 @@ REALTIME_TEMPERATURE = 1.0
 IMAGE_MODEL = "gpt-4o-mini"
 PPLX_MODEL = "sonar"
 TOOL_DATABASE_NAME = "agent_database.json"
+# "tinydb", "sqlite", "sharded" or "segmented". tinydb has no cross-process locking and no indexes (citation
+# lookups scan the user's searches), so it only suits a single process with little history
+DATABASE_BACKEND = "sqlite"
+SQLITE_DATABASE_NAME = "agent_database.sqlite3"
+SHARD_DIRECTORY = "agent_database_shards"
+SHARD_BACKEND = "sqlite"
+SHARD_COUNT = 8
+SEGMENT_DIRECTORY = "agent_database_segments"
+# 1 for daily segments, 7 for weekly segments starting on Monday
+SEGMENT_SPAN_DAYS = 7
+SEGMENT_ARCHIVE_AFTER_DAYS = 14
+SEGMENT_MMAP_BYTES = 256 * 1024 * 1024
 CONVERSATION_LOG_PREFIX = "conversation_log"
 IMAGE_RESIZE_WIDTH = 1024
+# choose each vision request's resolution, JPEG quality and detail level from the question and image content;
+# when False every image uses the "legacy" policy. Camera frames are always scaled to fit 512x512.
+ADAPTIVE_IMAGE_POLICY = True
+IMAGE_POLICIES = {
+    "legacy": {"max_width": IMAGE_RESIZE_WIDTH, "jpeg_quality": 75, "detail": "auto"},
+    "read_text": {"max_width": 1024, "jpeg_quality": 80, "detail": "high"},
+    "layout": {"max_width": 768, "jpeg_quality": 75, "detail": "high"},
+    "object": {"max_width": 512, "jpeg_quality": 70, "detail": "low"},
+}
+# follow-up screenshots in a conversation: "composite" sends a low resolution full frame plus a crop of the region
+# that changed since the previous screenshot, "crop" only the changed region, "off" always the full frame
+SCREENSHOT_DELTA_MODE = "composite"
+# tile size in pixels, and the mean grey level difference above which a tile counts as changed
+SCREENSHOT_DELTA_BLOCK = 32
+SCREENSHOT_DELTA_THRESHOLD = 8
+# the full frame is sent when the changed region covers more than this fraction of the screen
+SCREENSHOT_DELTA_MAX_FRACTION = 0.4
+# camera questions sample up to this many consecutive frames and send the sharpest, stopping early once the
+# time budget is spent; 1 sends the first frame received
+CAMERA_BURST_FRAMES = 5
+CAMERA_BURST_BUDGET_SECONDS = 0.25
+# frames are scored on a greyscale copy at most this wide
+CAMERA_SHARPNESS_WIDTH = 320
+# fraction of edge pixels above which an image is treated as text heavy
+IMAGE_TEXT_DENSITY_THRESHOLD = 0.08
+# image input tokens per model: a base cost, plus a cost per 512px tile at high detail
+IMAGE_TOKEN_COSTS = {
+    "gpt-4o-mini": {"base": 2833, "tile": 5667},
+    "default": {"base": 85, "tile": 170},
+}
+# query_conversation_logs describes these fields with their most common values, at most SCHEMA_OPTION_TOP_K each;
+# user_id is only ever described as the caller's own ID
+SCHEMA_OPTION_FIELDS = ["tool_id", "data_type"]
+SCHEMA_OPTION_TOP_K = 12
+# seconds a process reuses its schema description before recounting the fields, so other processes' writes show up
+SCHEMA_CATALOG_REFRESH_SECONDS = 300
+# query_conversation_logs answers questions about the pages past web searches cited from the citation index,
+# listing at most this many pages, instead of generating a query
+CITATION_LOOKUP_LIMIT = 20
+# product index: products (brand and model names, prices, URLs) extracted from records as they are stored, so
+# query_conversation_logs answers questions such as "the office chair we discussed" with an index lookup
+PRODUCT_INDEX_ENABLED = True
+# the records products are extracted from; answers of query_conversation_logs itself only repeat older mentions
+PRODUCT_INDEX_DATA_TYPES = [
+    "output",
+    "urls_list",
+    "user_input_text",
+    "agent_output_text",
+]
+PRODUCT_INDEX_EXCLUDED_TOOLS = ["query_conversation_logs"]
+# the most products kept per user, the least recently mentioned dropped first, and the most listed per answer
+PRODUCT_INDEX_MAX_PER_USER = 500
+PRODUCT_LOOKUP_LIMIT = 10
+# per-job profiling: a sampling profiler of the event loop thread and a loop lag monitor, writing collapsed stacks
+# and a slow callback report per job. PROFILING_ENV_VAR turns it on without a config change: "1" for every job,
+# or a comma-separated list of room names (wildcards allowed) to profile only those rooms
+PROFILING_ENABLED = False
+PROFILING_ENV_VAR = "AGENT_PROFILE_ROOMS"
+PROFILING_DIRECTORY = "agent_profiles"
+PROFILING_INTERVAL_SECONDS = 0.01
+PROFILING_LAG_INTERVAL_SECONDS = 0.05
+# loop lag above which the stacks sampled during the stall are reported as a slow callback
+PROFILING_SLOW_CALLBACK_SECONDS = 0.1
+PROFILING_MAX_SLOW_CALLBACKS = 200
+METRICS_ENABLED = False
+# each worker process serves its metrics on its own port, the first free one of METRICS_EXPORTER_PORT_COUNT ports
+# from METRICS_EXPORTER_PORT, so a scraper can list them all; keep the count above the processes a worker runs at
+# once (num_idle_processes plus the concurrent jobs). Port 0 picks any free port, which is logged at startup
+METRICS_EXPORTER_PORT = 9464
+METRICS_EXPORTER_PORT_COUNT = 32
+METRICS_JSON_DUMP_PATH = "agent_metrics_{}.json"
+METRICS_LATENCY_BUCKETS = [
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+]
+# USD per million tokens, plus any flat per-request fee
+MODEL_PRICING = {
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.60, "request": 0.0},
+    "sonar": {"prompt": 1.0, "completion": 1.0, "request": 0.005},
+}
+# records matching a rule are deleted once older than max_age_days; anything no rule matches
+# (e.g. user_input_text and agent_output_text transcripts) is kept forever; a rule with a "table" purges the
+# structured web searches (with their citations) or the per-call usage records instead, keeping usage aggregates
+RETENTION_RULES = [
+    {"data_type": "image", "max_age_days": 7},
+    {"data_type": "metadata", "max_age_days": 30},
+    {"table": "web_searches", "max_age_days": 90},
+    {"table": "usage", "max_age_days": 90},
+]
+RETENTION_ENABLED = False
+# one run per store every RETENTION_INTERVAL_SECONDS across all worker processes: a process checks every
+# RETENTION_CHECK_SECONDS, and runs only while holding a lock file next to the store and if the last run it
+# records there is old enough; a lock older than RETENTION_LOCK_STALE_SECONDS is left from a crashed run
+RETENTION_INTERVAL_SECONDS = 6 * 60 * 60
+RETENTION_CHECK_SECONDS = 10 * 60
+RETENTION_LOCK_STALE_SECONDS = 60 * 60
+RETENTION_BATCH_SIZE = 500
+# columnar export for offline analytics: "auto" writes Parquet when pyarrow is installed and NumPy column files
+# otherwise; image records are exported without their payload ("reference") or not at all ("exclude")
+EXPORT_FORMAT = "auto"
+EXPORT_IMAGES = "reference"
+EXPORT_DIRECTORY = "agent_database_export"
+# how far back the first export into a new directory goes, unless a start date is given
+EXPORT_FIRST_RUN_DAYS = 365
+# exports stop this many seconds before now, so records still being written are left for the next run
+EXPORT_SETTLE_SECONDS = 5
+# maximum pooled keep-alive connections per upstream host, shared by all jobs in a worker process
+HTTP_POOL_SIZE = 16
+# open_urls checks links before opening them: follows redirects, drops dead links and merges duplicates
+URL_VALIDATION_ENABLED = True
+# per request, and for a whole batch; links not checked by the deadline are opened unchecked
+URL_VALIDATION_TIMEOUT_SECONDS = 3.0
+URL_VALIDATION_DEADLINE_SECONDS = 4.0
+URL_VALIDATION_MAX_CONCURRENCY = 8
+# the most bytes of a page read to find its title, and the most characters of the title kept; the title is
+# third-party text that goes back to the model, so it is also stripped of control and markup characters
+URL_VALIDATION_MAX_BYTES = 64 * 1024
+URL_TITLE_MAX_CHARS = 80
+URL_VALIDATION_USER_AGENT = "Mozilla/5.0 (compatible; shopping-agent-link-check/1.0)"
+# final statuses that mark a link as dead; connection failures do too
+URL_DEAD_STATUSES = [404, 410]
+# link checks are cached per process by canonical URL, dead links for less time
+URL_CACHE_SIZE = 1024
+URL_CACHE_TTL_SECONDS = 6 * 60 * 60
+URL_DEAD_CACHE_TTL_SECONDS = 10 * 60
+# search_the_web_multi: the most sub-questions per call, and the most Perplexity requests a job runs at once
+WEB_SEARCH_MAX_QUESTIONS = 5
+WEB_SEARCH_MAX_CONCURRENCY = 4
+# speculative web search: searches issued from committed user speech before the realtime model calls the tool
+SPECULATIVE_SEARCH_ENABLED = False
+# minimum search intent score (0-1) an utterance needs to be searched speculatively
+SPECULATIVE_SEARCH_MIN_SCORE = 0.5
+# minimum keyword overlap (Jaccard, 0-1) between the tool's question and a speculated utterance to reuse it
+SPECULATIVE_SEARCH_MATCH_THRESHOLD = 0.3
+SPECULATIVE_SEARCH_MAX_IN_FLIGHT = 2
+# per conversation: the most speculative searches issued, and the most discarded before speculation stops
+SPECULATIVE_SEARCH_MAX_PER_CONVERSATION = 20
+SPECULATIVE_SEARCH_MAX_WASTED = 5
+SPECULATIVE_SEARCH_TTL_SECONDS = 60
+# seconds each tool's upstream model call may take, including any hedged duplicate, before it falls back
+UPSTREAM_DEADLINE_SECONDS = {
+    "search_the_web": 15.0,
+    "question_camera_image": 20.0,
+    "question_screenshot": 20.0,
+    "query_conversation_logs": 15.0,
+}
+# hedged requests: a duplicate is sent when a call is slower than the running HEDGE_QUANTILE of recent latencies
+HEDGING_ENABLED = False
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_INITIAL_DELAY_SECONDS = 5.0
+HEDGE_LATENCY_WINDOW = 200
+# recent web search results, served when the same question misses its deadline
+FALLBACK_CACHE_SIZE = 256
+FALLBACK_CACHE_TTL_SECONDS = 30 * 60
+# upstream limits: concurrent calls per upstream in each worker process, and a token bucket per upstream and
+# model (requests_per_second, burst), which "models" can override for individual models; the buckets are shared
+# by every process on the host through UPSTREAM_SHARED_STATE (None keeps them per process), so with N hosts
+# sharing an API key set each rate to 1/N of the key's limit
+UPSTREAM_LIMITS = {
+    "perplexity": {"max_concurrency": 8, "requests_per_second": 4.0, "burst": 8},
+    "openai": {"max_concurrency": 8, "requests_per_second": 8.0, "burst": 16},
+}
+UPSTREAM_SHARED_STATE = "upstream_limits.sqlite3"
+# how long an upstream's bucket is paused after it answers 429
+UPSTREAM_THROTTLE_SECONDS = 2.0
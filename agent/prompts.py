@@ -22,6 +22,9 @@ class TinyDBSnippetWriterPrompt:
 
     4. Assume tinydb has already been imported with the line `import tinydb`
 
+    5. When the question is about a period of time, always filter on timestamp and combine it with the other conditions 
+    using &, so that only the relevant part of the database is read. Timestamps are strings like "2025-01-06 14:03:27.123456".
+
     Examples:
 
     Example 1: 
@@ -104,6 +107,10 @@ class RealTimeModelDriverPrompt:
     - Information retrieval (search_the_web): If you need to search the web for the answer to a question that you don't know this is the 
     tool to use. Tell the user that you're going to do a web search before using this tool.
     
+    - Several searches at once (search_the_web_multi): If answering needs more than one independent search, for example comparing
+    the prices of two or more products, pass all the questions to this tool in one call instead of calling search_the_web for each one.
+    The answers come back together with one numbered list of sources.
+    
     - Open urls (open_urls): If the user wants to navigate to any of the links returned in the information retrieval step, use this tool
     to do that. Usually they won't know exactly which links to open, so just use this tool to open all the urls that you see in the information retrieval response.
     Tell the user that you're going to open some helpful links before calling this tool. 
@@ -1,8 +1,7 @@
 import asyncio
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Union
-from agent.tools.AgentDatabase import AgentDatabase
+from typing import TYPE_CHECKING, Union
 import aiofiles
 from livekit.agents import (
     multimodal,
@@ -11,6 +10,10 @@ from livekit.agents import (
 from livekit.agents.llm import ChatMessage
 from livekit.agents.multimodal.multimodal_agent import EventTypes
 
+if TYPE_CHECKING:
+    from agent.tools.AgentDatabase import AgentDatabase
+    from agent.tools.SearchSpeculator import SearchSpeculator
+
 """
 Ad adapted from https://github.com/livekit/agents/blob/main/examples/conversation_persistor.py
 """
@@ -40,10 +43,11 @@ class ConversationLogger(utils.EventEmitter[EventTypes]):
         *,
         model: multimodal.MultimodalAgent | None,
         log: str | None,
-        database: AgentDatabase,
+        database: "AgentDatabase",
         conversation_id: str,
         user_id: str,
         transcriptions_only: bool = False,
+        speculator: "SearchSpeculator | None" = None,
     ):
         """
         Initializes a ConversationLogger instance which records the events and transcriptions of a MultimodalAgent.
@@ -52,6 +56,7 @@ class ConversationLogger(utils.EventEmitter[EventTypes]):
             model (multimodal.MultimodalAgent): an instance of a MultiModalAgent
             log (str): name of the external file to record events in
             transcriptions_only (bool): a boolean variable to determine if only transcriptions will be recorded, False by default
+            speculator (SearchSpeculator): if set, committed user speech is passed to it to start speculative web searches
             user_transcriptions (arr): list of user transcriptions
             agent_transcriptions (arr): list of agent transcriptions
             events (arr): list of all events
@@ -70,6 +75,7 @@ class ConversationLogger(utils.EventEmitter[EventTypes]):
         self._db = database
         self._user_id = user_id
         self._conversation_id = conversation_id
+        self._speculator = speculator
 
         self._log_q = asyncio.Queue[Union[EventLog, TranscriptionLog, None]]()
 
@@ -94,7 +100,7 @@ class ConversationLogger(utils.EventEmitter[EventTypes]):
         return self._events
 
     @property
-    def db(self) -> AgentDatabase:
+    def db(self) -> "AgentDatabase":
         return self._db
 
     @property
@@ -176,7 +182,11 @@ class ConversationLogger(utils.EventEmitter[EventTypes]):
 
         @self._model.on("user_speech_committed")
         def _user_speech_committed(user_msg: ChatMessage):
-            transcription = TranscriptionLog(role="user", transcription=user_msg)
+            content = user_msg.content
+            transcription = TranscriptionLog(
+                role="user",
+                transcription=content if isinstance(content, str) else str(content),
+            )
             self.db.store_text(
                 user_id=self.user_id,
                 conversation_id=self.conversation_id,
@@ -185,6 +195,8 @@ class ConversationLogger(utils.EventEmitter[EventTypes]):
                 text_data=transcription.transcription,
             )
             self._log_q.put_nowait(transcription)
+            if self._speculator is not None and isinstance(user_msg.content, str):
+                self._speculator.speculate(user_msg.content)
 
             event = EventLog(eventname="user_speech_committed")
             self._log_q.put_nowait(event)
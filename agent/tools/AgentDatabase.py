@@ -1,11 +1,44 @@
+import bisect
 import tinydb
 import uuid
 import datetime
+import functools
+import json
 import logging
+import os
+import threading
+from agent.utils.database_utils import (
+    PURGEABLE_TABLES,
+    count_field_statistics,
+    notify_listeners,
+    project_record,
+)
+from agent.utils.metrics_utils import timed
+from agent.utils.search_utils import build_web_search_record, find_citations_in
+from agent.utils.time_utils import record_epoch_ms, to_epoch_ms
+from agent.utils.usage_utils import (
+    USAGE_TOTAL_FIELDS,
+    estimate_cost,
+    usage_aggregate_keys,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _synchronized(method):
+    """
+    Runs a method while holding the database's lock. TinyDB rewrites the whole file on every write, so two
+    threads writing at once would lose one of the writes.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class AgentDatabase:
     """
     A class to manage storing and retrieving images and text with unique IDs in TinyDB.
@@ -19,7 +52,35 @@ class AgentDatabase:
             db_file (str, optional): Path to the TinyDB database file. Defaults to "agent_db.json".
         """
         self.db_file = db_file
+        self._lock = threading.RLock()
+        self._listeners = []
         self.db = tinydb.TinyDB(self.db_file)
+        self.usage = self.db.table("usage")
+        self.usage_aggregates = self.db.table("usage_aggregates")
+        self.web_searches = self.db.table("web_searches")
+        self._backfill_timestamp_ms()
+
+    def _backfill_timestamp_ms(self):
+        """
+        Adds the epoch-millisecond timestamp to records stored before the field existed.
+        """
+        Data = tinydb.Query()
+        if self.db.contains(~Data.timestamp_ms.exists()):
+
+            def add_timestamp_ms(record):
+                record["timestamp_ms"] = record_epoch_ms(record)
+
+            self.db.update(add_timestamp_ms, ~Data.timestamp_ms.exists())
+
+    def add_listener(self, listener):
+        """
+        Registers a callback that is called with the list of records after every successful store_image,
+        store_text or insert_records, in the writing thread. Only writes made through this instance are seen.
+
+        Args:
+            listener (Callable): Called with a list of record dicts.
+        """
+        self._listeners.append(listener)
 
     def _generate_unique_id(self):
         """Generates a unique ID using UUID.
@@ -29,6 +90,8 @@ class AgentDatabase:
         """
         return str(uuid.uuid4())
 
+    @timed("db.store_image")
+    @_synchronized
     def store_image(self, user_id, conversation_id, tool_id, image_data):
         """
         Stores image data in the database.
@@ -43,11 +106,12 @@ class AgentDatabase:
             str: The unique ID of the stored image data, or None if storage failed.
         """
         unique_id = self._generate_unique_id()
-        timestamp = str(datetime.datetime.now())
+        now = datetime.datetime.now()
 
         data = {
             "id": unique_id,
-            "timestamp": timestamp,
+            "timestamp": str(now),
+            "timestamp_ms": to_epoch_ms(now),
             "user_id": user_id,
             "conversation_id": conversation_id,
             "tool_id": tool_id,
@@ -57,11 +121,14 @@ class AgentDatabase:
         try:
             self.db.insert(data)
             logger.info(f"Data stored with ID: {unique_id}")
+            notify_listeners(self._listeners, [data])
             return unique_id
         except Exception as e:
             logger.info(f"An error occurred during the store: {e}")
             return None
 
+    @timed("db.store_text")
+    @_synchronized
     def store_text(self, user_id, conversation_id, tool_id, data_type, text_data):
         """
         Stores text data in the database.
@@ -77,11 +144,12 @@ class AgentDatabase:
             str: The unique ID of the stored text data, or None if storage failed.
         """
         unique_id = self._generate_unique_id()
-        timestamp = str(datetime.datetime.now())
+        now = datetime.datetime.now()
 
         data = {
             "id": unique_id,
-            "timestamp": timestamp,
+            "timestamp": str(now),
+            "timestamp_ms": to_epoch_ms(now),
             "user_id": user_id,
             "conversation_id": conversation_id,
             "tool_id": tool_id,
@@ -91,11 +159,301 @@ class AgentDatabase:
         try:
             self.db.insert(data)
             logger.info(f"Data stored with ID: {unique_id}")
+            notify_listeners(self._listeners, [data])
+            return unique_id
+        except Exception as e:
+            logger.info(f"An error occurred during the store: {e}")
+            return None
+
+    @timed("db.insert_records")
+    @_synchronized
+    def insert_records(self, records):
+        """
+        Inserts already-built records in a single write, skipping IDs that are already stored.
+
+        Args:
+            records (Iterable[dict]): Records with the standard fields ("id", "timestamp", "user_id", ...).
+
+        Returns:
+            int: The number of records inserted.
+        """
+        existing_ids = {record["id"] for record in self.db.all()}
+        new_records = [
+            {**record, "timestamp_ms": record_epoch_ms(record)}
+            for record in records
+            if record["id"] not in existing_ids
+        ]
+        self.db.insert_multiple(new_records)
+        notify_listeners(self._listeners, new_records)
+        return len(new_records)
+
+    @timed("db.store_usage")
+    @_synchronized
+    def store_usage(
+        self,
+        user_id,
+        conversation_id,
+        tool_id,
+        model,
+        prompt_tokens,
+        completion_tokens,
+        total_tokens,
+        cost_usd=None,
+    ):
+        """
+        Stores a structured token usage record and updates the running usage aggregates.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            tool_id (str): The ID of the tool that made the model request.
+            model (str): The model that served the request.
+            prompt_tokens (int): Number of input tokens.
+            completion_tokens (int): Number of output tokens.
+            total_tokens (int): Total number of tokens.
+            cost_usd (float, optional): The cost of the request. Estimated from MODEL_PRICING if not given.
+
+        Returns:
+            str: The unique ID of the stored usage record, or None if storage failed.
+        """
+        unique_id = self._generate_unique_id()
+        timestamp = str(datetime.datetime.now())
+        if cost_usd is None:
+            cost_usd = estimate_cost(model, prompt_tokens, completion_tokens)
+
+        data = {
+            "id": unique_id,
+            "timestamp": timestamp,
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "tool_id": tool_id,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cost_usd": cost_usd,
+        }
+        try:
+            self.usage.insert(data)
+            self._add_to_usage_aggregates([data])
+            logger.info(f"Usage stored with ID: {unique_id}")
             return unique_id
         except Exception as e:
             logger.info(f"An error occurred during the store: {e}")
             return None
 
+    @timed("db.insert_usage_records")
+    @_synchronized
+    def insert_usage_records(self, records):
+        """
+        Inserts already-built usage records and adds them to the running aggregates, skipping IDs that are
+        already stored.
+
+        Args:
+            records (Iterable[dict]): Usage records, as returned by all_usage().
+
+        Returns:
+            int: The number of usage records inserted.
+        """
+        existing_ids = {record["id"] for record in self.usage.all()}
+        new_records = []
+        for record in records:
+            if record["id"] in existing_ids:
+                continue
+            new_records.append(dict(record))
+            existing_ids.add(record["id"])
+        if new_records:
+            self.usage.insert_multiple(new_records)
+            self._add_to_usage_aggregates(new_records)
+        return len(new_records)
+
+    @_synchronized
+    def all_usage(self):
+        """
+        Retrieves every usage record.
+
+        Returns:
+            list: All usage dictionaries.
+        """
+        return self.usage.all()
+
+    def _add_to_usage_aggregates(self, records):
+        """
+        Adds usage records to the running aggregates of their user, conversation, tool and day. TinyDB rewrites
+        the whole file on every write, so the existing aggregates are updated in one write, and the missing ones
+        inserted in one more. Which aggregates exist is decided by the update's query against the file, so
+        aggregates another process created are added to rather than duplicated.
+
+        Args:
+            records (list): The usage records being added.
+        """
+        deltas = {}
+        for record in records:
+            for scope_key in usage_aggregate_keys(
+                record["user_id"],
+                record["conversation_id"],
+                record["tool_id"],
+                record["timestamp"],
+            ):
+                delta = deltas.setdefault(
+                    scope_key, {field: 0 for field in USAGE_TOTAL_FIELDS}
+                )
+                for field in USAGE_TOTAL_FIELDS:
+                    delta[field] += 1 if field == "requests" else record[field]
+
+        updated = set()
+
+        def add_delta(aggregate):
+            scope_key = (aggregate["scope"], aggregate["key"])
+            # files written before aggregates were looked up by query can hold duplicates; totals sum them
+            if scope_key in deltas and scope_key not in updated:
+                updated.add(scope_key)
+                for field, value in deltas[scope_key].items():
+                    aggregate[field] += value
+
+        keys = sorted({key for _, key in deltas})
+        self.usage_aggregates.update(add_delta, tinydb.Query().key.one_of(keys))
+        missing = [
+            {"scope": scope, "key": key, **delta}
+            for (scope, key), delta in deltas.items()
+            if (scope, key) not in updated
+        ]
+        if missing:
+            self.usage_aggregates.insert_multiple(missing)
+
+    @_synchronized
+    def get_usage_totals(self, scope, key):
+        """
+        Retrieves the running usage aggregate for a user, conversation, tool or day.
+
+        Args:
+            scope (str): One of "user", "conversation", "tool" or "day".
+            key (str): The user ID, conversation ID, tool ID or date ("YYYY-MM-DD").
+
+        Returns:
+            dict: The "requests", "prompt_tokens", "completion_tokens", "total_tokens" and "cost_usd" totals.
+            All totals are zero if nothing has been recorded.
+        """
+        Aggregate = tinydb.Query()
+        aggregates = self.usage_aggregates.search(
+            (Aggregate.scope == scope) & (Aggregate.key == key)
+        )
+        totals = {field: 0 for field in USAGE_TOTAL_FIELDS} | {"cost_usd": 0.0}
+        for aggregate in aggregates:
+            for field in USAGE_TOTAL_FIELDS:
+                totals[field] += aggregate[field]
+        return totals
+
+    @timed("db.store_web_search")
+    @_synchronized
+    def store_web_search(
+        self,
+        user_id,
+        conversation_id,
+        question,
+        answer,
+        citations,
+        model=None,
+        status=None,
+        latency_ms=None,
+        usage=None,
+    ):
+        """
+        Stores a structured web search: the question, the answer without its citation list, the cited URLs
+        in order, and the response's status, latency and token usage. The citations are indexed for
+        find_citations.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            question (str): The question that was searched.
+            answer (str): The answer text, or None if the search failed.
+            citations (List[str]): The cited URLs, in citation order.
+            model (str, optional): The model that answered.
+            status (int, optional): The HTTP status of the response.
+            latency_ms (float, optional): How long the request took.
+            usage (dict, optional): Token counts, as returned by extract_perplexity_usage.
+
+        Returns:
+            str: The unique ID of the stored web search, or None if storage failed.
+        """
+        data = build_web_search_record(
+            user_id,
+            conversation_id,
+            question,
+            answer,
+            citations,
+            model=model,
+            status=status,
+            latency_ms=latency_ms,
+            usage=usage,
+        )
+        try:
+            self.web_searches.insert(data)
+            logger.info(f"Web search stored with ID: {data['id']}")
+            return data["id"]
+        except Exception as e:
+            logger.info(f"An error occurred during the store: {e}")
+            return None
+
+    @timed("db.insert_web_search_records")
+    @_synchronized
+    def insert_web_search_records(self, records):
+        """
+        Inserts already-built web search records, skipping IDs that are already stored.
+
+        Args:
+            records (Iterable[dict]): Web search records, as returned by all_web_searches().
+
+        Returns:
+            int: The number of web searches inserted.
+        """
+        existing_ids = {record["id"] for record in self.web_searches.all()}
+        inserted = 0
+        for record in records:
+            if record["id"] in existing_ids:
+                continue
+            self.web_searches.insert(dict(record))
+            existing_ids.add(record["id"])
+            inserted += 1
+        return inserted
+
+    @_synchronized
+    def all_web_searches(self):
+        """
+        Retrieves every web search record.
+
+        Returns:
+            list: All web search dictionaries.
+        """
+        return self.web_searches.all()
+
+    @timed("db.find_citations")
+    @_synchronized
+    def find_citations(self, user_id, terms=None, url=None, limit=50):
+        """
+        Looks up the pages cited by a user's web searches, newest search first.
+
+        Args:
+            user_id (str): The ID of the user.
+            terms (Set[str], optional): Only searches whose question or answer contains every term, ignoring
+                case. Defaults to None (every search).
+            url (str, optional): Only citations of this page, compared by canonical URL. Defaults to None.
+            limit (int, optional): The most citations returned. Defaults to 50.
+
+        Returns:
+            list: One dictionary per citation, with its "url", "domain" and "position", and the "search_id",
+            "question", "answer", "conversation_id" and "timestamp" of the search that cited it.
+        """
+        # there is no citation index in TinyDB, which parses the whole file on every read anyway: the table is
+        # read once and the user's searches are scanned. The SQLite backends look citations up by index
+        searches = [
+            search for search in self.web_searches.all() if search["user_id"] == user_id
+        ]
+        return find_citations_in(reversed(searches), terms=terms, url=url, limit=limit)
+
+    @timed("db.get_data_by_message_id")
+    @_synchronized
     def get_data_by_message_id(self, unique_id):
         """
         Retrieves data by unique ID.
@@ -114,13 +472,17 @@ class AgentDatabase:
             logger.info(f"No data found with ID: {unique_id}")
             return None
 
-    def get_data_by_user_id(self, user_id, remove_image_data=True):
+    @timed("db.get_data_by_user_id")
+    @_synchronized
+    def get_data_by_user_id(self, user_id, remove_image_data=True, fields=None):
         """
         Retrieves data by user ID.
 
         Args:
             user_id (str): The ID of the user.
             remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            fields (list, optional): Only return these fields of each record, e.g. CONVERSATION_FIELDS.
+                Defaults to None (all fields).
 
         Returns:
             list: A list of data dictionaries associated with the user ID.  Returns an empty list if no data is found.
@@ -133,11 +495,130 @@ class AgentDatabase:
         else:
             result = self.db.search(tinydb.Query().user_id == user_id)
         if result:
-            return result
+            return [project_record(record, fields) for record in result]
         else:
             logger.info(f"No data found with user ID: {user_id}")
             return []
 
+    @timed("db.get_page_by_user_id")
+    @_synchronized
+    def get_page_by_user_id(
+        self, user_id, cursor=None, limit=100, remove_image_data=True, fields=None
+    ):
+        """
+        Retrieves one page of a user's records, in insertion order.
+
+        Args:
+            user_id (str): The ID of the user.
+            cursor (int, optional): The cursor returned with the previous page. Defaults to None (first page).
+            limit (int, optional): Maximum number of records in the page. Defaults to 100.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            fields (list, optional): Only return these fields of each record. Defaults to None (all fields).
+
+        Returns:
+            tuple: The list of data dictionaries and the cursor of the next page, or None after the last page.
+        """
+        Data = tinydb.Query()
+        query = Data.user_id == user_id
+        if remove_image_data:
+            query &= Data.data_type != "image"
+        # TinyDB cannot stream: every read parses the whole file. It caches query results until the next write,
+        # though, so the user's records are resolved once and the following pages are slices of the cached list
+        matches = self.db.search(query)
+        start = 0
+        if cursor is not None:
+            # matches come back in ascending doc_id order
+            start = bisect.bisect_right(
+                matches, cursor, key=lambda record: record.doc_id
+            )
+        page = matches[start : start + limit]
+        next_cursor = page[-1].doc_id if start + limit < len(matches) else None
+        return [project_record(record, fields) for record in page], next_cursor
+
+    def iter_data_by_user_id(
+        self, user_id, remove_image_data=True, fields=None, batch_size=500
+    ):
+        """
+        Returns a user's records page by page. TinyDB holds the whole file in memory on every read, so this only
+        bounds the projected records held at a time; the other backends stream.
+
+        Args:
+            user_id (str): The ID of the user.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            fields (list, optional): Only return these fields of each record. Defaults to None (all fields).
+            batch_size (int, optional): Number of records read per page. Defaults to 500.
+
+        Yields:
+            dict: The user's records, in insertion order.
+        """
+        cursor = None
+        while True:
+            page, cursor = self.get_page_by_user_id(
+                user_id, cursor, batch_size, remove_image_data, fields
+            )
+            yield from page
+            if cursor is None:
+                return
+
+    @timed("db.get_data_by_time_range")
+    @_synchronized
+    def get_data_by_time_range(
+        self,
+        start,
+        end=None,
+        user_id=None,
+        remove_image_data=True,
+        image_payloads=True,
+    ):
+        """
+        Retrieves the records stored in a time range.
+
+        Args:
+            start (int | str | datetime.datetime): Start of the range (inclusive), as epoch milliseconds, a
+                timestamp string or a datetime.
+            end (int | str | datetime.datetime, optional): End of the range (exclusive). Defaults to None (now).
+            user_id (str, optional): Restrict the results to one user. Defaults to None.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            image_payloads (bool, optional): Whether included image records keep their data. If False, their
+                data is None and every record gets the length of its data as "data_chars", so payloads are never
+                returned. Defaults to True.
+
+        Returns:
+            list: The matching data dictionaries, oldest first.
+        """
+        Data = tinydb.Query()
+        end = end if end is not None else datetime.datetime.now()
+        query = (Data.timestamp_ms >= to_epoch_ms(start)) & (
+            Data.timestamp_ms < to_epoch_ms(end)
+        )
+        if user_id is not None:
+            query &= Data.user_id == user_id
+        if remove_image_data:
+            query &= Data.data_type != "image"
+        records = sorted(
+            self.db.search(query), key=lambda record: record["timestamp_ms"]
+        )
+        if not image_payloads:
+            records = [
+                dict(
+                    record,
+                    data=(
+                        None
+                        if record.get("data_type") == "image"
+                        else record.get("data")
+                    ),
+                    data_chars=(
+                        len(record["data"])
+                        if isinstance(record.get("data"), str)
+                        else None
+                    ),
+                )
+                for record in records
+            ]
+        return records
+
+    @timed("db.delete_data")
+    @_synchronized
     def delete_data(self, unique_id):
         """
         Deletes data by unique ID.
@@ -152,3 +633,182 @@ class AgentDatabase:
             logger.info(f"Data with ID {unique_id} deleted.")
         else:
             logger.info(f"Data with ID {unique_id} not found, deletion skipped.")
+
+    @timed("db.search_text")
+    @_synchronized
+    def search_text(self, text, user_id=None, limit=50):
+        """
+        Finds text records containing all of the given words (case-insensitive).
+
+        Args:
+            text (str): The words to search for.
+            user_id (str, optional): Restrict the search to one user. Defaults to None.
+            limit (int, optional): Maximum number of records to return. Defaults to 50.
+
+        Returns:
+            list: Matching data dictionaries, empty if the text has no words.
+        """
+        words = [word.lower() for word in text.split()]
+        if not words:
+            return []
+        Data = tinydb.Query()
+        query = (Data.data_type != "image") & Data.data.test(
+            lambda value: isinstance(value, str)
+            and all(word in value.lower() for word in words)
+        )
+        if user_id is not None:
+            query &= Data.user_id == user_id
+        return self.db.search(query)[:limit]
+
+    @_synchronized
+    def all(self):
+        """
+        Retrieves every record.
+
+        Returns:
+            list: All data dictionaries.
+        """
+        return self.db.all()
+
+    @timed("db.field_statistics")
+    def field_statistics(self, option_fields):
+        """
+        Summarizes the stored records' fields: the types each field holds and how often each value of the option
+        fields occurs. Reads the file rather than the table, so no records are kept in TinyDB's query cache,
+        and only reading it holds the lock.
+
+        Args:
+            option_fields (list): Fields whose values are counted.
+
+        Returns:
+            dict: "types" maps each field to the set of Python type names it holds, "options" maps each option
+            field to a Counter of its values.
+        """
+        with self._lock:
+            with open(self.db_file, "rb") as handle:
+                raw = handle.read()
+        records = json.loads(raw).get(self.db.default_table_name, {}) if raw else {}
+        return count_field_statistics(records.values(), option_fields)
+
+    @_synchronized
+    def search(self, query):
+        """
+        Runs a TinyDB query over the stored records.
+
+        Args:
+            query (tinydb.queries.QueryLike): The query condition.
+
+        Returns:
+            list: The matching data dictionaries.
+        """
+        return self.db.search(query)
+
+    @timed("db.purge_records")
+    def purge_records(self, cutoff, data_type=None, tool_id=None, batch_size=500):
+        """
+        Deletes records older than a cutoff, in batches. The expired records are found without holding the lock,
+        and the lock is released between batches, so inserts from other threads are not held up by the purge.
+
+        Args:
+            cutoff (str): Records with an earlier timestamp are deleted (same format as the stored timestamps).
+            data_type (str, optional): Only delete records of this data type. Defaults to None (any).
+            tool_id (str, optional): Only delete records from this tool. Defaults to None (any).
+            batch_size (int, optional): Number of records deleted per write. Defaults to 500.
+
+        Returns:
+            int: The number of records deleted.
+        """
+        # only reading the file holds the lock; parsing and filtering it, which take far longer, do not
+        with self._lock:
+            with open(self.db_file, "rb") as handle:
+                raw = handle.read()
+        records = json.loads(raw).get(self.db.default_table_name, {}) if raw else {}
+        expired_ids = [
+            record["id"]
+            for record in records.values()
+            if record.get("timestamp") is not None
+            and record["timestamp"] < cutoff
+            and (data_type is None or record.get("data_type") == data_type)
+            and (tool_id is None or record.get("tool_id") == tool_id)
+        ]
+
+        Data = tinydb.Query()
+        for start in range(0, len(expired_ids), batch_size):
+            batch = expired_ids[start : start + batch_size]
+            with self._lock:
+                self.db.remove(Data.id.one_of(batch))
+        if expired_ids:
+            logger.info(f"Purged {len(expired_ids)} records older than {cutoff}")
+        return len(expired_ids)
+
+    @timed("db.purge_table")
+    def purge_table(self, table, cutoff, batch_size=500):
+        """
+        Deletes web search or usage records older than a cutoff, in batches, the same way as purge_records.
+        Usage aggregates are kept, so totals still include the purged records.
+
+        Args:
+            table (str): "web_searches" or "usage".
+            cutoff (str): Records with an earlier timestamp are deleted (same format as the stored timestamps).
+            batch_size (int, optional): Number of records deleted per write. Defaults to 500.
+
+        Returns:
+            int: The number of records deleted.
+
+        Raises:
+            ValueError: If the table is not a purgeable table.
+        """
+        if table not in PURGEABLE_TABLES:
+            raise ValueError(f"Cannot purge table: {table}")
+        with self._lock:
+            with open(self.db_file, "rb") as handle:
+                raw = handle.read()
+        records = json.loads(raw).get(table, {}) if raw else {}
+        expired_ids = [
+            record["id"]
+            for record in records.values()
+            if record.get("timestamp") is not None and record["timestamp"] < cutoff
+        ]
+
+        Data = tinydb.Query()
+        for start in range(0, len(expired_ids), batch_size):
+            batch = expired_ids[start : start + batch_size]
+            with self._lock:
+                self.db.table(table).remove(Data.id.one_of(batch))
+        if expired_ids:
+            logger.info(
+                f"Purged {len(expired_ids)} {table} records older than {cutoff}"
+            )
+        return len(expired_ids)
+
+    def compact(self):
+        """
+        Compacts the database file. TinyDB rewrites the whole file on every write, so purged records have
+        already given their space back and there is nothing left to do.
+        """
+        return None
+
+    @_synchronized
+    def warm(self):
+        """
+        Reads the database file once, so the first request of a job does not pay for the cold read.
+
+        Returns:
+            int: The number of records.
+        """
+        return len(self.db)
+
+    def storage_bytes(self):
+        """
+        Returns the size of the database on disk.
+
+        Returns:
+            int: The size of the database file in bytes.
+        """
+        with self._lock:
+            return os.path.getsize(self.db_file) if os.path.exists(self.db_file) else 0
+
+    @_synchronized
+    def close(self):
+        """Closes the database file."""
+        self.db.close()
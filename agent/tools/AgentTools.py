@@ -1,17 +1,45 @@
 from typing import Annotated
+import asyncio
+import functools
+import json
 import logging
 import datetime
-from PIL import ImageGrab
 from typing import List
 from livekit.agents import llm
-import webbrowser
-from agent.utils.image_utils import encode_image, capture_image_from_video_stream
+from agent.utils.image_utils import (
+    encode_full_screenshot,
+    encode_screenshot,
+    capture_image_from_video_stream,
+    screenshot_delta,
+    select_image_policy,
+    to_grey_array,
+)
 from agent.utils.database_utils import (
     convert_database_entries_to_conversation,
     run_generated_query,
-    get_schema_from_db,
 )
-from agent.config import IMAGE_MODEL, IMAGE_RESIZE_WIDTH
+from agent.utils.metrics_utils import span, timed
+from agent.utils.usage_utils import extract_openai_usage, extract_perplexity_usage
+from agent.utils.intent_utils import citation_lookup_terms, product_lookup_terms
+from agent.utils.time_utils import epoch_ms_to_datetime, relative_time_bounds
+from agent.utils.url_utils import canonicalize_url
+from agent.tools.HedgedExecutor import HedgedExecutor
+from agent.tools.ProductIndex import ProductIndex
+from agent.tools.SchemaCatalog import SchemaCatalog
+from agent.tools.SearchSpeculator import SearchSpeculator
+from agent.tools.UpstreamScheduler import PRIORITY_BACKGROUND
+from agent.tools.UrlValidator import UrlValidator
+from agent.config import (
+    IMAGE_MODEL,
+    SPECULATIVE_SEARCH_ENABLED,
+    HEDGING_ENABLED,
+    UPSTREAM_DEADLINE_SECONDS,
+    WEB_SEARCH_MAX_QUESTIONS,
+    WEB_SEARCH_MAX_CONCURRENCY,
+    URL_VALIDATION_ENABLED,
+    CITATION_LOOKUP_LIMIT,
+    PRODUCT_INDEX_ENABLED,
+)
 from agent.prompts import (
     WebSearchLLMPrompt,
     ScreenshotImagePrompt,
@@ -23,17 +51,107 @@ logger = logging.getLogger("agent_tools")
 logger.setLevel(logging.INFO)
 
 
+def grab_screen():
+    """
+    Takes a screenshot of the whole screen.
+
+    PIL.ImageGrab is imported on first use, so jobs that never take a screenshot do not load it.
+
+    Returns:
+        PIL.Image.Image: The screenshot.
+    """
+    from PIL import ImageGrab
+
+    return ImageGrab.grab()
+
+
 class AgentTools(llm.FunctionContext):
     def __init__(
-        self, room, image_model, web_model, database, user_id, conversation_id
+        self,
+        room,
+        image_model,
+        web_model,
+        database,
+        user_id,
+        conversation_id,
+        frame_source=capture_image_from_video_stream,
+        screenshot_source=grab_screen,
+        speculative_search=SPECULATIVE_SEARCH_ENABLED,
+        hedging=HEDGING_ENABLED,
+        scheduler=None,
+        url_validator=None,
     ):
         super().__init__()
         self._room = room
+        self._frame_source = frame_source
+        self._screenshot_source = screenshot_source
         self._image_llm = image_model
         self._web_model = web_model
         self._user_id = user_id
         self._conversation_id = conversation_id
         self.db = database
+        # shared by every job using this database, so the schema is counted once per refresh interval per process
+        self._schema_catalog = SchemaCatalog.for_database(database)
+        # likewise shared, the products extracted from stored records, for product recall questions
+        self._product_index = (
+            ProductIndex.for_database(database) if PRODUCT_INDEX_ENABLED else None
+        )
+        # the previous screenshot in this conversation, as a greyscale array, so follow-ups can send what changed
+        self._previous_screenshot = None
+        # the worker-wide UpstreamScheduler, if any, queues and rate limits every upstream call
+        self._scheduler = scheduler
+        # checks links before open_urls opens them; the worker shares one, with its connection pool and cache
+        if url_validator is None and URL_VALIDATION_ENABLED:
+            url_validator = UrlValidator()
+        self._url_validator = url_validator
+        # searches issued from the user's speech before search_the_web is called, see SearchSpeculator
+        self.speculator = (
+            SearchSpeculator(
+                web_model,
+                on_wasted=self._record_wasted_search,
+                submit=self._submitter("search_the_web", priority=PRIORITY_BACKGROUND),
+            )
+            if speculative_search
+            else None
+        )
+        # bounds the Perplexity requests search_the_web_multi runs at once
+        self._search_semaphore = asyncio.Semaphore(WEB_SEARCH_MAX_CONCURRENCY)
+        # every upstream model call goes through an executor that enforces the tool's deadline and hedges slow requests
+        self._executors = {
+            tool_id: HedgedExecutor(
+                tool_id,
+                deadline_seconds=deadline,
+                hedge=hedging,
+                is_success=(
+                    (lambda result: result.status_code == 200)
+                    if tool_id == "search_the_web"
+                    else None
+                ),
+                on_discarded=functools.partial(self._record_discarded, tool_id),
+                submit=self._submitter(tool_id),
+            )
+            for tool_id, deadline in UPSTREAM_DEADLINE_SECONDS.items()
+        }
+
+    def _submitter(self, tool_id, **kwargs):
+        """
+        Returns the coroutine function a tool's upstream calls are run with.
+
+        Args:
+            tool_id (str): The tool making the calls.
+            **kwargs: Passed to UpstreamScheduler.submit, e.g. priority.
+
+        Returns:
+            Callable: UpstreamScheduler.submit bound to the tool's upstream and model, or None to run calls on
+            the default thread pool when there is no scheduler.
+        """
+        if self._scheduler is None:
+            return None
+        if tool_id == "search_the_web":
+            upstream, model = "perplexity", self._web_model.model
+        else:
+            upstream, model = "openai", IMAGE_MODEL
+        return functools.partial(self._scheduler.submit, upstream, model, **kwargs)
 
     @property
     def room(self):
@@ -55,7 +173,59 @@ class AgentTools(llm.FunctionContext):
     def conversation_id(self):
         return self._conversation_id
 
+    def _record_usage(self, tool_id, model, usage):
+        """
+        Stores the token usage of an upstream model request made by a tool.
+
+        Args:
+            tool_id (str): The ID of the tool that made the request.
+            model (str): The model that served the request.
+            usage (dict): Token counts, as returned by the extract_*_usage helpers.
+        """
+        self.db.store_usage(
+            user_id=self.user_id,
+            conversation_id=self.conversation_id,
+            tool_id=tool_id,
+            model=model,
+            **usage,
+        )
+
+    def _record_wasted_search(self, result):
+        """
+        Stores the token usage of a speculative web search whose result was never used.
+
+        Args:
+            result (requests.Response): The abandoned search's response.
+        """
+        if result.status_code == 200:
+            self._record_usage(
+                "search_the_web_speculative",
+                self.web_model.model,
+                extract_perplexity_usage(result),
+            )
+
+    def _record_discarded(self, tool_id, result):
+        """
+        Stores the token usage of a hedged or timed out upstream request whose result was not used.
+
+        Args:
+            tool_id (str): The tool that made the request.
+            result: The discarded Perplexity response or OpenAI chat completion.
+        """
+        if tool_id == "search_the_web":
+            if result.status_code == 200:
+                self._record_usage(
+                    "search_the_web_discarded",
+                    self.web_model.model,
+                    extract_perplexity_usage(result),
+                )
+        else:
+            self._record_usage(
+                f"{tool_id}_discarded", IMAGE_MODEL, extract_openai_usage(result)
+            )
+
     @llm.ai_callable()
+    @timed("tool.get_todays_date_and_time")
     async def get_todays_date_and_time(self):
         """
         When we want to get the date or time
@@ -65,6 +235,7 @@ class AgentTools(llm.FunctionContext):
         return f"The time is {date_time}"
 
     @llm.ai_callable()
+    @timed("tool.open_urls")
     async def open_urls(
         self,
         urls_to_open: Annotated[
@@ -82,20 +253,65 @@ class AgentTools(llm.FunctionContext):
         logger.info(
             f"CALL OPEN URLS: Here are the sites to navigate to: {urls_to_open}"
         )
-        for url in urls_to_open:
-            webbrowser.open(url, new=2, autoraise=True)
+        import webbrowser
+
+        to_open = urls_to_open
+        checked = None
+        if self._url_validator is not None:
+            with span("tool.open_urls.validate"):
+                checked = await self._url_validator.validate(urls_to_open)
+            # the link as cited rather than where it redirected the checker, which may be a bot check, a region
+            # or a login page; the browser follows the redirects itself
+            to_open = [result["url"] for result in checked if result["alive"]]
+            logger.info(f"CALL OPEN URLS: Checked links {checked}")
+
+        with span("tool.open_urls.browser"):
+            for url in to_open:
+                webbrowser.open(url, new=2, autoraise=True)
+
+        with span("tool.open_urls.db"):
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="open_urls",
+                data_type="urls_list",
+                text_data=str(to_open),
+            )
+            if checked is not None:
+                self.db.store_text(
+                    user_id=self.user_id,
+                    conversation_id=self.conversation_id,
+                    tool_id="open_urls",
+                    data_type="metadata",
+                    text_data=json.dumps(checked),
+                )
 
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="open_urls",
-            data_type="urls_list",
-            text_data=str(urls_to_open),
+        if checked is None:
+            return "Done opening urls"
+        # titles come from third-party pages, so they are quoted, and were cut and stripped by the validator
+        opened = [
+            (
+                f'{result["url"]} (titled "{result["title"]}")'
+                if result["title"]
+                else result["url"]
+            )
+            for result in checked
+            if result["alive"]
+        ]
+        dead = [result["url"] for result in checked if not result["alive"]]
+        response = (
+            "Opened these pages: " + "; ".join(opened)
+            if opened
+            else "None of the urls could be opened"
         )
-
-        return "Done opening urls"
+        if dead:
+            response += ". These links are broken and were not opened: " + ", ".join(
+                dead
+            )
+        return response
 
     @llm.ai_callable()
+    @timed("tool.search_the_web")
     async def search_the_web(
         self,
         user_question: Annotated[
@@ -110,12 +326,46 @@ class AgentTools(llm.FunctionContext):
         access to the internet and return its answer to your question in addition to the sources it used
         """
         logger.info(f"CALL PPLX: Here's whats going to be asked: {user_question}")
-        result = self.web_model.invoke(
-            query=user_question, system_prompt=WebSearchLLMPrompt
-        )
-        text_result = self.web_model.craft_text_response(result)
+        result = None
+        if self.speculator is not None:
+            with span("tool.search_the_web.speculation"):
+                result = await self.speculator.claim(user_question)
+        if result is None:
+            with span("tool.search_the_web.upstream"):
+                try:
+                    result = await self._executors["search_the_web"].run(
+                        self.web_model.invoke,
+                        query=user_question,
+                        system_prompt=WebSearchLLMPrompt,
+                        cache_key=user_question.strip().lower(),
+                    )
+                except asyncio.TimeoutError as e:
+                    logger.info(e)
+        with span("tool.search_the_web.parse"):
+            if result is None:
+                text_result = (
+                    "The web search is taking too long, please try again in a moment"
+                )
+                usage = None
+            else:
+                text_result = self.web_model.craft_text_response(result)
+                usage = extract_perplexity_usage(result)
 
         logger.info(f"CALL PPLX: Here's the response {text_result}")
+        with span("tool.search_the_web.db"):
+            self._store_search(user_question, result, text_result, usage)
+        return text_result
+
+    def _store_search(self, user_question, result, text_result, usage):
+        """
+        Stores a web search's question and answer, the parsed response with its citations, and token usage.
+
+        Args:
+            user_question (str): The question that was searched.
+            result (requests.Response): The Perplexity response, or None if the search missed its deadline.
+            text_result (str): The answer as returned to the model.
+            usage (dict): Token counts, as returned by extract_perplexity_usage, or None.
+        """
         self.db.store_text(
             user_id=self.user_id,
             conversation_id=self.conversation_id,
@@ -130,17 +380,135 @@ class AgentTools(llm.FunctionContext):
             data_type="output",
             text_data=text_result,
         )
-        # save raw model result
+        if result is None:
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="search_the_web",
+                data_type="metadata",
+                text_data=str(result),
+            )
+            return
+
+        parsed = self.web_model.parse_response(result)
+        answer, citations = parsed if parsed is not None else (None, [])
+        elapsed = getattr(result, "elapsed", None)
+        latency_ms = elapsed.total_seconds() * 1000 if elapsed is not None else None
+        # the parsed response, compactly: the answer is already stored as the output
         self.db.store_text(
             user_id=self.user_id,
             conversation_id=self.conversation_id,
             tool_id="search_the_web",
             data_type="metadata",
-            text_data=str(result),
+            text_data=json.dumps(
+                {
+                    "status": result.status_code,
+                    "model": self.web_model.model,
+                    "latency_ms": latency_ms,
+                    "citations": citations,
+                    "usage": usage,
+                }
+            ),
         )
+        # the structured search, whose citations are indexed for query_conversation_logs
+        self.db.store_web_search(
+            user_id=self.user_id,
+            conversation_id=self.conversation_id,
+            question=user_question,
+            answer=answer,
+            citations=citations,
+            model=self.web_model.model,
+            status=result.status_code,
+            latency_ms=latency_ms,
+            usage=usage,
+        )
+        if result.status_code == 200:
+            self._record_usage("search_the_web", self.web_model.model, usage)
+
+    async def _search_one(self, user_question):
+        """
+        Runs one sub-question of search_the_web_multi, waiting for a slot if too many searches are running.
+
+        Args:
+            user_question (str): The sub-question.
+
+        Returns:
+            requests.Response: The Perplexity response.
+        """
+        if self.speculator is not None:
+            result = await self.speculator.claim(user_question)
+            if result is not None:
+                return result
+        async with self._search_semaphore:
+            return await self._executors["search_the_web"].run(
+                self.web_model.invoke,
+                query=user_question,
+                system_prompt=WebSearchLLMPrompt,
+                cache_key=user_question.strip().lower(),
+            )
+
+    @llm.ai_callable()
+    @timed("tool.search_the_web_multi")
+    async def search_the_web_multi(
+        self,
+        user_questions: Annotated[
+            List[str],
+            llm.TypeInfo(
+                description="The separate questions to search for at the same time, e.g. one per product being compared"
+            ),
+        ],
+    ):
+        """
+        Use instead of several calls to search_the_web when a request breaks down into independent questions, for example
+        comparing the prices of two or more products. The questions are searched at the same time and the answers come back
+        together, with one list of sources
+        """
+        # drop repeats, keeping the order the model asked in
+        questions = list(dict.fromkeys(q.strip() for q in user_questions if q.strip()))
+        questions = questions[:WEB_SEARCH_MAX_QUESTIONS]
+        logger.info(f"CALL PPLX MULTI: Here's whats going to be asked: {questions}")
+        with span("tool.search_the_web_multi.upstream"):
+            results = await asyncio.gather(
+                *(self._search_one(question) for question in questions),
+                return_exceptions=True,
+            )
+
+        with span("tool.search_the_web_multi.parse"):
+            responses = []
+            for question, result in zip(questions, results):
+                if isinstance(result, Exception):
+                    logger.info(f"CALL PPLX MULTI: '{question}' failed: {result}")
+                    result = None
+                responses.append(result)
+            answered = [
+                (question, response)
+                for question, response in zip(questions, responses)
+                if response is not None
+            ]
+            failed = [q for q, r in zip(questions, responses) if r is None]
+            if answered:
+                text_result = self.web_model.craft_combined_response(
+                    [question for question, _ in answered],
+                    [response for _, response in answered],
+                )
+                if failed:
+                    text_result += f"\nUnable to search for: {failed}"
+            else:
+                text_result = "Unable to call web search, got an error"
+
+        logger.info(f"CALL PPLX MULTI: Here's the response {text_result}")
+        with span("tool.search_the_web_multi.db"):
+            for question, response in answered:
+                self._store_search(
+                    question,
+                    response,
+                    self.web_model.craft_text_response(response),
+                    extract_perplexity_usage(response),
+                )
         return text_result
 
     @llm.ai_callable()
+    @timed("tool.question_camera_image")
     async def question_camera_image(
         self,
         user_question: Annotated[
@@ -156,86 +524,104 @@ class AgentTools(llm.FunctionContext):
         """
 
         logger.info(f"CAPTURE FRAME: Here's whats going to be asked: {user_question}")
-        latest_frame = await capture_image_from_video_stream(self._room)
+        # the frame is not captured yet, so only the question picks the policy; frames are always scaled to fit
+        # 512x512, so the policy only sets the JPEG quality and detail level
+        policy_name, policy = select_image_policy(user_question)
+        logger.info(f"CAPTURE FRAME: Using the {policy_name} image policy")
+        with span("tool.question_camera_image.capture"):
+            latest_frame = await self._frame_source(
+                self._room, quality=policy["jpeg_quality"]
+            )
 
         # if the image is present, then ask a question of it
         if not isinstance(latest_frame["b64_image"], type(None)):
             base64_image = latest_frame["b64_image"]
 
             try:
-                response = self._image_llm.chat.completions.create(
-                    model=IMAGE_MODEL,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": VideoStreamImagePrompt.system_message,
-                                }
-                            ],
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": f"{user_question}"},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}"
+                with span("tool.question_camera_image.upstream"):
+                    response = await self._executors["question_camera_image"].run(
+                        self._image_llm.chat.completions.create,
+                        model=IMAGE_MODEL,
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": VideoStreamImagePrompt.system_message,
+                                    }
+                                ],
+                            },
+                            {
+                                "role": "user",
+                                "content": [
+                                    {"type": "text", "text": f"{user_question}"},
+                                    {
+                                        "type": "image_url",
+                                        "image_url": {
+                                            "url": f"data:image/jpeg;base64,{base64_image}",
+                                            "detail": policy["detail"],
+                                        },
                                     },
-                                },
-                            ],
-                        },
-                    ],
-                    max_tokens=1000,
-                )
-                final_response_text = response.choices[0].message.content
-                token_usage = str(response.usage.__dict__)
+                                ],
+                            },
+                        ],
+                        max_tokens=1000,
+                    )
+                with span("tool.question_camera_image.parse"):
+                    final_response_text = response.choices[0].message.content
+                    token_usage = str(response.usage.__dict__)
+                    usage = extract_openai_usage(response)
                 logger.info(f"CAPTURE FRAME: Here's the response {final_response_text}")
             except Exception as e:
                 logger.info(e)
                 token_usage = None
+                usage = None
                 final_response_text = "Unable to ask a question of this captured video frame: Technical difficulties"
                 base64_image = None
 
         else:
             token_usage = None
+            usage = None
             final_response_text = "Unable to ask question about frame because byte64 encoded image not present"
             base64_image = None
 
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="question_camera_image",
-            data_type="input",
-            text_data=user_question,
-        )
-        self.db.store_image(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="question_camera_image",
-            image_data=base64_image,
-        )
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="question_camera_image",
-            data_type="output",
-            text_data=final_response_text,
-        )
-        # save raw model result
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="question_camera_image",
-            data_type="metadata",
-            text_data=token_usage,
-        )
+        with span("tool.question_camera_image.db"):
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_camera_image",
+                data_type="input",
+                text_data=user_question,
+            )
+            self.db.store_image(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_camera_image",
+                image_data=base64_image,
+            )
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_camera_image",
+                data_type="output",
+                text_data=final_response_text,
+            )
+            # save raw model result
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_camera_image",
+                data_type="metadata",
+                text_data=token_usage,
+            )
+            if usage:
+                self._record_usage("question_camera_image", IMAGE_MODEL, usage)
 
         return final_response_text
 
     @llm.ai_callable()
+    @timed("tool.question_screenshot")
     async def question_screenshot(
         self,
         user_question: Annotated[
@@ -251,82 +637,258 @@ class AgentTools(llm.FunctionContext):
         or something of the like.
         """
 
-        screenshot = ImageGrab.grab().convert("RGB")
-        width, height = screenshot.size
-        new_height = int(height * IMAGE_RESIZE_WIDTH / width)
-        screenshot = screenshot.resize((IMAGE_RESIZE_WIDTH, new_height))
-        base64_image = encode_image(screenshot)
-        logger.info(f"SCREENSHOT: Here's whats going to be asked {user_question}")
+        with span("tool.question_screenshot.capture"):
+            screenshot = self._screenshot_source().convert("RGB")
+        with span("tool.question_screenshot.diff"):
+            current = to_grey_array(screenshot)
+            delta = screenshot_delta(self._previous_screenshot, current)
+        with span("tool.question_screenshot.encode"):
+            policy_name, policy = select_image_policy(user_question, screenshot)
+            sent_as, images = encode_screenshot(screenshot, policy, delta)
+        logger.info(
+            f"SCREENSHOT: Here's whats going to be asked {user_question} ({policy_name} image policy, sent {sent_as})"
+        )
+        content = [{"type": "text", "text": f"{user_question}"}]
+        if sent_as == "composite":
+            content.append(
+                {
+                    "type": "text",
+                    "text": "The first image is the whole screen at low resolution. The second is the part of the "
+                    "screen that changed since the previous screenshot, at full resolution.",
+                }
+            )
+        elif sent_as == "crop":
+            content.append(
+                {
+                    "type": "text",
+                    "text": "The image is the part of the screen that changed since the previous screenshot.",
+                }
+            )
+        content.extend(
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{image}",
+                    "detail": detail,
+                },
+            }
+            for image, detail in images
+        )
 
         try:
-            response = self._image_llm.chat.completions.create(
-                model=IMAGE_MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": ScreenshotImagePrompt.system_message,
-                            }
-                        ],
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": f"{user_question}"},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                },
-                            },
-                        ],
-                    },
-                ],
-                max_tokens=1000,
-            )
-            final_response_text = response.choices[0].message.content
-            token_usage = str(response.usage.__dict__)
+            with span("tool.question_screenshot.upstream"):
+                response = await self._executors["question_screenshot"].run(
+                    self._image_llm.chat.completions.create,
+                    model=IMAGE_MODEL,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": ScreenshotImagePrompt.system_message,
+                                }
+                            ],
+                        },
+                        {"role": "user", "content": content},
+                    ],
+                    max_tokens=1000,
+                )
+            with span("tool.question_screenshot.parse"):
+                final_response_text = response.choices[0].message.content
+                token_usage = str(response.usage.__dict__)
+                usage = extract_openai_usage(response)
             logger.info(f"SCREENSHOT: Here's the response {final_response_text}")
+            # the next screenshot is only compared with one the model has seen
+            self._previous_screenshot = current
         except Exception as e:
             logger.info(e)
             token_usage = None
+            usage = None
             final_response_text = "Unable to ask a question of this captured screenshot: Technical difficulties"
             base64_image = None
+        else:
+            # the stored image is always the whole screen, even when only the changed region was sent
+            if sent_as in ("full", "unchanged"):
+                base64_image = images[0][0]
+            else:
+                with span("tool.question_screenshot.encode_stored"):
+                    base64_image = encode_full_screenshot(screenshot, policy)[0]
+
+        with span("tool.question_screenshot.db"):
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_screenshot",
+                data_type="input",
+                text_data=user_question,
+            )
+            self.db.store_image(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_screenshot",
+                image_data=base64_image,
+            )
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_screenshot",
+                data_type="output",
+                text_data=final_response_text,
+            )
+
+            self.db.store_text(
+                user_id=self.user_id,
+                conversation_id=self.conversation_id,
+                tool_id="question_screenshot",
+                data_type="metadata",
+                text_data=token_usage,
+            )
+            if usage:
+                self._record_usage("question_screenshot", IMAGE_MODEL, usage)
+
+        return final_response_text
+
+    def _store_query(self, user_question, conversation_string, token_usage, usage):
+        """
+        Stores a conversation log question, its answer and the token usage of the query that answered it.
 
+        Args:
+            user_question (str): The question.
+            conversation_string (str): The answer as returned to the model.
+            token_usage (str): The model's usage block, or None if no model was called.
+            usage (dict): Token counts, as returned by extract_openai_usage, or None.
+        """
         self.db.store_text(
             user_id=self.user_id,
             conversation_id=self.conversation_id,
-            tool_id="question_screenshot",
+            tool_id="query_conversation_logs",
             data_type="input",
             text_data=user_question,
         )
-        self.db.store_image(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="question_screenshot",
-            image_data=base64_image,
-        )
+
         self.db.store_text(
             user_id=self.user_id,
             conversation_id=self.conversation_id,
-            tool_id="question_screenshot",
+            tool_id="query_conversation_logs",
             data_type="output",
-            text_data=final_response_text,
+            text_data=conversation_string,
         )
 
         self.db.store_text(
             user_id=self.user_id,
             conversation_id=self.conversation_id,
-            tool_id="question_screenshot",
+            tool_id="query_conversation_logs",
             data_type="metadata",
             text_data=token_usage,
         )
+        if usage:
+            self._record_usage("query_conversation_logs", IMAGE_MODEL, usage)
 
-        return final_response_text
+    def _lookup_citations(self, user_question):
+        """
+        Answers a question about the pages past web searches cited, such as "What sites did you show me for
+        monitors?", from the database's citation index.
+
+        Args:
+            user_question (str): The question.
+
+        Returns:
+            str: The cited pages, most recent first, or None if the question is not about cited pages or
+            nothing matches, in which case the question is answered with a generated query instead.
+        """
+        terms = citation_lookup_terms(user_question)
+        if terms is None:
+            return None
+        try:
+            citations = self.db.find_citations(
+                self.user_id, terms=terms, limit=CITATION_LOOKUP_LIMIT * 4
+            )
+        except Exception as e:
+            logger.info(f"QUERY CONVERSATION LOGS: Citation lookup failed: {e}")
+            return None
+        if not citations:
+            return None
+
+        pages = {}
+        for citation in citations:
+            page = pages.setdefault(
+                canonicalize_url(citation["url"]),
+                {"url": citation["url"], "questions": []},
+            )
+            if citation["question"] not in page["questions"]:
+                page["questions"].append(citation["question"])
+            if len(pages) >= CITATION_LOOKUP_LIMIT:
+                break
+        logger.info(
+            f"QUERY CONVERSATION LOGS: Found {len(pages)} cited pages for {sorted(terms)}"
+        )
+        return "Pages cited in earlier web searches, most recent first:\n" + "\n".join(
+            f"- {page['url']} (searched for: {'; '.join(page['questions'][:3])})"
+            for page in pages.values()
+        )
+
+    def _lookup_products(self, user_question):
+        """
+        Answers a question that recalls a product from earlier conversations, such as "What was the office chair
+        we discussed last week?", from the product index.
+
+        Args:
+            user_question (str): The question.
+
+        Returns:
+            str: The matching products, most relevant and most recently mentioned first, or None if the question
+            does not recall a product or nothing matches, in which case the question is answered with a
+            generated query instead.
+        """
+        if self._product_index is None:
+            return None
+        terms = product_lookup_terms(user_question)
+        if terms is None:
+            return None
+        since_ms, until_ms = relative_time_bounds(user_question)
+        try:
+            products = self._product_index.find(
+                self.user_id, terms=terms, since_ms=since_ms, until_ms=until_ms
+            )
+        except Exception as e:
+            logger.info(f"QUERY CONVERSATION LOGS: Product lookup failed: {e}")
+            return None
+        if not products:
+            return None
+        logger.info(
+            f"QUERY CONVERSATION LOGS: Found {len(products)} products for {sorted(terms)}"
+        )
+
+        lines = []
+        for product in products:
+            line = f"- {product['name']}"
+            if product["category"]:
+                line += f" {product['category']}"
+            if product["prices"]:
+                # prices are kept most recent last
+                latest, *earlier = [
+                    f"${price:,.0f}" if price.is_integer() else f"${price:,.2f}"
+                    for price in reversed(product["prices"])
+                ]
+                line += f", {latest}"
+                if earlier:
+                    line += f" (earlier {', '.join(earlier)})"
+            if product["urls"]:
+                line += ", " + " ".join(product["urls"])
+            last_seen = epoch_ms_to_datetime(product["last_seen_ms"])
+            times = (
+                "once" if product["mentions"] == 1 else f"{product['mentions']} times"
+            )
+            line += f", mentioned {times}, last on {last_seen:%Y-%m-%d %H:%M}"
+            lines.append(line)
+        return (
+            "Products from earlier conversations, most relevant first:\n"
+            + "\n".join(lines)
+        )
 
     @llm.ai_callable()
+    @timed("tool.query_conversation_logs")
     async def query_conversation_logs(
         self,
         user_question: Annotated[
@@ -342,7 +904,26 @@ class AgentTools(llm.FunctionContext):
         had with the assistant about office chairs last week.
         """
 
-        db_schema = get_schema_from_db(self.db.db)
+        # questions about the pages past web searches cited are answered from the citation index, and questions
+        # recalling a product from the product index; both read the database, so they run off the event loop
+        with span("tool.query_conversation_logs.citations"):
+            conversation_string = await asyncio.to_thread(
+                self._lookup_citations, user_question
+            )
+        if conversation_string is None:
+            with span("tool.query_conversation_logs.products"):
+                conversation_string = await asyncio.to_thread(
+                    self._lookup_products, user_question
+                )
+        if conversation_string is not None:
+            with span("tool.query_conversation_logs.db"):
+                self._store_query(user_question, conversation_string, None, None)
+            return conversation_string
+
+        with span("tool.query_conversation_logs.schema"):
+            db_schema = await asyncio.to_thread(
+                self._schema_catalog.describe, self.user_id
+            )
         today_date = str(datetime.date.today())[:10]
         input_text = f"""
         You have a TinyDB called "db". Each entry has the following fields:
@@ -356,59 +937,46 @@ class AgentTools(llm.FunctionContext):
         """
 
         try:
-            response = self._image_llm.chat.completions.create(
-                model=IMAGE_MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": TinyDBSnippetWriterPrompt.system_message,
-                            }
-                        ],
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": f"{input_text}"},
-                        ],
-                    },
-                ],
-                max_tokens=1000,
-            )
-            final_response_text = response.choices[0].message.content
-            code_response = final_response_text.split("$$$$")[1]
-            query_result = run_generated_query(self.db.db, code_response)
-            conversation_string = convert_database_entries_to_conversation(query_result)
+            with span("tool.query_conversation_logs.upstream"):
+                response = await self._executors["query_conversation_logs"].run(
+                    self._image_llm.chat.completions.create,
+                    model=IMAGE_MODEL,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": TinyDBSnippetWriterPrompt.system_message,
+                                }
+                            ],
+                        },
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": f"{input_text}"},
+                            ],
+                        },
+                    ],
+                    max_tokens=1000,
+                )
+            with span("tool.query_conversation_logs.parse"):
+                final_response_text = response.choices[0].message.content
+                code_response = final_response_text.split("$$$$")[1]
+            with span("tool.query_conversation_logs.run_query"):
+                query_result = run_generated_query(self.db, code_response)
+                conversation_string = convert_database_entries_to_conversation(
+                    query_result
+                )
             token_usage = str(response.usage.__dict__)
+            usage = extract_openai_usage(response)
             logger.info(f"QUERY CONVERSATION LOGS: Here's the query {code_response}")
         except Exception as e:
             logger.info(e)
             token_usage = None
+            usage = None
             conversation_string = "Unable to ask a question about the conversation database: Technical difficulties"
 
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="query_conversation_logs",
-            data_type="input",
-            text_data=user_question,
-        )
-
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="query_conversation_logs",
-            data_type="output",
-            text_data=conversation_string,
-        )
-
-        self.db.store_text(
-            user_id=self.user_id,
-            conversation_id=self.conversation_id,
-            tool_id="query_conversation_logs",
-            data_type="metadata",
-            text_data=token_usage,
-        )
+        with span("tool.query_conversation_logs.db"):
+            self._store_query(user_question, conversation_string, token_usage, usage)
         return conversation_string
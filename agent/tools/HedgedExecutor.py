@@ -0,0 +1,281 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+from agent.utils.metrics_utils import METRICS
+from agent.config import (
+    HEDGING_ENABLED,
+    HEDGE_QUANTILE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_INITIAL_DELAY_SECONDS,
+    HEDGE_LATENCY_WINDOW,
+    FALLBACK_CACHE_SIZE,
+    FALLBACK_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# recent successful request latencies per executor name, shared by every job in the process so the hedge
+# delay is learned from all rooms rather than per conversation
+_LATENCIES: Dict[str, collections.deque] = {}
+_LATENCIES_LOCK = threading.Lock()
+
+
+class FallbackCache:
+    """
+    A small process-wide LRU cache of recent successful upstream results, served when a request misses its deadline.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = FALLBACK_CACHE_SIZE,
+        ttl_seconds: float = FALLBACK_CACHE_TTL_SECONDS,
+    ):
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_entries (int, optional): Entries kept before the least recently used is evicted.
+            ttl_seconds (float, optional): How long an entry can be served for.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached result for a key, or None if there is none or it has expired.
+
+        Args:
+            key: The cache key.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored, result = entry
+            if time.monotonic() - stored > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, result) -> None:
+        """
+        Stores a result, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key: The cache key.
+            result: The result.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+FALLBACK_CACHE = FallbackCache()
+
+
+class HedgedExecutor:
+    """
+    Runs a blocking upstream call in a worker thread (or through an UpstreamScheduler) with a deadline, and optionally a hedged duplicate.
+
+    If the call has not returned after the hedge delay (the running HEDGE_QUANTILE of recent latencies for the
+    same executor name, or HEDGE_INITIAL_DELAY_SECONDS until there are HEDGE_MIN_SAMPLES of them), an identical
+    request is sent and whichever returns first wins. Requests that lose, or that are still going when the
+    deadline passes, are cancelled: one still waiting for a worker thread or in the UpstreamScheduler's queue
+    never runs, so it costs no rate limit token. A blocking HTTP call that has already started cannot be
+    interrupted, so it runs to completion and its result is passed to on_discarded, e.g. to record its token
+    usage. If the deadline passes first, the most recent cached result for the same cache key is returned, or
+    asyncio.TimeoutError is raised so the caller can fall back.
+
+    Counters: "hedge.<name>.fired", "hedge.<name>.won" (the hedge returned first), "hedge.<name>.deadline_exceeded"
+    and "hedge.<name>.fallback_cached".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        deadline_seconds: Optional[float] = None,
+        hedge: bool = HEDGING_ENABLED,
+        hedge_quantile: float = HEDGE_QUANTILE,
+        initial_hedge_delay: float = HEDGE_INITIAL_DELAY_SECONDS,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        is_success: Optional[Callable] = None,
+        on_discarded: Optional[Callable] = None,
+        cache: FallbackCache = FALLBACK_CACHE,
+        submit: Optional[Callable] = None,
+    ):
+        """
+        Initializes the executor.
+
+        Args:
+            name (str): The upstream call being made, e.g. "search_the_web". Latency history is shared by name.
+            deadline_seconds (float, optional): Time allowed for the call, including any hedge. Defaults to None (no deadline).
+            hedge (bool, optional): Whether to send a hedged duplicate. Defaults to HEDGING_ENABLED.
+            hedge_quantile (float, optional): Latency quantile used as the hedge delay. Defaults to HEDGE_QUANTILE.
+            initial_hedge_delay (float, optional): Hedge delay until enough latencies are known.
+            min_samples (int, optional): Latencies needed before the quantile is used.
+            is_success (Callable, optional): Returns whether a result may be cached. Defaults to accepting every result.
+            on_discarded (Callable, optional): Called with the result of every losing or timed out request that completes.
+            cache (FallbackCache, optional): Where results are cached. Defaults to the process-wide cache.
+            submit (Callable, optional): Coroutine function that runs fnc(*args, **kwargs), e.g. a bound
+                UpstreamScheduler.submit. Defaults to asyncio.to_thread.
+        """
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self.is_success = is_success
+        self.on_discarded = on_discarded
+        self.cache = cache
+        self.submit = submit or asyncio.to_thread
+        self.stats = {
+            "fired": 0,
+            "won": 0,
+            "deadline_exceeded": 0,
+            "fallback_cached": 0,
+        }
+        with _LATENCIES_LOCK:
+            self._latencies = _LATENCIES.setdefault(
+                name, collections.deque(maxlen=HEDGE_LATENCY_WINDOW)
+            )
+
+    def _count(self, name: str) -> None:
+        self.stats[name] += 1
+        METRICS.increment(f"hedge.{self.name}.{name}")
+
+    def hedge_delay(self) -> float:
+        """
+        Returns how long to wait for a request before sending the hedge.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_hedge_delay
+        index = min(
+            len(samples) - 1, int(round(self.hedge_quantile * len(samples))) - 1
+        )
+        return samples[max(0, index)]
+
+    def _discard(self, task: asyncio.Task, attempt: Dict) -> None:
+        if task.done():
+            self._report_discarded(task)
+            return
+        with attempt["lock"]:
+            if attempt["started"]:
+                task.add_done_callback(self._report_discarded)
+                return
+            attempt["discarded"] = True
+        # still queued: the scheduler drops cancelled requests, and the call is skipped if it was just dispatched
+        task.cancel()
+
+    def _report_discarded(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.on_discarded is not None:
+            try:
+                self.on_discarded(task.result())
+            except Exception as e:
+                logger.info(f"Unable to handle discarded {self.name} result: {e}")
+
+    async def run(self, fnc: Callable, /, *args, cache_key=None, **kwargs):
+        """
+        Calls fnc(*args, **kwargs) in a worker thread, hedging and enforcing the deadline.
+
+        Args:
+            fnc (Callable): The blocking upstream call.
+            *args: Positional arguments for fnc.
+            cache_key (optional): Key the result is cached under and looked up by when the deadline passes.
+                Defaults to None, meaning the result is not cached.
+            **kwargs: Keyword arguments for fnc.
+
+        Returns:
+            The result of the first request to succeed, or a cached result if the deadline passed.
+
+        Raises:
+            asyncio.TimeoutError: If the deadline passed and nothing is cached for cache_key.
+            Exception: Whatever the last request raised, if every request failed.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.deadline_seconds if self.deadline_seconds else None
+        hedge_at = start + self.hedge_delay() if self.hedge else None
+        started = {}
+        attempts = {}
+
+        def launch():
+            attempt = {"lock": threading.Lock(), "started": False, "discarded": False}
+
+            def call():
+                with attempt["lock"]:
+                    if attempt["discarded"]:
+                        return None
+                    attempt["started"] = True
+                return fnc(*args, **kwargs)
+
+            task = asyncio.create_task(self.submit(call))
+            started[task] = loop.time()
+            attempts[task] = attempt
+            return task
+
+        primary = launch()
+        pending = {primary}
+        error = None
+        while pending:
+            now = loop.time()
+            wake_at = [t for t in (deadline, hedge_at) if t is not None]
+            timeout = max(0.0, min(wake_at) - now) if wake_at else None
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                result = task.result()
+                self._latencies.append(loop.time() - started[task])
+                if task is not primary:
+                    self._count("won")
+                for other in pending:
+                    self._discard(other, attempts[other])
+                if cache_key is not None and (
+                    self.is_success is None or self.is_success(result)
+                ):
+                    self.cache.put((self.name, cache_key), result)
+                return result
+
+            now = loop.time()
+            if deadline is not None and now >= deadline:
+                break
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if pending:
+                    self._count("fired")
+                    logger.info(f"Hedging {self.name} after {now - start:.2f}s")
+                    pending.add(launch())
+
+        if error is not None and not pending:
+            raise error
+
+        for task in pending:
+            self._discard(task, attempts[task])
+        self._count("deadline_exceeded")
+        logger.info(f"{self.name} missed its {self.deadline_seconds}s deadline")
+        if cache_key is not None:
+            cached = self.cache.get((self.name, cache_key))
+            if cached is not None:
+                self._count("fallback_cached")
+                return cached
+        raise asyncio.TimeoutError(
+            f"{self.name} did not respond within {self.deadline_seconds}s"
+        )
@@ -0,0 +1,268 @@
+import asyncio
+import collections
+import datetime
+import fnmatch
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+from agent.utils.metrics_utils import METRICS, EventLoopLagMonitor
+from agent.config import (
+    PROFILING_ENABLED,
+    PROFILING_ENV_VAR,
+    PROFILING_DIRECTORY,
+    PROFILING_INTERVAL_SECONDS,
+    PROFILING_LAG_INTERVAL_SECONDS,
+    PROFILING_SLOW_CALLBACK_SECONDS,
+    PROFILING_MAX_SLOW_CALLBACKS,
+)
+
+logger = logging.getLogger(__name__)
+
+# samples whose innermost frame is in one of these modules are the event loop waiting for work
+_IDLE_MODULES = ("selectors.py",)
+# samples kept for attributing a stall to what the loop was running
+_RECENT_SAMPLES = 4096
+# loop lag probes kept for the percentiles, the first hour and more at the default probe interval
+_LAG_WINDOW = 100_000
+
+
+def profiling_requested(room_name: str) -> bool:
+    """
+    Returns whether a job should be profiled.
+
+    Profiling is on for every job when PROFILING_ENABLED is set. Otherwise the PROFILING_ENV_VAR environment
+    variable turns it on: "1" or "all" for every job, or a comma-separated list of room names, which may use
+    shell-style wildcards (e.g. "support-*"), to profile only the rooms that misbehave.
+
+    Args:
+        room_name (str): The job's room.
+
+    Returns:
+        bool: True if the job should be profiled.
+    """
+    if PROFILING_ENABLED:
+        return True
+    value = os.environ.get(PROFILING_ENV_VAR, "").strip()
+    if value.lower() in ("1", "all", "true"):
+        return True
+    patterns = [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+    return any(fnmatch.fnmatchcase(room_name, pattern) for pattern in patterns)
+
+
+class JobProfiler:
+    """
+    A low-overhead sampling profiler and event loop lag monitor for one job, from start() to aclose().
+
+    A daemon thread samples the stack of the job's event loop thread every interval_seconds, and counts each
+    distinct stack. An EventLoopLagMonitor wakes every lag_interval_seconds and measures how late it woke up:
+    the loop lag, i.e. how long some callback held the loop. Whenever the lag exceeds slow_callback_seconds, the
+    stacks sampled during the stall are recorded as a slow callback, so the report names the code that blocked
+    the loop rather than only when it happened.
+
+    aclose() writes two files to the directory, named after the room, conversation and process:
+    "<name>.collapsed", the stacks in the collapsed format read by flamegraph.pl, speedscope and inferno, and
+    "<name>.slow_callbacks.json", with the loop lag distribution and the slow callbacks. Time the loop spends
+    waiting for I/O shows up under the selectors frames; blocking calls run in worker threads (e.g. the
+    upstream requests) are not sampled.
+
+    Counters: "profiler.samples" and "profiler.slow_callbacks", and the "profiler.loop_lag" histogram.
+    """
+
+    def __init__(
+        self,
+        room_name: str,
+        conversation_id: str,
+        directory: str = PROFILING_DIRECTORY,
+        interval_seconds: float = PROFILING_INTERVAL_SECONDS,
+        lag_interval_seconds: float = PROFILING_LAG_INTERVAL_SECONDS,
+        slow_callback_seconds: float = PROFILING_SLOW_CALLBACK_SECONDS,
+        max_slow_callbacks: int = PROFILING_MAX_SLOW_CALLBACKS,
+    ):
+        """
+        Initializes the profiler. Call start() from the job's event loop to begin sampling.
+
+        Args:
+            room_name (str): The job's room, used to tag the output.
+            conversation_id (str): The job's conversation ID, used to tag the output.
+            directory (str, optional): Where the output is written. Defaults to PROFILING_DIRECTORY.
+            interval_seconds (float, optional): Seconds between stack samples. Defaults to PROFILING_INTERVAL_SECONDS.
+            lag_interval_seconds (float, optional): Seconds between loop lag probes. Defaults to PROFILING_LAG_INTERVAL_SECONDS.
+            slow_callback_seconds (float, optional): Loop lag above which a slow callback is recorded.
+                Defaults to PROFILING_SLOW_CALLBACK_SECONDS.
+            max_slow_callbacks (int, optional): The most slow callbacks kept; later ones are only counted.
+                Defaults to PROFILING_MAX_SLOW_CALLBACKS.
+        """
+        self.room_name = room_name
+        self.conversation_id = conversation_id
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self.lag_interval_seconds = lag_interval_seconds
+        self.slow_callback_seconds = slow_callback_seconds
+        self.max_slow_callbacks = max_slow_callbacks
+        self.stacks = collections.Counter()
+        self.slow_callbacks: List[Dict] = []
+        self.slow_callback_count = 0
+        self._recent = collections.deque(maxlen=_RECENT_SAMPLES)
+        self._labels = {}
+        self._thread_id = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lag_monitor = EventLoopLagMonitor(
+            interval=lag_interval_seconds,
+            max_samples=_LAG_WINDOW,
+            metric="profiler.loop_lag",
+            slow_threshold=slow_callback_seconds,
+            on_slow=self._record_slow_callback,
+        )
+        self._started = None
+
+    @property
+    def output_prefix(self) -> str:
+        """The path of the output files, without their extension."""
+        name = re.sub(
+            r"[^A-Za-z0-9_.-]+", "_", f"{self.room_name}_{self.conversation_id}"
+        )
+        return os.path.join(self.directory, f"{name}_{os.getpid()}")
+
+    def start(self) -> None:
+        """Starts sampling the running event loop's thread, and the loop lag monitor."""
+        if self._thread is not None:
+            return
+        self._thread_id = threading.get_ident()
+        self._started = time.time()
+        self._thread = threading.Thread(
+            target=self._sample, name="job-profiler", daemon=True
+        )
+        self._thread.start()
+        self._lag_monitor.start()
+        logger.info(
+            f"Profiling room {self.room_name} conversation {self.conversation_id}"
+        )
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+        return label
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            self.stacks[stack] += 1
+            self._recent.append((time.monotonic(), stack))
+            METRICS.increment("profiler.samples")
+
+    def _record_slow_callback(self, expected: float, woke: float, lag: float) -> None:
+        self.slow_callback_count += 1
+        METRICS.increment("profiler.slow_callbacks")
+        if len(self.slow_callbacks) >= self.max_slow_callbacks:
+            return
+        stalled = collections.Counter(
+            stack for at, stack in list(self._recent) if expected <= at <= woke
+        )
+        self.slow_callbacks.append(
+            {
+                "at": datetime.datetime.now().isoformat(),
+                "lag_ms": 1000 * lag,
+                "samples": sum(stalled.values()),
+                "stacks": [
+                    {"stack": ";".join(stack), "samples": count}
+                    for stack, count in stalled.most_common(3)
+                ],
+            }
+        )
+        logger.info(
+            f"Event loop blocked for {1000 * lag:.0f}ms in room {self.room_name}"
+            + (f" at {stalled.most_common(1)[0][0][-1]}" if stalled else "")
+        )
+
+    def report(self) -> Dict:
+        """
+        Summarizes the profile so far.
+
+        Returns:
+            Dict: The room, conversation, duration, sample counts, loop lag percentiles and slow callbacks.
+        """
+        samples = sum(self.stacks.values())
+        idle = sum(
+            count
+            for stack, count in self.stacks.items()
+            if stack and stack[-1].split(":")[0].endswith(_IDLE_MODULES)
+        )
+        lags = sorted(self._lag_monitor.samples)
+
+        def lag_ms(fraction: float) -> Optional[float]:
+            if not lags:
+                return None
+            return 1000 * lags[min(len(lags) - 1, int(fraction * len(lags)))]
+
+        return {
+            "room": self.room_name,
+            "conversation_id": self.conversation_id,
+            "pid": os.getpid(),
+            "started": (
+                datetime.datetime.fromtimestamp(self._started).isoformat()
+                if self._started
+                else None
+            ),
+            "duration_seconds": time.time() - self._started if self._started else 0.0,
+            "interval_seconds": self.interval_seconds,
+            "samples": samples,
+            "idle_fraction": idle / samples if samples else None,
+            "loop_lag_ms": {
+                "probes": len(lags),
+                "p50": lag_ms(0.5),
+                "p99": lag_ms(0.99),
+                "max": 1000 * lags[-1] if lags else None,
+            },
+            "slow_callback_seconds": self.slow_callback_seconds,
+            "slow_callback_count": self.slow_callback_count,
+            "slow_callbacks": self.slow_callbacks,
+        }
+
+    def write(self) -> str:
+        """
+        Writes the collapsed stacks and the slow callback report.
+
+        Returns:
+            str: The path of the output files, without their extension.
+        """
+        prefix = self.output_prefix
+        os.makedirs(self.directory, exist_ok=True)
+        with open(prefix + ".collapsed", "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{';'.join(stack)} {count}\n")
+        with open(prefix + ".slow_callbacks.json", "w") as file:
+            json.dump(self.report(), file, indent=2)
+        return prefix
+
+    async def aclose(self) -> None:
+        """Stops sampling and writes the output files."""
+        if self._thread is None:
+            return
+        await self._lag_monitor.aclose()
+        self._stop.set()
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+        try:
+            prefix = await asyncio.to_thread(self.write)
+            logger.info(
+                f"Wrote profile of room {self.room_name} to {prefix}.collapsed "
+                f"({self.slow_callback_count} slow callbacks)"
+            )
+        except Exception as e:
+            logger.info(f"Unable to write the profile of room {self.room_name}: {e}")
@@ -1,5 +1,9 @@
 import requests
 import json
+import re
+from requests.adapters import HTTPAdapter
+from agent.utils.metrics_utils import timed
+from agent.utils.url_utils import canonicalize_url
 
 
 class PerplexityChat:
@@ -13,14 +17,34 @@ class PerplexityChat:
         BASE_URL (str): The endpoint URL for the Perplexity chat completions API.
         api_key (str): The API key used for authentication with Perplexity.
         model (str): The Perplexity model to use for completions.
+        base_url (str): The endpoint URL requests are sent to. Defaults to BASE_URL, but can point at a local stand-in.
+        session (requests.Session): The pooled HTTP session requests are sent with, so connections are reused.
+        timeout_seconds (float): The connect and read timeout of each request, or None to wait indefinitely.
     """
 
     BASE_URL = "https://api.perplexity.ai/chat/completions"
 
-    def __init__(self, pplx_model="sonar", pplx_api_key=None):
+    def __init__(
+        self,
+        pplx_model="sonar",
+        pplx_api_key=None,
+        base_url=None,
+        session=None,
+        pool_size=10,
+        timeout_seconds=None,
+    ):
         self.api_key = pplx_api_key
         self.model = pplx_model
-
+        self.base_url = base_url or self.BASE_URL
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+        self.timeout_seconds = timeout_seconds
+
+    @timed("pplx.invoke")
     def invoke(self, system_prompt, query, max_tokens=1000):
         """
         Send a request to the Perplexity API to generate a chat completion.
@@ -56,12 +80,33 @@ class PerplexityChat:
             "Content-Type": "application/json",
         }
 
-        response = requests.request(
-            "POST", self.BASE_URL, json=payload, headers=headers
+        response = self.session.request(
+            "POST",
+            self.base_url,
+            json=payload,
+            headers=headers,
+            timeout=self.timeout_seconds,
         )
 
         return response
 
+    @staticmethod
+    def parse_response(response):
+        """
+        Extracts the answer text and the cited urls from a successful API response.
+
+        Args:
+            response (requests.Response): The HTTP response from the Perplexity API.
+
+        Returns:
+            tuple: The answer text and the list of citation urls, or None if the request was unsuccessful.
+        """
+        if response.status_code != 200:
+            return None
+        response_json = json.loads(response.text)
+        text_response = response_json["choices"][0]["message"]["content"]
+        return text_response, list(response_json.get("citations") or [])
+
     @staticmethod
     def craft_text_response(response):
         """
@@ -74,15 +119,59 @@ class PerplexityChat:
             str: The formatted text response with citations, or an error message
                 if the request was unsuccessful.
         """
-        if response.status_code == 200:
-            response_json = json.loads(response.text)
-            citations = str(
-                {i + 1: x for i, x in enumerate(response_json["citations"])}
-            )
-            text_response = response_json["choices"][0]["message"]["content"]
+        parsed = PerplexityChat.parse_response(response)
+        if parsed is not None:
+            text_response, citations = parsed
+            citations = str({i + 1: x for i, x in enumerate(citations)})
             result = text_response + f"\ncitations: \n{citations}"
 
         else:
             result = "Unable to call web search, got an error"
 
         return result
+
+    @staticmethod
+    def craft_combined_response(questions, responses):
+        """
+        Combines the answers to several questions into one text response with a single citation list.
+
+        Citations are deduplicated across the answers by their canonical URL and renumbered, and each answer's [n]
+        markers are rewritten to the combined numbering. Markers with no matching citation are dropped, so they
+        cannot point at another answer's source.
+
+        Args:
+            questions (List[str]): The questions that were asked.
+            responses (List[requests.Response]): The HTTP response for each question, in the same order.
+
+        Returns:
+            str: The answers, each under its question, followed by the combined citations.
+        """
+        numbering = {}
+        citations = {}
+        sections = []
+        for question, response in zip(questions, responses):
+            parsed = PerplexityChat.parse_response(response)
+            if parsed is None:
+                sections.append(
+                    f"Question: {question}\nUnable to call web search, got an error"
+                )
+                continue
+            text_response, answer_citations = parsed
+            remap = {}
+            for i, url in enumerate(answer_citations):
+                key = canonicalize_url(url)
+                if key not in numbering:
+                    numbering[key] = len(numbering) + 1
+                    citations[numbering[key]] = url
+                remap[str(i + 1)] = str(numbering[key])
+            text_response = re.sub(
+                r"\[(\d+)\]",
+                lambda m: f"[{remap[m.group(1)]}]" if m.group(1) in remap else "",
+                text_response,
+            )
+            sections.append(f"Question: {question}\n{text_response}")
+        return "\n\n".join(sections) + f"\ncitations: \n{str(citations)}"
+
+    def close(self):
+        """Closes the pooled HTTP connections."""
+        self.session.close()
@@ -0,0 +1,287 @@
+import collections
+import logging
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Set
+from agent.utils.metrics_utils import METRICS
+from agent.utils.product_utils import extract_products, product_key, product_terms
+from agent.utils.time_utils import record_epoch_ms
+from agent.config import (
+    PRODUCT_INDEX_DATA_TYPES,
+    PRODUCT_INDEX_EXCLUDED_TOOLS,
+    PRODUCT_INDEX_MAX_PER_USER,
+    PRODUCT_LOOKUP_LIMIT,
+)
+
+logger = logging.getLogger(__name__)
+
+# one index per database instance in the process, so every job sharing a database shares its index
+_INDEXES = weakref.WeakKeyDictionary()
+_INDEXES_LOCK = threading.Lock()
+# per product: the most recent mentions, prices and URLs kept, and the most sentence terms kept for matching
+_MAX_MENTIONS = 20
+_MAX_PRICES = 5
+_MAX_URLS = 5
+_MAX_CONTEXT_TERMS = 64
+
+
+class ProductIndex:
+    """
+    An index of the products each user's conversations mentioned, for product-centric recall questions.
+
+    Products are extracted from tool outputs, opened URLs and the conversation transcript with the local
+    heuristics of extract_products (brand and model names, prices and URLs), so no model is called. A user's
+    products are indexed on their first lookup, from that user's text records only, so starting a job process
+    does not scan the database; from then on the database's store listener keeps them up to date as records
+    are stored. Each product is keyed by user and name, and keeps when it was mentioned, in which conversations
+    and by which tools, its most recent prices and URLs, and the words of the sentences it was mentioned in.
+    find() then answers "the office chair we discussed last week" with a lookup.
+
+    Writes made by other processes after a user's first lookup are not seen by this process, and records purged
+    by retention stay indexed until the process exits (by default no retention rule covers the indexed data
+    types). The index is thread-safe.
+    """
+
+    def __init__(
+        self,
+        database,
+        data_types: List[str] = PRODUCT_INDEX_DATA_TYPES,
+        excluded_tools: List[str] = PRODUCT_INDEX_EXCLUDED_TOOLS,
+        max_per_user: int = PRODUCT_INDEX_MAX_PER_USER,
+    ):
+        """
+        Initializes an empty index and registers it as a store listener of the database.
+
+        Args:
+            database: Any conversation database backend.
+            data_types (List[str], optional): Data types products are extracted from. Defaults to PRODUCT_INDEX_DATA_TYPES.
+            excluded_tools (List[str], optional): Tools whose records are skipped. Defaults to PRODUCT_INDEX_EXCLUDED_TOOLS.
+            max_per_user (int, optional): The most products kept per user. Defaults to PRODUCT_INDEX_MAX_PER_USER.
+        """
+        # the database holds the index through its listener, so the index only holds it weakly
+        self._database = weakref.ref(database)
+        self.data_types = set(data_types)
+        self.excluded_tools = set(excluded_tools)
+        self.max_per_user = max_per_user
+        # user_id -> product key -> product, least recently mentioned first
+        self._products: Dict[str, collections.OrderedDict] = {}
+        # users whose records are being or have been read; the listener only indexes records of these users
+        self._users: Set[str] = set()
+        self._loaded: Set[str] = set()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        database.add_listener(self.observe)
+
+    @classmethod
+    def for_database(cls, database) -> "ProductIndex":
+        """
+        Returns the process-wide product index of a database, creating it on first use.
+
+        Args:
+            database: Any conversation database backend.
+
+        Returns:
+            ProductIndex: The index.
+        """
+        with _INDEXES_LOCK:
+            index = _INDEXES.get(database)
+            if index is None:
+                index = _INDEXES[database] = cls(database)
+            return index
+
+    def load_user(self, user_id: str) -> float:
+        """
+        Reads a user's text records into the index, if they have not been read yet.
+
+        Args:
+            user_id (str): The ID of the user.
+
+        Returns:
+            float: The time taken in seconds, 0 if the user's records were already read.
+        """
+        if user_id in self._loaded:
+            return 0.0
+        with self._load_lock:
+            if user_id in self._loaded:
+                return 0.0
+            start = time.perf_counter()
+            with self._lock:
+                # records stored from here on are indexed by the listener too; ones read twice are skipped by ID
+                self._users.add(user_id)
+            database = self._database()
+            try:
+                records = (
+                    database.get_data_by_user_id(user_id, remove_image_data=True)
+                    if database is not None
+                    else []
+                )
+            except Exception:
+                with self._lock:
+                    self._users.discard(user_id)
+                raise
+            # oldest first, so the products dropped when a user has too many are the least recently mentioned
+            records = sorted(
+                (record for record in records if self._indexable(record)),
+                key=record_epoch_ms,
+            )
+            self._index(records)
+            self._loaded.add(user_id)
+            elapsed = time.perf_counter() - start
+            METRICS.increment("product_index.users_loaded")
+            logger.info(
+                f"Indexed products of user {user_id} from {len(records)} records in {elapsed:.3f}s"
+            )
+            return elapsed
+
+    def _indexable(self, record: Dict) -> bool:
+        return (
+            record.get("data_type") in self.data_types
+            and record.get("tool_id") not in self.excluded_tools
+            and isinstance(record.get("data"), str)
+        )
+
+    def observe(self, records: List[Dict]) -> None:
+        """
+        Extracts the products mentioned in stored records of the users already read and adds them to the index.
+        Registered as the database's store listener.
+
+        Args:
+            records (List[Dict]): The records.
+        """
+        with self._lock:
+            records = [record for record in records if record["user_id"] in self._users]
+        self._index(records)
+
+    def _index(self, records: List[Dict]) -> None:
+        extracted = []
+        for record in records:
+            if not self._indexable(record):
+                continue
+            products = extract_products(record["data"])
+            if products:
+                extracted.append((record, products))
+        if not extracted:
+            return
+        with self._lock:
+            for record, products in extracted:
+                for product in products:
+                    self._add(record, product)
+        METRICS.increment(
+            "product_index.mentions", sum(len(products) for _, products in extracted)
+        )
+
+    def _add(self, record: Dict, product: Dict) -> None:
+        user_products = self._products.setdefault(
+            record["user_id"], collections.OrderedDict()
+        )
+        key = product_key(product["name"])
+        entry = user_products.get(key)
+        if entry is None:
+            entry = user_products[key] = {
+                "name": product["name"],
+                "brand": product["brand"],
+                "category": None,
+                "name_terms": set(),
+                "context_terms": set(),
+                "prices": [],
+                "urls": [],
+                "mentions": collections.OrderedDict(),
+                "mention_count": 0,
+                "conversation_ids": set(),
+                "tool_ids": set(),
+            }
+        if record["id"] in entry["mentions"]:
+            # a record passed to the listener again, e.g. by a re-run insert_records
+            return
+        epoch_ms = record_epoch_ms(record)
+        entry["mentions"][record["id"]] = epoch_ms
+        while len(entry["mentions"]) > _MAX_MENTIONS:
+            entry["mentions"].popitem(last=False)
+        entry["mention_count"] += 1
+        entry["category"] = entry["category"] or product["category"]
+        entry["name_terms"] = product_terms(entry)
+        if len(entry["context_terms"]) < _MAX_CONTEXT_TERMS:
+            entry["context_terms"] |= set(
+                sorted(product["terms"])[
+                    : _MAX_CONTEXT_TERMS - len(entry["context_terms"])
+                ]
+            )
+        for field, limit in (("prices", _MAX_PRICES), ("urls", _MAX_URLS)):
+            for value in product[field]:
+                if value in entry[field]:
+                    entry[field].remove(value)
+                entry[field].append(value)
+            del entry[field][:-limit]
+        entry["conversation_ids"].add(record["conversation_id"])
+        entry["tool_ids"].add(record["tool_id"] or record["data_type"])
+
+        if epoch_ms >= self._last_seen(entry):
+            user_products.move_to_end(key)
+        while len(user_products) > self.max_per_user:
+            user_products.popitem(last=False)
+
+    @staticmethod
+    def _last_seen(entry: Dict) -> int:
+        return max(entry["mentions"].values())
+
+    def find(
+        self,
+        user_id: str,
+        terms: Optional[Set[str]] = None,
+        since_ms: Optional[int] = None,
+        until_ms: Optional[int] = None,
+        limit: int = PRODUCT_LOOKUP_LIMIT,
+    ) -> List[Dict]:
+        """
+        Looks up a user's products, reading the user's records into the index on the first lookup.
+
+        Args:
+            user_id (str): The ID of the user.
+            terms (Set[str], optional): Only products whose name, category or mentioning sentences contain every
+                term, as returned by query_terms. Products matching more terms by name or category come first.
+            since_ms (int, optional): Only products mentioned at or after this time, in epoch milliseconds.
+            until_ms (int, optional): Only products mentioned before this time, in epoch milliseconds.
+            limit (int, optional): The most products returned. Defaults to PRODUCT_LOOKUP_LIMIT.
+
+        Returns:
+            List[Dict]: The products, most relevant then most recently mentioned first, each with its "name",
+            "brand", "category", recent "prices" and "urls" (most recent last), "first_seen_ms" and
+            "last_seen_ms" of its recent mentions, "mentions" count, "conversation_ids" and "tool_ids".
+        """
+        self.load_user(user_id)
+        terms = set(terms or ())
+        matches = []
+        with self._lock:
+            for entry in self._products.get(user_id, {}).values():
+                if not terms <= entry["name_terms"] | entry["context_terms"]:
+                    continue
+                seen = [
+                    epoch_ms
+                    for epoch_ms in entry["mentions"].values()
+                    if (since_ms is None or epoch_ms >= since_ms)
+                    and (until_ms is None or epoch_ms < until_ms)
+                ]
+                if not seen:
+                    continue
+                matches.append(
+                    (
+                        len(terms & entry["name_terms"]),
+                        max(seen),
+                        {
+                            "name": entry["name"],
+                            "brand": entry["brand"],
+                            "category": entry["category"],
+                            "prices": list(entry["prices"]),
+                            "urls": list(entry["urls"]),
+                            "first_seen_ms": min(entry["mentions"].values()),
+                            "last_seen_ms": self._last_seen(entry),
+                            "mentions": entry["mention_count"],
+                            "conversation_ids": sorted(entry["conversation_ids"]),
+                            "tool_ids": sorted(entry["tool_ids"]),
+                        },
+                    )
+                )
+        matches.sort(key=lambda match: (match[0], match[1]), reverse=True)
+        METRICS.increment("product_index.lookups")
+        return [product for _, _, product in matches[:limit]]
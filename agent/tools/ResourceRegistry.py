@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+from openai import OpenAI
+from agent.tools.PerplexityChat import PerplexityChat
+from agent.tools.RetentionManager import RetentionManager
+from agent.tools.UpstreamScheduler import UpstreamScheduler
+from agent.tools.UrlValidator import UrlValidator
+from agent.utils.database_utils import create_agent_database
+from agent.config import (
+    PPLX_MODEL,
+    HTTP_POOL_SIZE,
+    URL_VALIDATION_ENABLED,
+    RETENTION_ENABLED,
+    UPSTREAM_DEADLINE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceRegistry:
+    """
+    The clients, upstream scheduler, link validator, database and retention job a worker process shares between
+    its jobs.
+
+    Built in the worker's prewarm step, which runs while the process is idle and before it is assigned a job,
+    so a job starts with the database open and warm and the HTTP connection pools ready. Every job run by the
+    same process uses the same instances, which are safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        openai_api_key,
+        pplx_api_key,
+        database=None,
+        openai_base_url=None,
+        pplx_base_url=None,
+        pool_size=HTTP_POOL_SIZE,
+    ):
+        """
+        Creates the shared resources.
+
+        Args:
+            openai_api_key (str): API key for the OpenAI client used by the image tools.
+            pplx_api_key (str): API key for Perplexity.
+            database (optional): The conversation and tool use database. Defaults to create_agent_database().
+            openai_base_url (str, optional): Alternative OpenAI endpoint, e.g. a local stand-in. Defaults to None.
+            pplx_base_url (str, optional): Alternative Perplexity endpoint. Defaults to None.
+            pool_size (int, optional): Maximum pooled connections per upstream host. Defaults to HTTP_POOL_SIZE.
+        """
+        # the tools give up on a call at its deadline, but a blocking HTTP call keeps its worker thread and its
+        # scheduler slot until the transport times out, so the clients time out at the same deadline; a retry
+        # could only finish after the deadline, so the OpenAI client does not retry
+        self.images_model = OpenAI(
+            api_key=openai_api_key,
+            base_url=openai_base_url,
+            timeout=max(
+                UPSTREAM_DEADLINE_SECONDS[tool_id]
+                for tool_id in (
+                    "question_screenshot",
+                    "question_camera_image",
+                    "query_conversation_logs",
+                )
+            ),
+            max_retries=0,
+        )
+        self.web_model = PerplexityChat(
+            pplx_model=PPLX_MODEL,
+            pplx_api_key=pplx_api_key,
+            base_url=pplx_base_url,
+            pool_size=pool_size,
+            timeout_seconds=UPSTREAM_DEADLINE_SECONDS["search_the_web"],
+        )
+        self.database = database if database is not None else create_agent_database()
+        # queues and prioritises the upstream calls of every job in the process, within rate limits shared with
+        # the other worker processes on the host
+        self.scheduler = UpstreamScheduler()
+        # checks the links open_urls opens, with one connection pool for the process
+        self.url_validator = (
+            UrlValidator(pool_size=pool_size) if URL_VALIDATION_ENABLED else None
+        )
+        # purges expired records in the background, once per interval across every worker process; started by
+        # start_retention()
+        self.retention = RetentionManager(self.database) if RETENTION_ENABLED else None
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Creates the shared resources from the OPENAI_API_KEY and PPLX_API_KEY environment variables.
+
+        Returns:
+            ResourceRegistry: The resources.
+
+        Raises:
+            KeyError: If either environment variable is not set.
+        """
+        return cls(os.environ["OPENAI_API_KEY"], os.environ["PPLX_API_KEY"])
+
+    def warm(self):
+        """
+        Loads the database's indexes and caches, so the first request of the first job does not pay for them.
+        The schema catalog and the product index are not built here: they are filled on first use, so process
+        start-up does not grow with the database.
+
+        Returns:
+            float: The time taken in seconds.
+        """
+        start = time.perf_counter()
+        records = self.database.warm()
+        elapsed = time.perf_counter() - start
+        logger.info(f"Warmed database with {records} records in {elapsed:.3f}s")
+        return elapsed
+
+    def start_retention(self):
+        """Starts the retention job, if retention is enabled and it is not running yet."""
+        if self.retention is not None:
+            self.retention.start()
+
+    def close(self):
+        """Stops the scheduler and the retention job and closes the database and the HTTP connection pools."""
+        if self.retention is not None:
+            self.retention.close()
+        self.scheduler.close()
+        self.database.close()
+        self.web_model.close()
+        self.images_model.close()
+        if self.url_validator is not None:
+            self.url_validator.close()
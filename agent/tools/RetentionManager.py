@@ -0,0 +1,257 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from agent.config import (
+    RETENTION_BATCH_SIZE,
+    RETENTION_CHECK_SECONDS,
+    RETENTION_INTERVAL_SECONDS,
+    RETENTION_LOCK_STALE_SECONDS,
+    RETENTION_RULES,
+)
+from agent.utils.metrics_utils import METRICS, span
+
+logger = logging.getLogger(__name__)
+
+
+def retention_state_path(database):
+    """
+    Returns where the retention lock and last run of a database are kept: next to its file, or in its shard or
+    segment directory.
+
+    Args:
+        database: Any conversation database backend.
+
+    Returns:
+        str: The path, without the ".lock" or ".json" suffix.
+    """
+    directory = getattr(database, "segment_dir", None) or getattr(
+        database, "shard_dir", None
+    )
+    if directory is not None:
+        return os.path.join(directory, "retention")
+    return database.db_file + ".retention"
+
+
+class RetentionManager:
+    """
+    Enforces retention rules on an agent database and compacts it, as a periodic background job.
+
+    Each rule deletes the records of one data type and/or tool, or of one table, once they are older than its
+    max_age_days. The work runs in a daemon thread, in small batches, so the event loop and inserts from the
+    tools carry on while it runs. A worker process runs one manager for its shared database, owned by its
+    ResourceRegistry, rather than one per job.
+
+    Every worker process runs a manager, and job processes come and go, so the managers coordinate through
+    files next to the store: a run only starts while holding the lock file, and only if the last run recorded
+    in the state file is at least interval_seconds old. The store is purged, compacted and (for the segmented
+    backend) archived by one process at a time, once per interval however many processes there are.
+    """
+
+    def __init__(
+        self,
+        database,
+        rules=None,
+        interval_seconds=RETENTION_INTERVAL_SECONDS,
+        batch_size=RETENTION_BATCH_SIZE,
+        check_seconds=RETENTION_CHECK_SECONDS,
+        lock_stale_seconds=RETENTION_LOCK_STALE_SECONDS,
+        state_path=None,
+    ):
+        """
+        Initializes the manager. Call start() to begin the periodic job.
+
+        Args:
+            database (AgentDatabase | SQLiteAgentDatabase | ShardedAgentDatabase): The database to enforce rules on.
+            rules (list, optional): Dicts with "max_age_days" and either a "table" or optional "data_type" and
+                "tool_id" filters. A rule with max_age_days None keeps its records forever.
+                Defaults to RETENTION_RULES.
+            interval_seconds (float, optional): Seconds between runs, across all processes.
+                Defaults to RETENTION_INTERVAL_SECONDS.
+            batch_size (int, optional): Number of records deleted per write. Defaults to RETENTION_BATCH_SIZE.
+            check_seconds (float, optional): Seconds between checks of whether a run is due.
+                Defaults to RETENTION_CHECK_SECONDS.
+            lock_stale_seconds (float, optional): Age after which a lock file is taken to be left from a crashed
+                run. Defaults to RETENTION_LOCK_STALE_SECONDS.
+            state_path (str, optional): Path of the lock and state files, without suffix.
+                Defaults to retention_state_path(database).
+        """
+        self.db = database
+        self.rules = RETENTION_RULES if rules is None else rules
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.check_seconds = check_seconds
+        self.lock_stale_seconds = lock_stale_seconds
+        state_path = state_path or retention_state_path(database)
+        self.lock_path = state_path + ".lock"
+        self.state_path = state_path + ".json"
+        self.last_report = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def run_once(self, now=None):
+        """
+        Purges expired records for every rule, then compacts the database.
+
+        Args:
+            now (datetime.datetime, optional): The time ages are measured from. Defaults to the current time.
+
+        Returns:
+            dict: The number of records purged per rule, the "bytes_reclaimed" and the "purge_seconds" and
+            "compaction_seconds" durations.
+        """
+        now = now or datetime.datetime.now()
+        bytes_before = self.db.storage_bytes()
+
+        purged = {}
+        start = time.perf_counter()
+        with span("retention.purge"):
+            for rule in self.rules:
+                if rule.get("max_age_days") is None:
+                    continue
+                cutoff = now - datetime.timedelta(days=rule["max_age_days"])
+                if "table" in rule:
+                    purged[rule["table"]] = self.db.purge_table(
+                        rule["table"], str(cutoff), batch_size=self.batch_size
+                    )
+                else:
+                    name = "{}/{}".format(
+                        rule.get("data_type", "*"), rule.get("tool_id", "*")
+                    )
+                    purged[name] = self.db.purge_records(
+                        str(cutoff),
+                        data_type=rule.get("data_type"),
+                        tool_id=rule.get("tool_id"),
+                        batch_size=self.batch_size,
+                    )
+                self._refresh_lock()
+        purge_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with span("retention.compact"):
+            self.db.compact()
+        compaction_seconds = time.perf_counter() - start
+
+        report = {
+            "purged": purged,
+            "bytes_before": bytes_before,
+            "bytes_after": self.db.storage_bytes(),
+            "purge_seconds": purge_seconds,
+            "compaction_seconds": compaction_seconds,
+        }
+        report["bytes_reclaimed"] = max(0, bytes_before - report["bytes_after"])
+        logger.info(
+            f"Retention run purged {sum(purged.values())} records {purged}, "
+            f"reclaimed {report['bytes_reclaimed']} bytes, "
+            f"purge took {purge_seconds:.3f}s and compaction {compaction_seconds:.3f}s"
+        )
+        self.last_report = report
+        return report
+
+    def run_if_due(self, now=None, force=False):
+        """
+        Runs the rules if no other process is running them and the last run is at least interval_seconds old.
+
+        Args:
+            now (datetime.datetime, optional): The time ages are measured from. Defaults to the current time.
+            force (bool, optional): Run even if the last run is recent, e.g. from cron. Defaults to False.
+
+        Returns:
+            dict: The report of the run, see run_once, or None if another process holds the lock or the last
+            run is recent.
+        """
+        if not self._acquire_lock():
+            logger.info(f"Retention run skipped, {self.lock_path} is held")
+            METRICS.increment("retention.skipped_locked")
+            return None
+        try:
+            last_run = self.last_run()
+            if (
+                not force
+                and last_run is not None
+                and time.time() - last_run < self.interval_seconds
+            ):
+                return None
+            report = self.run_once(now)
+            self._write_state(report)
+            return report
+        finally:
+            self._release_lock()
+
+    def last_run(self):
+        """
+        Returns when the rules were last run on this store by any process.
+
+        Returns:
+            float: The end of the last run in seconds since the epoch, or None if there is no record of one.
+        """
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)["last_run"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _write_state(self, report):
+        with open(self.state_path + ".tmp", "w") as file:
+            json.dump({"last_run": time.time(), "report": report}, file)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _acquire_lock(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(self.lock_path)
+                except FileNotFoundError:
+                    continue
+                if age < self.lock_stale_seconds:
+                    return False
+                logger.info(f"Removing stale retention lock {self.lock_path}")
+                try:
+                    os.remove(self.lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as file:
+                file.write(str(os.getpid()))
+            return True
+        return False
+
+    def _refresh_lock(self):
+        # a long run keeps its lock from looking stale
+        try:
+            os.utime(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    def _release_lock(self):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_if_due()
+            except Exception as e:
+                logger.info(f"An error occurred during the retention run: {e}")
+            self._stop.wait(self.check_seconds)
+
+    def start(self):
+        """Starts the periodic job in a daemon thread, unless it is running. The first check is immediate."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="retention", daemon=True
+            )
+            self._thread.start()
+
+    def close(self):
+        """Stops the periodic job. A run already in progress finishes in the background."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
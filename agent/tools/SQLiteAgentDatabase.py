@@ -0,0 +1,1227 @@
+import collections
+import json
+import sqlite3
+import threading
+import uuid
+import datetime
+import logging
+import os
+from contextlib import contextmanager
+from agent.utils.database_utils import PURGEABLE_TABLES, notify_listeners
+from agent.utils.metrics_utils import timed
+from agent.utils.search_utils import (
+    WEB_SEARCH_FIELDS,
+    build_web_search_record,
+    citation_rows,
+)
+from agent.utils.time_utils import record_epoch_ms, timestamp_to_epoch_ms, to_epoch_ms
+from agent.utils.url_utils import canonicalize_url
+from agent.utils.usage_utils import (
+    USAGE_TOTAL_FIELDS,
+    estimate_cost,
+    usage_aggregate_keys,
+)
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = [
+    "id",
+    "timestamp",
+    "timestamp_ms",
+    "user_id",
+    "conversation_id",
+    "tool_id",
+    "data_type",
+    "data",
+]
+USAGE_FIELDS = [
+    "id",
+    "timestamp",
+    "user_id",
+    "conversation_id",
+    "tool_id",
+    "model",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "cost_usd",
+]
+# rows search() reads per batch, each batch holding the connection lock
+SEARCH_FETCH_SIZE = 1000
+# the Python type each SQLite storage class is read back as, for field_statistics
+_PYTHON_TYPE_NAMES = {
+    "text": "str",
+    "integer": "int",
+    "real": "float",
+    "blob": "bytes",
+    "null": "NoneType",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    timestamp_ms INTEGER,
+    user_id TEXT,
+    conversation_id TEXT,
+    tool_id TEXT,
+    data_type TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_records_user ON records (user_id, data_type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_records_user_cursor ON records (user_id);
+CREATE INDEX IF NOT EXISTS idx_records_conversation ON records (conversation_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records (timestamp);
+
+CREATE TABLE IF NOT EXISTS usage (
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    user_id TEXT,
+    conversation_id TEXT,
+    tool_id TEXT,
+    model TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_user ON usage (user_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS usage_aggregates (
+    scope TEXT NOT NULL,
+    key TEXT,
+    requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+CREATE TABLE IF NOT EXISTS web_searches (
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    timestamp_ms INTEGER NOT NULL,
+    user_id TEXT,
+    conversation_id TEXT,
+    question TEXT,
+    answer TEXT,
+    citations TEXT NOT NULL,
+    model TEXT,
+    status INTEGER,
+    latency_ms REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_web_searches_user ON web_searches (user_id, timestamp_ms);
+
+CREATE TABLE IF NOT EXISTS citations (
+    search_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    canonical_url TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    PRIMARY KEY (search_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_citations_url ON citations (canonical_url);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5 (
+    data, content='records', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS records_fts_insert AFTER INSERT ON records
+WHEN new.data_type IS NOT 'image' AND new.data IS NOT NULL BEGIN
+    INSERT INTO records_fts (rowid, data) VALUES (new.rowid, new.data);
+END;
+CREATE TRIGGER IF NOT EXISTS records_fts_delete AFTER DELETE ON records
+WHEN old.data_type IS NOT 'image' AND old.data IS NOT NULL BEGIN
+    INSERT INTO records_fts (records_fts, rowid, data) VALUES ('delete', old.rowid, old.data);
+END;
+"""
+
+
+class SQLiteAgentDatabase:
+    """
+    A SQLite implementation of the AgentDatabase interface that is safe to share between processes.
+
+    The database runs in WAL mode, so readers never block the single writer, and every write is a short
+    IMMEDIATE transaction that waits on SQLite's file lock instead of overwriting other processes' data.
+    Text records are indexed in an FTS5 table for keyword search.
+    """
+
+    def __init__(
+        self,
+        db_file="agent_db.sqlite3",
+        busy_timeout_ms=10000,
+        read_only=False,
+        mmap_size=0,
+    ):
+        """
+        Initializes the database connection and creates the schema if needed.
+
+        Args:
+            db_file (str, optional): Path to the SQLite database file. Defaults to "agent_db.sqlite3".
+            busy_timeout_ms (int, optional): How long a write waits for another process's lock. Defaults to 10000.
+            read_only (bool, optional): Open an archived file as immutable and read-only, which skips all
+                locking. The file must not be modified while it is open this way. Defaults to False.
+            mmap_size (int, optional): Bytes of the file to memory-map for reads; 0 disables it. Defaults to 0.
+        """
+        self.db_file = db_file
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._listeners = []
+        if read_only:
+            self.conn = sqlite3.connect(
+                f"file:{db_file}?mode=ro&immutable=1",
+                uri=True,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+        else:
+            self.conn = sqlite3.connect(
+                self.db_file,
+                timeout=busy_timeout_ms / 1000,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+        self.conn.row_factory = sqlite3.Row
+        if mmap_size:
+            self.conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        if read_only:
+            self.fts_enabled = self._table_exists("records_fts")
+            return
+
+        self.conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        # auto_vacuum only takes effect on a new file, before any table is created
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        with self._transaction():
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    self.conn.execute(statement)
+        self._backfill_timestamp_ms()
+        self.fts_enabled = self._create_fts()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs the enclosed statements in a single IMMEDIATE transaction, holding the connection lock.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _table_exists(self, name):
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+            ).fetchone()
+            is not None
+        )
+
+    def _backfill_timestamp_ms(self):
+        """
+        Adds the epoch-millisecond timestamp column to files created before it existed, and fills it in for
+        records that do not have it yet.
+        """
+        with self._transaction() as conn:
+            columns = [
+                row["name"] for row in conn.execute("PRAGMA table_info(records)")
+            ]
+            if "timestamp_ms" not in columns:
+                conn.execute("ALTER TABLE records ADD COLUMN timestamp_ms INTEGER")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_records_timestamp_ms "
+                "ON records (timestamp_ms)"
+            )
+            conn.create_function(
+                "epoch_ms", 1, timestamp_to_epoch_ms, deterministic=True
+            )
+            conn.execute(
+                "UPDATE records SET timestamp_ms = epoch_ms(timestamp) "
+                "WHERE timestamp_ms IS NULL"
+            )
+
+    def _create_fts(self):
+        """
+        Creates the FTS5 index over text records, if this SQLite build supports FTS5.
+
+        Returns:
+            bool: Whether full-text search is available.
+        """
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+            return True
+        except sqlite3.OperationalError as e:
+            logger.info(f"Full-text search unavailable, falling back to LIKE: {e}")
+            return False
+
+    def add_listener(self, listener):
+        """
+        Registers a callback that is called with the list of records after every successful store_image,
+        store_text or insert_records, in the writing thread. Only writes made through this instance are seen.
+
+        Args:
+            listener (Callable): Called with a list of record dicts.
+        """
+        self._listeners.append(listener)
+
+    def _generate_unique_id(self):
+        """Generates a unique ID using UUID.
+
+        Returns:
+            str: A unique UUID string.
+        """
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def _to_dict(row):
+        return dict(row) if row is not None else None
+
+    @staticmethod
+    def _columns(fields):
+        """
+        Returns the column list for a projection, checking the fields are record fields.
+
+        Raises:
+            ValueError: If a field is not a record field.
+        """
+        if fields is None:
+            return ", ".join(RECORD_FIELDS)
+        unknown = [field for field in fields if field not in RECORD_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown record fields: {unknown}")
+        return ", ".join(fields)
+
+    def _insert(self, data):
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    f"INSERT INTO records ({', '.join(RECORD_FIELDS)}) "
+                    f"VALUES ({', '.join('?' * len(RECORD_FIELDS))})",
+                    [data[field] for field in RECORD_FIELDS],
+                )
+            logger.info(f"Data stored with ID: {data['id']}")
+        except Exception as e:
+            logger.info(f"An error occurred during the store: {e}")
+            return None
+        notify_listeners(self._listeners, [data])
+        return data["id"]
+
+    @timed("db.store_image")
+    def store_image(self, user_id, conversation_id, tool_id, image_data):
+        """
+        Stores image data in the database.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            tool_id (str): The ID of the tool used to generate the image.
+            image_data (str): The base64 encoded image data to store.
+
+        Returns:
+            str: The unique ID of the stored image data, or None if storage failed.
+        """
+        now = datetime.datetime.now()
+        return self._insert(
+            {
+                "id": self._generate_unique_id(),
+                "timestamp": str(now),
+                "timestamp_ms": to_epoch_ms(now),
+                "user_id": user_id,
+                "conversation_id": conversation_id,
+                "tool_id": tool_id,
+                "data_type": "image",
+                "data": image_data,
+            }
+        )
+
+    @timed("db.store_text")
+    def store_text(self, user_id, conversation_id, tool_id, data_type, text_data):
+        """
+        Stores text data in the database.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            tool_id (str): The ID of the tool used to generate the text.
+            data_type (str): The type of text data (e.g., "query", "response").
+            text_data (str): The text data to store.
+
+        Returns:
+            str: The unique ID of the stored text data, or None if storage failed.
+        """
+        now = datetime.datetime.now()
+        return self._insert(
+            {
+                "id": self._generate_unique_id(),
+                "timestamp": str(now),
+                "timestamp_ms": to_epoch_ms(now),
+                "user_id": user_id,
+                "conversation_id": conversation_id,
+                "tool_id": tool_id,
+                "data_type": data_type,
+                "data": text_data,
+            }
+        )
+
+    @timed("db.insert_records")
+    def insert_records(self, records):
+        """
+        Inserts already-built records in a single transaction, skipping IDs that are already stored.
+
+        Args:
+            records (Iterable[dict]): Records with the standard fields ("id", "timestamp", "user_id", ...).
+
+        Returns:
+            int: The number of records inserted.
+        """
+        records = list(records)
+        with self._transaction() as conn:
+            cursor = conn.executemany(
+                f"INSERT OR IGNORE INTO records ({', '.join(RECORD_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(RECORD_FIELDS))})",
+                (
+                    [
+                        (
+                            record_epoch_ms(record)
+                            if field == "timestamp_ms"
+                            else record.get(field)
+                        )
+                        for field in RECORD_FIELDS
+                    ]
+                    for record in records
+                ),
+            )
+            inserted = cursor.rowcount
+        # records whose ID was already stored are passed on too; listeners must tolerate seeing a record twice
+        notify_listeners(self._listeners, records)
+        return inserted
+
+    @timed("db.store_usage")
+    def store_usage(
+        self,
+        user_id,
+        conversation_id,
+        tool_id,
+        model,
+        prompt_tokens,
+        completion_tokens,
+        total_tokens,
+        cost_usd=None,
+    ):
+        """
+        Stores a structured token usage record and updates the running usage aggregates in the same transaction.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            tool_id (str): The ID of the tool that made the model request.
+            model (str): The model that served the request.
+            prompt_tokens (int): Number of input tokens.
+            completion_tokens (int): Number of output tokens.
+            total_tokens (int): Total number of tokens.
+            cost_usd (float, optional): The cost of the request. Estimated from MODEL_PRICING if not given.
+
+        Returns:
+            str: The unique ID of the stored usage record, or None if storage failed.
+        """
+        if cost_usd is None:
+            cost_usd = estimate_cost(model, prompt_tokens, completion_tokens)
+        data = {
+            "id": self._generate_unique_id(),
+            "timestamp": str(datetime.datetime.now()),
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "tool_id": tool_id,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cost_usd": cost_usd,
+        }
+        try:
+            with self._transaction() as conn:
+                self._insert_usage(conn, data)
+            logger.info(f"Usage stored with ID: {data['id']}")
+            return data["id"]
+        except Exception as e:
+            logger.info(f"An error occurred during the store: {e}")
+            return None
+
+    @timed("db.insert_usage_records")
+    def insert_usage_records(self, records):
+        """
+        Inserts already-built usage records and adds them to the running aggregates, skipping IDs that are
+        already stored.
+
+        Args:
+            records (Iterable[dict]): Usage records, as returned by all_usage().
+
+        Returns:
+            int: The number of usage records inserted.
+        """
+        inserted = 0
+        with self._transaction() as conn:
+            for record in records:
+                exists = conn.execute(
+                    "SELECT 1 FROM usage WHERE id = ?", (record["id"],)
+                ).fetchone()
+                if not exists:
+                    self._insert_usage(conn, record)
+                    inserted += 1
+        return inserted
+
+    def all_usage(self):
+        """
+        Retrieves every usage record, in insertion order.
+
+        Returns:
+            list: All usage dictionaries.
+        """
+        with self._lock:
+            return [
+                dict(row)
+                for row in self.conn.execute(
+                    f"SELECT {', '.join(USAGE_FIELDS)} FROM usage ORDER BY rowid"
+                )
+            ]
+
+    @staticmethod
+    def _insert_usage(conn, data):
+        conn.execute(
+            f"INSERT INTO usage ({', '.join(USAGE_FIELDS)}) "
+            f"VALUES ({', '.join('?' * len(USAGE_FIELDS))})",
+            [data[field] for field in USAGE_FIELDS],
+        )
+        conn.executemany(
+            """
+            INSERT INTO usage_aggregates
+                (scope, key, requests, prompt_tokens, completion_tokens, total_tokens, cost_usd)
+            VALUES (?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (scope, key) DO UPDATE SET
+                requests = requests + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                total_tokens = total_tokens + excluded.total_tokens,
+                cost_usd = cost_usd + excluded.cost_usd
+            """,
+            [
+                (
+                    scope,
+                    key,
+                    data["prompt_tokens"],
+                    data["completion_tokens"],
+                    data["total_tokens"],
+                    data["cost_usd"],
+                )
+                for scope, key in usage_aggregate_keys(
+                    data["user_id"],
+                    data["conversation_id"],
+                    data["tool_id"],
+                    data["timestamp"],
+                )
+            ],
+        )
+
+    def get_usage_totals(self, scope, key):
+        """
+        Retrieves the running usage aggregate for a user, conversation, tool or day.
+
+        Args:
+            scope (str): One of "user", "conversation", "tool" or "day".
+            key (str): The user ID, conversation ID, tool ID or date ("YYYY-MM-DD").
+
+        Returns:
+            dict: The "requests", "prompt_tokens", "completion_tokens", "total_tokens" and "cost_usd" totals.
+            All totals are zero if nothing has been recorded.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(USAGE_TOTAL_FIELDS)} FROM usage_aggregates "
+                "WHERE scope = ? AND key IS ?",
+                (scope, key),
+            ).fetchone()
+        if row is None:
+            return {field: 0 for field in USAGE_TOTAL_FIELDS} | {"cost_usd": 0.0}
+        return dict(row)
+
+    @timed("db.store_web_search")
+    def store_web_search(
+        self,
+        user_id,
+        conversation_id,
+        question,
+        answer,
+        citations,
+        model=None,
+        status=None,
+        latency_ms=None,
+        usage=None,
+    ):
+        """
+        Stores a structured web search and indexes its citations in the same transaction.
+        See AgentDatabase.store_web_search.
+
+        Returns:
+            str: The unique ID of the stored web search, or None if storage failed.
+        """
+        data = build_web_search_record(
+            user_id,
+            conversation_id,
+            question,
+            answer,
+            citations,
+            model=model,
+            status=status,
+            latency_ms=latency_ms,
+            usage=usage,
+        )
+        try:
+            with self._transaction() as conn:
+                self._insert_web_search(conn, data)
+            logger.info(f"Web search stored with ID: {data['id']}")
+            return data["id"]
+        except Exception as e:
+            logger.info(f"An error occurred during the store: {e}")
+            return None
+
+    @timed("db.insert_web_search_records")
+    def insert_web_search_records(self, records):
+        """
+        Inserts already-built web search records, skipping IDs that are already stored.
+
+        Args:
+            records (Iterable[dict]): Web search records, as returned by all_web_searches().
+
+        Returns:
+            int: The number of web searches inserted.
+        """
+        inserted = 0
+        with self._transaction() as conn:
+            for record in records:
+                exists = conn.execute(
+                    "SELECT 1 FROM web_searches WHERE id = ?", (record["id"],)
+                ).fetchone()
+                if not exists:
+                    self._insert_web_search(conn, record)
+                    inserted += 1
+        return inserted
+
+    def all_web_searches(self):
+        """
+        Retrieves every web search record, in insertion order.
+
+        Returns:
+            list: All web search dictionaries.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(WEB_SEARCH_FIELDS)} FROM web_searches ORDER BY rowid"
+            ).fetchall()
+        return [self._web_search_to_dict(row) for row in rows]
+
+    @staticmethod
+    def _web_search_to_dict(row):
+        data = dict(row)
+        data["citations"] = json.loads(data["citations"])
+        return data
+
+    @staticmethod
+    def _insert_web_search(conn, data):
+        conn.execute(
+            f"INSERT INTO web_searches ({', '.join(WEB_SEARCH_FIELDS)}) "
+            f"VALUES ({', '.join('?' * len(WEB_SEARCH_FIELDS))})",
+            [
+                json.dumps(data[field]) if field == "citations" else data[field]
+                for field in WEB_SEARCH_FIELDS
+            ],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO citations "
+            "(search_id, position, url, canonical_url, domain) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    row["search_id"],
+                    row["position"],
+                    row["url"],
+                    row["canonical_url"],
+                    row["domain"],
+                )
+                for row in citation_rows(data)
+            ],
+        )
+
+    @timed("db.find_citations")
+    def find_citations(self, user_id, terms=None, url=None, limit=50):
+        """
+        Looks up the pages cited by a user's web searches, newest search first, through the citation index.
+        See AgentDatabase.find_citations.
+
+        Returns:
+            list: One dictionary per citation.
+        """
+        conditions = ["s.user_id = ?"]
+        parameters = [user_id]
+        if url is not None:
+            conditions.append("c.canonical_url = ?")
+            parameters.append(canonicalize_url(url))
+        for term in sorted(terms or []):
+            # LIKE ignores case for ASCII, as the other backends do
+            pattern = (
+                "%"
+                + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                + "%"
+            )
+            conditions.append(
+                "(s.question LIKE ? ESCAPE '\\' OR s.answer LIKE ? ESCAPE '\\')"
+            )
+            parameters.extend([pattern, pattern])
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT c.url, c.domain, c.position, s.id AS search_id, s.question, s.answer, "
+                "s.conversation_id, s.timestamp "
+                "FROM web_searches s JOIN citations c ON c.search_id = s.id "
+                f"WHERE {' AND '.join(conditions)} "
+                "ORDER BY s.timestamp_ms DESC, s.rowid DESC, c.position LIMIT ?",
+                parameters + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    @timed("db.get_data_by_message_id")
+    def get_data_by_message_id(self, unique_id):
+        """
+        Retrieves data by unique ID.
+
+        Args:
+            unique_id (str): The unique ID of the data to retrieve.
+
+        Returns:
+            dict: The data dictionary if found, None otherwise.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(RECORD_FIELDS)} FROM records WHERE id = ?",
+                (unique_id,),
+            ).fetchone()
+        if row is None:
+            logger.info(f"No data found with ID: {unique_id}")
+        return self._to_dict(row)
+
+    @timed("db.get_data_by_user_id")
+    def get_data_by_user_id(self, user_id, remove_image_data=True, fields=None):
+        """
+        Retrieves data by user ID.
+
+        Args:
+            user_id (str): The ID of the user.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            fields (list, optional): Only return these fields of each record, e.g. CONVERSATION_FIELDS.
+                Defaults to None (all fields).
+
+        Returns:
+            list: A list of data dictionaries associated with the user ID.  Returns an empty list if no data is found.
+        """
+        query = f"SELECT {self._columns(fields)} FROM records WHERE user_id = ?"
+        if remove_image_data:
+            query += " AND data_type IS NOT 'image'"
+        with self._lock:
+            result = [
+                dict(row)
+                for row in self.conn.execute(query + " ORDER BY rowid", (user_id,))
+            ]
+        if not result:
+            logger.info(f"No data found with user ID: {user_id}")
+        return result
+
+    @timed("db.get_page_by_user_id")
+    def get_page_by_user_id(
+        self, user_id, cursor=None, limit=100, remove_image_data=True, fields=None
+    ):
+        """
+        Retrieves one page of a user's records, in insertion order. Pages are read by keyset on the rowid,
+        so each page costs the same however deep into the history it is.
+
+        Args:
+            user_id (str): The ID of the user.
+            cursor (int, optional): The cursor returned with the previous page. Defaults to None (first page).
+            limit (int, optional): Maximum number of records in the page. Defaults to 100.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            fields (list, optional): Only return these fields of each record. Defaults to None (all fields).
+
+        Returns:
+            tuple: The list of data dictionaries and the cursor of the next page, or None after the last page.
+        """
+        query = (
+            f"SELECT rowid, {self._columns(fields)} FROM records "
+            "WHERE user_id = ? AND rowid > ?"
+        )
+        if remove_image_data:
+            query += " AND data_type IS NOT 'image'"
+        with self._lock:
+            rows = self.conn.execute(
+                query + " ORDER BY rowid LIMIT ?", (user_id, cursor or 0, limit)
+            ).fetchall()
+        page = [{key: row[key] for key in row.keys()[1:]} for row in rows]
+        next_cursor = rows[-1]["rowid"] if len(rows) == limit else None
+        return page, next_cursor
+
+    def iter_data_by_user_id(
+        self, user_id, remove_image_data=True, fields=None, batch_size=500
+    ):
+        """
+        Streams a user's records page by page, so only one page is held in memory at a time.
+
+        Args:
+            user_id (str): The ID of the user.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            fields (list, optional): Only return these fields of each record. Defaults to None (all fields).
+            batch_size (int, optional): Number of records read per page. Defaults to 500.
+
+        Yields:
+            dict: The user's records, in insertion order.
+        """
+        cursor = None
+        while True:
+            page, cursor = self.get_page_by_user_id(
+                user_id, cursor, batch_size, remove_image_data, fields
+            )
+            yield from page
+            if cursor is None:
+                return
+
+    @timed("db.get_data_by_time_range")
+    def get_data_by_time_range(
+        self,
+        start,
+        end=None,
+        user_id=None,
+        remove_image_data=True,
+        image_payloads=True,
+    ):
+        """
+        Retrieves the records stored in a time range, using the epoch-millisecond timestamp index.
+
+        Args:
+            start (int | str | datetime.datetime): Start of the range (inclusive), as epoch milliseconds, a
+                timestamp string or a datetime.
+            end (int | str | datetime.datetime, optional): End of the range (exclusive). Defaults to None (now).
+            user_id (str, optional): Restrict the results to one user. Defaults to None.
+            remove_image_data (bool, optional): Whether to exclude image data from the results. Defaults to True.
+            image_payloads (bool, optional): Whether included image records keep their data. If False, their
+                data is None and every record gets the length of its data as "data_chars", so payloads are never
+                returned. Defaults to True.
+
+        Returns:
+            list: The matching data dictionaries, oldest first.
+        """
+        columns = RECORD_FIELDS
+        if not image_payloads:
+            columns = [
+                (
+                    "CASE WHEN data_type IS 'image' THEN NULL ELSE data END AS data"
+                    if field == "data"
+                    else field
+                )
+                for field in RECORD_FIELDS
+            ] + ["length(data) AS data_chars"]
+        query = (
+            f"SELECT {', '.join(columns)} FROM records "
+            "WHERE timestamp_ms >= ? AND timestamp_ms < ?"
+        )
+        parameters = [
+            to_epoch_ms(start),
+            to_epoch_ms(end if end is not None else datetime.datetime.now()),
+        ]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            parameters.append(user_id)
+        if remove_image_data:
+            query += " AND data_type IS NOT 'image'"
+        with self._lock:
+            return [
+                dict(row)
+                for row in self.conn.execute(
+                    query + " ORDER BY timestamp_ms, rowid", parameters
+                )
+            ]
+
+    @timed("db.delete_data")
+    def delete_data(self, unique_id):
+        """
+        Deletes data by unique ID.
+
+        Args:
+            unique_id (str): The unique ID of the data to delete.
+        """
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM records WHERE id = ?", (unique_id,)
+            ).rowcount
+        if deleted:
+            logger.info(f"Data with ID {unique_id} deleted.")
+        else:
+            logger.info(f"Data with ID {unique_id} not found, deletion skipped.")
+
+    @timed("db.search_text")
+    def search_text(self, text, user_id=None, limit=50):
+        """
+        Finds text records containing the given words, using the FTS5 index when available.
+
+        Args:
+            text (str): The words to search for.
+            user_id (str, optional): Restrict the search to one user. Defaults to None.
+            limit (int, optional): Maximum number of records to return. Defaults to 50.
+
+        Returns:
+            list: Matching data dictionaries, best matches first when FTS5 is available. Empty if the text has no
+            words, which FTS5 cannot match.
+        """
+        words = text.split()
+        if not words:
+            return []
+        columns = ", ".join(f"records.{field}" for field in RECORD_FIELDS)
+        if self.fts_enabled:
+            terms = " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+            query = (
+                f"SELECT {columns} FROM records_fts "
+                "JOIN records ON records.rowid = records_fts.rowid "
+                "WHERE records_fts MATCH ?"
+            )
+            parameters = [terms]
+        else:
+            query = (
+                f"SELECT {columns} FROM records "
+                "WHERE data_type IS NOT 'image' AND data LIKE ?"
+            )
+            parameters = [f"%{text}%"]
+        if user_id is not None:
+            query += " AND records.user_id = ?"
+            parameters.append(user_id)
+        query += " ORDER BY rank LIMIT ?" if self.fts_enabled else " LIMIT ?"
+        parameters.append(limit)
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(query, parameters)]
+
+    def all(self):
+        """
+        Retrieves every record, in insertion order.
+
+        Returns:
+            list: All data dictionaries.
+        """
+        with self._lock:
+            return [
+                dict(row)
+                for row in self.conn.execute(
+                    f"SELECT {', '.join(RECORD_FIELDS)} FROM records ORDER BY rowid"
+                )
+            ]
+
+    @timed("db.field_statistics")
+    def field_statistics(self, option_fields):
+        """
+        Summarizes the stored records' fields in one grouped query: the types each column holds and how often
+        each value of the option fields occurs. typeof() does not read the data column's contents, so image
+        payloads are never loaded.
+
+        Args:
+            option_fields (list): Fields whose values are counted.
+
+        Returns:
+            dict: The statistics. See AgentDatabase.field_statistics.
+
+        Raises:
+            ValueError: If an option field is not a record field.
+        """
+        self._columns(option_fields)
+        groups = [f"typeof({field})" for field in RECORD_FIELDS] + list(option_fields)
+        query = (
+            f"SELECT {', '.join(groups)}, COUNT(*) FROM records "
+            f"GROUP BY {', '.join(str(position) for position in range(1, len(groups) + 1))}"
+        )
+        with self._lock:
+            rows = self.conn.execute(query).fetchall()
+        types = {}
+        options = {field: collections.Counter() for field in option_fields}
+        for row in rows:
+            for field, storage_class in zip(RECORD_FIELDS, row):
+                types.setdefault(field, set()).add(_PYTHON_TYPE_NAMES[storage_class])
+            for field, value in zip(option_fields, row[len(RECORD_FIELDS) : -1]):
+                options[field][value] += row[-1]
+        return {"types": types, "options": options}
+
+    def search(self, query):
+        """
+        Runs a TinyDB-style query over the stored records, so queries written by the LLM for TinyDB
+        work unchanged against this backend.
+
+        Args:
+            query (Callable[[dict], bool]): A tinydb.Query condition, or any predicate over a record dict.
+
+        Returns:
+            list: The matching data dictionaries, in insertion order. Image records are matched and returned
+            without their data, so image payloads are never read.
+        """
+        # the rows are fetched in batches and matched outside the lock, so writers are not held up by the scan
+        columns = ", ".join(
+            (
+                "CASE WHEN data_type IS 'image' THEN NULL ELSE data END AS data"
+                if field == "data"
+                else field
+            )
+            for field in RECORD_FIELDS
+        )
+        matches = []
+        with self._lock:
+            cursor = self.conn.execute(f"SELECT {columns} FROM records ORDER BY rowid")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(SEARCH_FETCH_SIZE)
+            if not rows:
+                return matches
+            matches.extend(record for record in map(dict, rows) if query(record))
+
+    @timed("db.purge_records")
+    def purge_records(self, cutoff, data_type=None, tool_id=None, batch_size=500):
+        """
+        Deletes records older than a cutoff, one short transaction per batch, so writers in this and other
+        processes get the lock between batches.
+
+        Args:
+            cutoff (str): Records with an earlier timestamp are deleted (same format as the stored timestamps).
+            data_type (str, optional): Only delete records of this data type. Defaults to None (any).
+            tool_id (str, optional): Only delete records from this tool. Defaults to None (any).
+            batch_size (int, optional): Number of records deleted per transaction. Defaults to 500.
+
+        Returns:
+            int: The number of records deleted.
+        """
+        condition, parameters = self._expiry_condition(cutoff, data_type, tool_id)
+        purged = 0
+        while True:
+            with self._transaction() as conn:
+                deleted = conn.execute(
+                    "DELETE FROM records WHERE rowid IN "
+                    f"(SELECT rowid FROM records WHERE {condition} LIMIT ?)",
+                    parameters + [batch_size],
+                ).rowcount
+            purged += deleted
+            if deleted < batch_size:
+                break
+        if purged:
+            logger.info(f"Purged {purged} records older than {cutoff}")
+        return purged
+
+    @timed("db.purge_table")
+    def purge_table(self, table, cutoff, batch_size=500):
+        """
+        Deletes web search or usage records older than a cutoff, one short transaction per batch. A web search's
+        citations are deleted with it. Usage aggregates are kept, so totals still include the purged records.
+
+        Args:
+            table (str): "web_searches" or "usage".
+            cutoff (str): Records with an earlier timestamp are deleted (same format as the stored timestamps).
+            batch_size (int, optional): Number of records deleted per transaction. Defaults to 500.
+
+        Returns:
+            int: The number of records deleted.
+
+        Raises:
+            ValueError: If the table is not a purgeable table.
+        """
+        if table not in PURGEABLE_TABLES:
+            raise ValueError(f"Cannot purge table: {table}")
+        purged = 0
+        while True:
+            with self._transaction() as conn:
+                ids = [
+                    row[0]
+                    for row in conn.execute(
+                        f"SELECT id FROM {table} WHERE timestamp < ? LIMIT ?",
+                        (cutoff, batch_size),
+                    )
+                ]
+                placeholders = ", ".join("?" * len(ids))
+                if ids and table == "web_searches":
+                    conn.execute(
+                        f"DELETE FROM citations WHERE search_id IN ({placeholders})",
+                        ids,
+                    )
+                if ids:
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE id IN ({placeholders})", ids
+                    )
+            purged += len(ids)
+            if len(ids) < batch_size:
+                break
+        if purged:
+            logger.info(f"Purged {purged} {table} records older than {cutoff}")
+        return purged
+
+    def count_expired(self, cutoff, data_type=None, tool_id=None):
+        """
+        Counts the records purge_records would delete, without writing. Works on read-only files.
+
+        Args:
+            cutoff (str): Records with an earlier timestamp are counted.
+            data_type (str, optional): Only count records of this data type. Defaults to None (any).
+            tool_id (str, optional): Only count records from this tool. Defaults to None (any).
+
+        Returns:
+            int: The number of expired records.
+        """
+        condition, parameters = self._expiry_condition(cutoff, data_type, tool_id)
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT COUNT(*) FROM records WHERE {condition}", parameters
+            ).fetchone()[0]
+
+    @staticmethod
+    def _expiry_condition(cutoff, data_type, tool_id):
+        condition = "timestamp < ?"
+        parameters = [cutoff]
+        if data_type is not None:
+            condition += " AND data_type = ?"
+            parameters.append(data_type)
+        if tool_id is not None:
+            condition += " AND tool_id = ?"
+            parameters.append(tool_id)
+        return condition, parameters
+
+    def seal(self):
+        """
+        Prepares the file to be archived: compacts it and switches it out of WAL mode, so that it can be
+        opened read-only and immutable afterwards. Close the database after sealing it.
+
+        Returns:
+            dict: The number of "records" and their "min_timestamp_ms" and "max_timestamp_ms".
+        """
+        self.compact()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), MIN(timestamp_ms), MAX(timestamp_ms) FROM records"
+            ).fetchone()
+            self.conn.execute("PRAGMA journal_mode = DELETE")
+        return {
+            "records": row[0],
+            "min_timestamp_ms": row[1],
+            "max_timestamp_ms": row[2],
+        }
+
+    @timed("db.compact")
+    def compact(self, pages_per_step=1000):
+        """
+        Returns free pages to the file system with incremental vacuum steps, then truncates the WAL.
+
+        Each step is its own short transaction, so inserts are only held up for one step at a time, unlike
+        a full VACUUM which rewrites the whole file under an exclusive lock.
+
+        Args:
+            pages_per_step (int, optional): Number of free pages released per transaction. Defaults to 1000.
+
+        Returns:
+            int: The number of pages released.
+        """
+        released = 0
+        while True:
+            with self._lock:
+                free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages:
+                break
+            with self._transaction() as conn:
+                # each step of the statement releases one page, so it has to be run to completion
+                conn.execute(
+                    f"PRAGMA incremental_vacuum({int(pages_per_step)})"
+                ).fetchall()
+            with self._lock:
+                remaining = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free_pages:
+                logger.info(
+                    f"Incremental vacuum is not enabled for {self.db_file}, skipping"
+                )
+                break
+            released += free_pages - remaining
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return released
+
+    def warm(self):
+        """
+        Compiles the schema and reads the record and usage indexes into SQLite's page cache, so the first
+        request of a job does not pay for them.
+
+        Returns:
+            int: The number of records.
+        """
+        with self._lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            self.conn.execute("SELECT COUNT(*) FROM usage_aggregates").fetchone()
+        return count
+
+    def storage_bytes(self):
+        """
+        Returns the size of the database on disk.
+
+        Returns:
+            int: The size of the database file and its WAL and shared-memory files in bytes.
+        """
+        return sum(
+            os.path.getsize(self.db_file + suffix)
+            for suffix in ("", "-wal", "-shm")
+            if os.path.exists(self.db_file + suffix)
+        )
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self.conn.close()
+
+
+def migrate_tinydb_to_sqlite(tinydb_file, sqlite_file, batch_size=5000):
+    """
+    Copies records, usage history and web searches from a TinyDB AgentDatabase file into a SQLiteAgentDatabase.
+
+    Records that already exist in the target (by ID) are skipped, so the migration can be re-run safely.
+    Usage aggregates are rebuilt from the migrated usage records.
+
+    Args:
+        tinydb_file (str): Path to the existing TinyDB JSON file.
+        sqlite_file (str): Path to the SQLite database to create or extend.
+        batch_size (int, optional): Number of records inserted per transaction. Defaults to 5000.
+
+    Returns:
+        dict: The number of "records", "usage" and "web_searches" rows migrated.
+    """
+    import tinydb
+
+    source = tinydb.TinyDB(tinydb_file)
+    target = SQLiteAgentDatabase(sqlite_file)
+    migrated = {"records": 0, "usage": 0, "web_searches": 0}
+
+    batch = []
+    for record in source.all():
+        batch.append(record)
+        if len(batch) >= batch_size:
+            migrated["records"] += target.insert_records(batch)
+            batch = []
+    if batch:
+        migrated["records"] += target.insert_records(batch)
+
+    migrated["usage"] = target.insert_usage_records(source.table("usage").all())
+    migrated["web_searches"] = target.insert_web_search_records(
+        source.table("web_searches").all()
+    )
+
+    source.close()
+    target.close()
+    logger.info(f"Migrated {migrated} from {tinydb_file} to {sqlite_file}")
+    return migrated
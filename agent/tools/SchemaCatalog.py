@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+from agent.utils.metrics_utils import METRICS
+from agent.config import (
+    SCHEMA_CATALOG_REFRESH_SECONDS,
+    SCHEMA_OPTION_FIELDS,
+    SCHEMA_OPTION_TOP_K,
+)
+
+logger = logging.getLogger(__name__)
+
+# one catalog per database instance in the process, so every job sharing a database shares its catalog
+_CATALOGS = weakref.WeakKeyDictionary()
+_CATALOGS_LOCK = threading.Lock()
+
+
+class SchemaCatalog:
+    """
+    A compact description of the conversation database's schema for the query_conversation_logs prompt.
+
+    get_schema_from_db scans every record on each call and lists every value of tool_id, data_type and user_id,
+    so the prompt grows with the user base. The catalog asks the database for its field statistics instead, the
+    types of each field and the value counts of the SCHEMA_OPTION_FIELDS, which the backends compute without
+    loading image data. The description lists each field's types, the most common values of the option fields
+    (at most top_k each, with a count of the rest) and only the caller's own user_id.
+
+    The statistics are recounted on the first description after refresh_seconds, so writes from other processes
+    show up within that time. The rendered text is cached and only rebuilt when a recount changes it: a new field
+    or type, or a change to which values are listed. Listed values are sorted, so a change in their order of
+    frequency does not change the text. The catalog is thread-safe.
+    """
+
+    def __init__(
+        self,
+        database,
+        option_fields: List[str] = SCHEMA_OPTION_FIELDS,
+        top_k: int = SCHEMA_OPTION_TOP_K,
+        refresh_seconds: float = SCHEMA_CATALOG_REFRESH_SECONDS,
+    ):
+        """
+        Initializes an empty catalog. Nothing is read until the first description.
+
+        Args:
+            database: Any conversation database backend.
+            option_fields (List[str], optional): Fields whose values are listed. Defaults to SCHEMA_OPTION_FIELDS.
+            top_k (int, optional): Maximum values listed per field. Defaults to SCHEMA_OPTION_TOP_K.
+            refresh_seconds (float, optional): Age after which the statistics are recounted.
+                Defaults to SCHEMA_CATALOG_REFRESH_SECONDS.
+        """
+        # the catalogs are keyed by their database, so a catalog only holds it weakly
+        self._database = weakref.ref(database)
+        self.option_fields = option_fields
+        self.top_k = top_k
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self._types: Dict[str, tuple] = {}
+        self._listed: Dict[str, tuple] = {}
+        self._lines: Optional[List[str]] = None
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def for_database(cls, database) -> "SchemaCatalog":
+        """
+        Returns the process-wide catalog of a database, creating it on first use.
+
+        Args:
+            database: Any conversation database backend.
+
+        Returns:
+            SchemaCatalog: The catalog.
+        """
+        with _CATALOGS_LOCK:
+            catalog = _CATALOGS.get(database)
+            if catalog is None:
+                catalog = _CATALOGS[database] = cls(database)
+            return catalog
+
+    def refresh(self, force: bool = False) -> float:
+        """
+        Recounts the database's field statistics if they are older than refresh_seconds, invalidating the cached
+        description if the recount changes it.
+
+        Args:
+            force (bool, optional): Recount even if the statistics are fresh. Defaults to False.
+
+        Returns:
+            float: The time taken in seconds, 0 if the statistics were still fresh.
+        """
+        with self._refresh_lock:
+            if (
+                not force
+                and self._refreshed_at is not None
+                and time.monotonic() - self._refreshed_at < self.refresh_seconds
+            ):
+                return 0.0
+            start = time.perf_counter()
+            database = self._database()
+            if database is None:
+                return 0.0
+            statistics = database.field_statistics(self.option_fields)
+            types = {
+                field: tuple(sorted(type_names))
+                for field, type_names in statistics["types"].items()
+            }
+            listed = {
+                field: self._top_values(counts)
+                for field, counts in statistics["options"].items()
+                if counts
+            }
+            with self._lock:
+                if types != self._types or listed != self._listed:
+                    self._types = types
+                    self._listed = listed
+                    self._lines = None
+                    self.version += 1
+                    METRICS.increment("schema_catalog.invalidated")
+            self._refreshed_at = time.monotonic()
+            elapsed = time.perf_counter() - start
+            METRICS.increment("schema_catalog.refreshed")
+            logger.info(f"Refreshed schema catalog in {elapsed:.3f}s")
+            return elapsed
+
+    def _top_values(self, counts) -> tuple:
+        top = [value for value, _ in counts.most_common(self.top_k)]
+        return tuple(sorted(top, key=repr)), len(counts) - len(top)
+
+    @staticmethod
+    def _format_value(value) -> str:
+        return "None" if value is None else f'"{value}"'
+
+    def _render(self) -> List[str]:
+        lines = []
+        for field, types in self._types.items():
+            type_names = " or ".join(types)
+            if field == "user_id":
+                # filled in per caller by describe
+                lines.append(None)
+            elif field in self._listed:
+                values, others = self._listed[field]
+                line = f"- {field} ({type_names}): one of " + ", ".join(
+                    self._format_value(value) for value in values
+                )
+                if others:
+                    line += f", and {others} other values"
+                lines.append(line)
+            else:
+                lines.append(f"- {field} ({type_names})")
+        if "user_id" not in self._types:
+            lines.append(None)
+        return lines
+
+    def describe(self, user_id: str) -> str:
+        """
+        Returns the schema description for the query_conversation_logs prompt, recounting the statistics first
+        if they are stale. Reads the database, so call it off the event loop.
+
+        Args:
+            user_id (str): The ID of the user asking, the only user_id the description mentions.
+
+        Returns:
+            str: One line per field.
+        """
+        self.refresh()
+        with self._lock:
+            if self._lines is None:
+                self._lines = self._render()
+            lines = self._lines
+        user_line = f'- user_id (str): "{user_id}" for this user'
+        return "\n".join(user_line if line is None else line for line in lines)
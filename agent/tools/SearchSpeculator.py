@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Set
+from agent.prompts import WebSearchLLMPrompt
+from agent.utils.intent_utils import query_similarity, query_terms, search_intent_score
+from agent.utils.metrics_utils import METRICS
+from agent.config import (
+    SPECULATIVE_SEARCH_MIN_SCORE,
+    SPECULATIVE_SEARCH_MATCH_THRESHOLD,
+    SPECULATIVE_SEARCH_MAX_IN_FLIGHT,
+    SPECULATIVE_SEARCH_MAX_PER_CONVERSATION,
+    SPECULATIVE_SEARCH_MAX_WASTED,
+    SPECULATIVE_SEARCH_TTL_SECONDS,
+    UPSTREAM_DEADLINE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Speculation:
+    utterance: str
+    """the user utterance that was searched"""
+    terms: Set[str]
+    """topic words of the utterance, used to match it with the tool call's question"""
+    task: asyncio.Task
+    """the web search, running in a worker thread"""
+    created: float = field(default_factory=time.monotonic)
+    """when the search was issued"""
+
+
+class SearchSpeculator:
+    """
+    Issues web searches for committed user speech that looks like a search request, before the realtime model
+    gets round to calling search_the_web, and hands the result to the tool call when its question matches.
+
+    The realtime model usually says it is going to search before it calls the tool, so by the time the call
+    arrives the speculative search is in flight or finished. Speculation is bounded: at most max_in_flight
+    searches at once (the oldest is abandoned for a newer utterance), at most max_speculations per conversation,
+    and none at all once max_wasted speculative results have been thrown away. A result nobody claims within
+    ttl_seconds is abandoned, and so is a claimed search that has not answered deadline_seconds after it was
+    issued, so the tool call can fall back to searching itself. Abandoned searches that still complete are passed
+    to on_wasted, so their token usage can be recorded.
+
+    Every method must be called from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        web_model,
+        system_prompt=WebSearchLLMPrompt,
+        min_score: float = SPECULATIVE_SEARCH_MIN_SCORE,
+        match_threshold: float = SPECULATIVE_SEARCH_MATCH_THRESHOLD,
+        max_in_flight: int = SPECULATIVE_SEARCH_MAX_IN_FLIGHT,
+        max_speculations: int = SPECULATIVE_SEARCH_MAX_PER_CONVERSATION,
+        max_wasted: int = SPECULATIVE_SEARCH_MAX_WASTED,
+        ttl_seconds: float = SPECULATIVE_SEARCH_TTL_SECONDS,
+        deadline_seconds: float = UPSTREAM_DEADLINE_SECONDS["search_the_web"],
+        on_wasted: Optional[Callable] = None,
+        submit: Optional[Callable] = None,
+    ):
+        """
+        Initializes the speculator.
+
+        Args:
+            web_model (PerplexityChat): The client the searches are sent with.
+            system_prompt (optional): The system prompt the searches use. Defaults to WebSearchLLMPrompt, the same
+                prompt search_the_web uses, so a speculative result can stand in for the real one.
+            min_score (float, optional): Minimum search_intent_score for an utterance to be searched.
+            match_threshold (float, optional): Minimum query_similarity between the tool's question and an utterance.
+            max_in_flight (int, optional): Maximum speculative searches running at once.
+            max_speculations (int, optional): Maximum speculative searches for the conversation.
+            max_wasted (int, optional): Speculation stops once this many results have been abandoned.
+            ttl_seconds (float, optional): How long an unclaimed result is kept.
+            deadline_seconds (float, optional): How long after it was issued a claimed search is waited for.
+                Defaults to the search_the_web deadline.
+            on_wasted (Callable, optional): Called with the response of every abandoned search that completes.
+            submit (Callable, optional): Coroutine function that runs the blocking search, e.g. UpstreamScheduler.submit
+                bound to background priority. Defaults to asyncio.to_thread.
+        """
+        self.web_model = web_model
+        self.system_prompt = system_prompt
+        self.min_score = min_score
+        self.match_threshold = match_threshold
+        self.max_in_flight = max_in_flight
+        self.max_speculations = max_speculations
+        self.max_wasted = max_wasted
+        self.ttl_seconds = ttl_seconds
+        self.deadline_seconds = deadline_seconds
+        self.on_wasted = on_wasted
+        self.submit = submit or asyncio.to_thread
+        self.stats = {
+            "issued": 0,
+            "hits": 0,
+            "hits_in_flight": 0,
+            "misses": 0,
+            "wasted": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "skipped_budget": 0,
+        }
+        self._speculations: List[Speculation] = []
+        self._abandoned: Set[asyncio.Task] = set()
+
+    def _count(self, name: str) -> None:
+        self.stats[name] += 1
+        METRICS.increment(f"speculation.{name}")
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of issued speculative searches that were claimed by a tool call."""
+        return (
+            self.stats["hits"] / self.stats["issued"] if self.stats["issued"] else 0.0
+        )
+
+    def speculate(self, utterance: str) -> bool:
+        """
+        Starts a web search for an utterance if it looks like a search request and the budget allows it.
+
+        Args:
+            utterance (str): The committed user speech.
+
+        Returns:
+            bool: True if a search was issued.
+        """
+        self._expire()
+        if search_intent_score(utterance) < self.min_score:
+            return False
+        terms = query_terms(utterance)
+        if any(
+            query_similarity(terms, s.terms) >= self.match_threshold
+            for s in self._speculations
+        ):
+            # the user is repeating or rephrasing something that is already being searched
+            return False
+        if (
+            self.stats["issued"] >= self.max_speculations
+            or self.stats["wasted"] >= self.max_wasted
+        ):
+            self._count("skipped_budget")
+            return False
+
+        in_flight = [s for s in self._speculations if not s.task.done()]
+        if len(in_flight) >= self.max_in_flight:
+            # the newest utterance is the one the model is most likely about to search for
+            self._abandon(in_flight[0])
+
+        task = asyncio.create_task(
+            self.submit(
+                self.web_model.invoke, system_prompt=self.system_prompt, query=utterance
+            )
+        )
+        self._speculations.append(Speculation(utterance, terms, task))
+        self._count("issued")
+        logger.info(f"SPECULATIVE SEARCH: {utterance}")
+        return True
+
+    async def claim(self, question: str):
+        """
+        Returns the speculative result for a tool call's question, waiting for it if it is still in flight.
+
+        Args:
+            question (str): The question search_the_web was called with.
+
+        Returns:
+            requests.Response: The speculative search's response, or None if no speculation matches the question,
+            or the matching search failed or missed its deadline, in which case the caller should search itself.
+        """
+        self._expire()
+        terms = query_terms(question)
+        best, best_similarity = None, 0.0
+        for speculation in self._speculations:
+            similarity = query_similarity(terms, speculation.terms)
+            if similarity > best_similarity:
+                best, best_similarity = speculation, similarity
+        if best is None or best_similarity < self.match_threshold:
+            self._count("misses")
+            return None
+
+        self._speculations.remove(best)
+        in_flight = not best.task.done()
+        if in_flight:
+            remaining = self.deadline_seconds - (time.monotonic() - best.created)
+            # asyncio.wait leaves the search running on timeout, so its usage is still reported when it completes
+            await asyncio.wait({best.task}, timeout=max(0.0, remaining))
+            if not best.task.done():
+                logger.info(
+                    f"Speculative search for '{best.utterance}' missed its {self.deadline_seconds}s deadline"
+                )
+                self._count("timed_out")
+                self._abandon(best)
+                return None
+        try:
+            response = best.task.result()
+        except Exception as e:
+            logger.info(f"Speculative search for '{best.utterance}' failed: {e}")
+            self._count("failed")
+            return None
+        if response.status_code != 200:
+            self._count("failed")
+            return None
+
+        self._count("hits")
+        if in_flight:
+            self._count("hits_in_flight")
+        logger.info(
+            f"SPECULATIVE SEARCH HIT: '{question}' matched '{best.utterance}' ({best_similarity:.2f})"
+        )
+        return response
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for speculation in list(self._speculations):
+            if now - speculation.created > self.ttl_seconds:
+                self._abandon(speculation)
+
+    def _abandon(self, speculation: Speculation) -> None:
+        # the thread making the request cannot be interrupted, so the search is left to finish and only its
+        # usage is reported; aclose() cancels whatever is still outstanding when the conversation ends
+        if speculation in self._speculations:
+            self._speculations.remove(speculation)
+        self._count("wasted")
+        if speculation.task.done():
+            self._report_wasted(speculation.task)
+        else:
+            self._abandoned.add(speculation.task)
+            speculation.task.add_done_callback(self._report_wasted)
+
+    def _report_wasted(self, task: asyncio.Task) -> None:
+        self._abandoned.discard(task)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.on_wasted is not None:
+            try:
+                self.on_wasted(task.result())
+            except Exception as e:
+                logger.info(f"Unable to record wasted speculative search: {e}")
+
+    async def aclose(self) -> None:
+        """Abandons every unclaimed speculation, cancels the searches still in flight and logs the statistics."""
+        for speculation in list(self._speculations):
+            self._abandon(speculation)
+        for task in list(self._abandoned):
+            task.cancel()
+        logger.info(
+            f"Speculative search stats: {self.stats}, hit rate {self.hit_rate:.2f}"
+        )
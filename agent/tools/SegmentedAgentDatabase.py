@@ -0,0 +1,644 @@
+import datetime
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from agent.tools.SQLiteAgentDatabase import SQLiteAgentDatabase
+from agent.tools.ShardedAgentDatabase import read_manifest, write_manifest
+from agent.utils.database_utils import merge_field_statistics, notify_listeners
+from agent.utils.metrics_utils import timed
+from agent.utils.time_utils import (
+    epoch_ms_to_datetime,
+    query_time_bounds,
+    record_epoch_ms,
+    to_epoch_ms,
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = re.compile(r"^segment_(\d{8})\.sqlite3$")
+USAGE_FILE_NAME = "usage.sqlite3"
+# segment boundaries are counted from this Monday, so weekly segments run Monday to Sunday
+SEGMENT_ORIGIN = datetime.date(1970, 1, 5)
+
+
+class SegmentedAgentDatabase:
+    """
+    Stores records in time-partitioned SQLite segments, one file per day or week of record timestamps.
+
+    Queries over a time range only open the segments that overlap it, including TinyDB queries that bound
+    "timestamp" or "timestamp_ms". Segments older than archive_after_days are sealed: compacted, their exact
+    time range recorded in the manifest, and reopened read-only, immutable and memory-mapped. Usage records
+    and aggregates, and web searches with their citation index, are kept in a single separate file, since
+    they are small and queried by totals or by user rather than by time.
+
+    Archiving should run from one process at a time, e.g. a single retention job.
+    """
+
+    def __init__(
+        self,
+        segment_dir="agent_database_segments",
+        span_days=7,
+        archive_after_days=14,
+        mmap_size=256 * 1024 * 1024,
+    ):
+        """
+        Opens the segment directory, creating it and its manifest on first use.
+
+        Args:
+            segment_dir (str, optional): Directory holding the segment files. Defaults to "agent_database_segments".
+            span_days (int, optional): Days covered by each segment of a new directory; 1 for daily and 7 for
+                weekly segments. Defaults to 7.
+            archive_after_days (int, optional): Days after a segment's last day before compact() archives it.
+                Defaults to 14.
+            mmap_size (int, optional): Bytes of each archived segment to memory-map. Defaults to 256 MiB.
+
+        An existing directory keeps the span recorded in its manifest.
+        """
+        self.segment_dir = segment_dir
+        os.makedirs(segment_dir, exist_ok=True)
+        manifest = read_manifest(segment_dir)
+        if manifest is None:
+            manifest = {"span_days": span_days, "archived": {}}
+            write_manifest(segment_dir, manifest)
+        self.manifest = manifest
+        self.span_days = manifest["span_days"]
+        self.archive_after_days = archive_after_days
+        self.mmap_size = mmap_size
+        self.usage_db = SQLiteAgentDatabase(os.path.join(segment_dir, USAGE_FILE_NAME))
+        self._segments = {}
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=8, thread_name_prefix="db_segment"
+        )
+
+    def segment_name(self, epoch_ms):
+        """
+        Returns the name of the segment that holds records from a given time.
+
+        Args:
+            epoch_ms (int): The record time in epoch milliseconds.
+
+        Returns:
+            str: The segment file name, e.g. "segment_20250106.sqlite3".
+        """
+        day = epoch_ms_to_datetime(epoch_ms).date()
+        offset = (day - SEGMENT_ORIGIN).days // self.span_days * self.span_days
+        start = SEGMENT_ORIGIN + datetime.timedelta(days=offset)
+        return f"segment_{start:%Y%m%d}.sqlite3"
+
+    def segment_bounds(self, name):
+        """
+        Returns the time range of the records a segment can hold: the exact range for an archived segment,
+        otherwise the days it covers.
+
+        Args:
+            name (str): The segment file name.
+
+        Returns:
+            tuple: The inclusive (min, max) record time in epoch milliseconds.
+        """
+        stats = self.manifest["archived"].get(name)
+        if stats and stats["min_timestamp_ms"] is not None:
+            return stats["min_timestamp_ms"], stats["max_timestamp_ms"]
+        start = datetime.datetime.strptime(
+            SEGMENT_PATTERN.match(name).group(1), "%Y%m%d"
+        )
+        end = start + datetime.timedelta(days=self.span_days)
+        return to_epoch_ms(start), to_epoch_ms(end) - 1
+
+    def segment_names(self, start_ms=None, end_ms=None):
+        """
+        Lists the segments, oldest first, optionally only those overlapping a time range.
+
+        Args:
+            start_ms (int, optional): Start of the range in epoch milliseconds (inclusive). Defaults to None.
+            end_ms (int, optional): End of the range in epoch milliseconds (inclusive). Defaults to None.
+
+        Returns:
+            list: Segment file names.
+        """
+        names = []
+        for name in sorted(os.listdir(self.segment_dir)):
+            if not SEGMENT_PATTERN.match(name):
+                continue
+            lower, upper = self.segment_bounds(name)
+            if start_ms is not None and upper < start_ms:
+                continue
+            if end_ms is not None and lower > end_ms:
+                continue
+            names.append(name)
+        return names
+
+    def _path(self, name):
+        return os.path.join(self.segment_dir, name)
+
+    def _open(self, name):
+        with self._lock:
+            segment = self._segments.get(name)
+            if segment is None:
+                archived = name in self.manifest["archived"]
+                segment = SQLiteAgentDatabase(
+                    self._path(name),
+                    read_only=archived,
+                    mmap_size=self.mmap_size if archived else 0,
+                )
+                self._segments[name] = segment
+            return segment
+
+    def _close_segment(self, name):
+        with self._lock:
+            segment = self._segments.pop(name, None)
+            if segment is not None:
+                segment.close()
+
+    @contextmanager
+    def _writable(self, name):
+        """
+        Yields a segment that can be written to. An archived segment is reopened for writing and archived
+        again afterwards, which is slow but only happens for late or purged records.
+        """
+        if name not in self.manifest["archived"]:
+            yield self._open(name)
+            return
+        with self._lock:
+            self._close_segment(name)
+            self.manifest = read_manifest(self.segment_dir)
+            self.manifest["archived"].pop(name, None)
+            write_manifest(self.segment_dir, self.manifest)
+            try:
+                yield self._open(name)
+            finally:
+                self.archive_segment(name)
+
+    def add_listener(self, listener):
+        """
+        Registers a store listener for records written to any segment. See AgentDatabase.add_listener.
+        """
+        self._listeners.append(listener)
+
+    def _fan_out(self, names, method, *args, **kwargs):
+        futures = [
+            self._executor.submit(getattr(self._open(name), method), *args, **kwargs)
+            for name in names
+        ]
+        return [future.result() for future in futures]
+
+    def _store(self, data):
+        try:
+            with self._writable(self.segment_name(data["timestamp_ms"])) as segment:
+                segment.insert_records([data])
+            logger.info(f"Data stored with ID: {data['id']}")
+        except Exception as e:
+            logger.info(f"An error occurred during the store: {e}")
+            return None
+        notify_listeners(self._listeners, [data])
+        return data["id"]
+
+    def _new_record(self, user_id, conversation_id, tool_id, data_type, data):
+        now = datetime.datetime.now()
+        return {
+            "id": str(uuid.uuid4()),
+            "timestamp": str(now),
+            "timestamp_ms": to_epoch_ms(now),
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "tool_id": tool_id,
+            "data_type": data_type,
+            "data": data,
+        }
+
+    @timed("db.segmented.store_image")
+    def store_image(self, user_id, conversation_id, tool_id, image_data):
+        """
+        Stores image data in the current segment. See AgentDatabase.store_image.
+        """
+        return self._store(
+            self._new_record(user_id, conversation_id, tool_id, "image", image_data)
+        )
+
+    @timed("db.segmented.store_text")
+    def store_text(self, user_id, conversation_id, tool_id, data_type, text_data):
+        """
+        Stores text data in the current segment. See AgentDatabase.store_text.
+        """
+        return self._store(
+            self._new_record(user_id, conversation_id, tool_id, data_type, text_data)
+        )
+
+    @timed("db.segmented.insert_records")
+    def insert_records(self, records):
+        """
+        Inserts already-built records into the segments their timestamps fall in.
+
+        Args:
+            records (Iterable[dict]): Records with the standard fields.
+
+        Returns:
+            int: The number of records inserted.
+        """
+        groups = {}
+        for record in records:
+            name = self.segment_name(record_epoch_ms(record))
+            groups.setdefault(name, []).append(record)
+        inserted = 0
+        for name, group in sorted(groups.items()):
+            with self._writable(name) as segment:
+                inserted += segment.insert_records(group)
+            notify_listeners(self._listeners, group)
+        return inserted
+
+    def store_usage(
+        self,
+        user_id,
+        conversation_id,
+        tool_id,
+        model,
+        prompt_tokens,
+        completion_tokens,
+        total_tokens,
+        cost_usd=None,
+    ):
+        """
+        Stores a usage record in the usage file. See AgentDatabase.store_usage.
+        """
+        return self.usage_db.store_usage(
+            user_id,
+            conversation_id,
+            tool_id,
+            model,
+            prompt_tokens,
+            completion_tokens,
+            total_tokens,
+            cost_usd=cost_usd,
+        )
+
+    def insert_usage_records(self, records):
+        """
+        Inserts already-built usage records. See AgentDatabase.insert_usage_records.
+        """
+        return self.usage_db.insert_usage_records(records)
+
+    def all_usage(self):
+        """
+        Retrieves every usage record.
+
+        Returns:
+            list: All usage dictionaries.
+        """
+        return self.usage_db.all_usage()
+
+    def get_usage_totals(self, scope, key):
+        """
+        Retrieves the running usage aggregate for a user, conversation, tool or day.
+        See AgentDatabase.get_usage_totals.
+        """
+        return self.usage_db.get_usage_totals(scope, key)
+
+    def store_web_search(
+        self,
+        user_id,
+        conversation_id,
+        question,
+        answer,
+        citations,
+        model=None,
+        status=None,
+        latency_ms=None,
+        usage=None,
+    ):
+        """
+        Stores a structured web search in the usage file. See AgentDatabase.store_web_search.
+        """
+        return self.usage_db.store_web_search(
+            user_id,
+            conversation_id,
+            question,
+            answer,
+            citations,
+            model=model,
+            status=status,
+            latency_ms=latency_ms,
+            usage=usage,
+        )
+
+    def insert_web_search_records(self, records):
+        """
+        Inserts already-built web search records. See AgentDatabase.insert_web_search_records.
+        """
+        return self.usage_db.insert_web_search_records(records)
+
+    def all_web_searches(self):
+        """
+        Retrieves every web search record.
+
+        Returns:
+            list: All web search dictionaries.
+        """
+        return self.usage_db.all_web_searches()
+
+    def find_citations(self, user_id, terms=None, url=None, limit=50):
+        """
+        Looks up the pages cited by a user's web searches. See AgentDatabase.find_citations.
+        """
+        return self.usage_db.find_citations(user_id, terms=terms, url=url, limit=limit)
+
+    @timed("db.segmented.get_data_by_message_id")
+    def get_data_by_message_id(self, unique_id):
+        """
+        Retrieves data by unique ID, looking in all segments in parallel.
+
+        Args:
+            unique_id (str): The unique ID of the data to retrieve.
+
+        Returns:
+            dict: The data dictionary if found, None otherwise.
+        """
+        for result in self._fan_out(
+            self.segment_names(), "get_data_by_message_id", unique_id
+        ):
+            if result:
+                return result
+        return None
+
+    @timed("db.segmented.get_data_by_user_id")
+    def get_data_by_user_id(self, user_id, remove_image_data=True, fields=None):
+        """
+        Retrieves data by user ID from every segment, oldest first. See AgentDatabase.get_data_by_user_id.
+        """
+        results = self._fan_out(
+            self.segment_names(),
+            "get_data_by_user_id",
+            user_id,
+            remove_image_data=remove_image_data,
+            fields=fields,
+        )
+        return [record for segment_results in results for record in segment_results]
+
+    @timed("db.segmented.get_page_by_user_id")
+    def get_page_by_user_id(
+        self, user_id, cursor=None, limit=100, remove_image_data=True, fields=None
+    ):
+        """
+        Retrieves one page of a user's records, oldest segment first. The cursor names the segment and the
+        position in it, so a page only reads the segments it spans. See AgentDatabase.get_page_by_user_id.
+
+        Returns:
+            tuple: The list of data dictionaries and the cursor of the next page, or None after the last page.
+        """
+        start_name, segment_cursor = cursor.split(":") if cursor else (None, None)
+        page = []
+        for name in self.segment_names():
+            if start_name is not None and name < start_name:
+                continue
+            records, next_cursor = self._open(name).get_page_by_user_id(
+                user_id,
+                int(segment_cursor) if name == start_name else None,
+                limit - len(page),
+                remove_image_data,
+                fields,
+            )
+            page.extend(records)
+            if next_cursor is not None:
+                return page, f"{name}:{next_cursor}"
+        return page, None
+
+    def iter_data_by_user_id(
+        self, user_id, remove_image_data=True, fields=None, batch_size=500
+    ):
+        """
+        Streams a user's records page by page, oldest segment first. See AgentDatabase.iter_data_by_user_id.
+        """
+        cursor = None
+        while True:
+            page, cursor = self.get_page_by_user_id(
+                user_id, cursor, batch_size, remove_image_data, fields
+            )
+            yield from page
+            if cursor is None:
+                return
+
+    @timed("db.segmented.get_data_by_time_range")
+    def get_data_by_time_range(
+        self,
+        start,
+        end=None,
+        user_id=None,
+        remove_image_data=True,
+        image_payloads=True,
+    ):
+        """
+        Retrieves the records stored in a time range, opening only the segments that overlap it.
+        See AgentDatabase.get_data_by_time_range.
+        """
+        start_ms = to_epoch_ms(start)
+        end_ms = to_epoch_ms(end if end is not None else datetime.datetime.now())
+        results = self._fan_out(
+            self.segment_names(start_ms, end_ms - 1),
+            "get_data_by_time_range",
+            start_ms,
+            end_ms,
+            user_id=user_id,
+            remove_image_data=remove_image_data,
+            image_payloads=image_payloads,
+        )
+        return [record for segment_results in results for record in segment_results]
+
+    def delete_data(self, unique_id):
+        """
+        Deletes data by unique ID from whichever segment holds it.
+
+        Args:
+            unique_id (str): The unique ID of the data to delete.
+        """
+        names = self.segment_names()
+        for name, result in zip(
+            names, self._fan_out(names, "get_data_by_message_id", unique_id)
+        ):
+            if result:
+                with self._writable(name) as segment:
+                    segment.delete_data(unique_id)
+                return
+        logger.info(f"Data with ID {unique_id} not found, deletion skipped.")
+
+    @timed("db.segmented.search_text")
+    def search_text(self, text, user_id=None, limit=50):
+        """
+        Finds text records containing the given words, newest segments first. See AgentDatabase.search_text.
+        """
+        names = self.segment_names()[::-1]
+        results = self._fan_out(
+            names, "search_text", text, user_id=user_id, limit=limit
+        )
+        return [record for segment_results in results for record in segment_results][
+            :limit
+        ]
+
+    @timed("db.segmented.all")
+    def all(self):
+        """
+        Retrieves every record from every segment, oldest segment first.
+
+        Returns:
+            list: All data dictionaries.
+        """
+        results = self._fan_out(self.segment_names(), "all")
+        return [record for segment_results in results for record in segment_results]
+
+    def field_statistics(self, option_fields):
+        """
+        Summarizes the stored records' fields across every segment. See AgentDatabase.field_statistics.
+        """
+        return merge_field_statistics(
+            self._fan_out(self.segment_names(), "field_statistics", option_fields)
+        )
+
+    @timed("db.segmented.search")
+    def search(self, query):
+        """
+        Runs a TinyDB query over the segments it can match. Comparisons on "timestamp" or "timestamp_ms"
+        joined to the rest of the query by & limit the segments that are read.
+
+        Args:
+            query (tinydb.queries.QueryLike): The query condition.
+
+        Returns:
+            list: The matching data dictionaries, oldest segment first.
+        """
+        start_ms, end_ms = query_time_bounds(query)
+        results = self._fan_out(self.segment_names(start_ms, end_ms), "search", query)
+        return [record for segment_results in results for record in segment_results]
+
+    @timed("db.segmented.purge_records")
+    def purge_records(self, cutoff, data_type=None, tool_id=None, batch_size=500):
+        """
+        Deletes records older than a cutoff. Segments that lie entirely before the cutoff are deleted as
+        whole files when the purge is not filtered by data type or tool. See AgentDatabase.purge_records.
+
+        Returns:
+            int: The number of records deleted.
+        """
+        cutoff_ms = to_epoch_ms(cutoff)
+        purged = 0
+        for name in self.segment_names(end_ms=cutoff_ms - 1):
+            expired = self._open(name).count_expired(
+                cutoff, data_type=data_type, tool_id=tool_id
+            )
+            if not expired:
+                continue
+            if (
+                data_type is None
+                and tool_id is None
+                and self.segment_bounds(name)[1] < cutoff_ms
+            ):
+                self._drop_segment(name)
+                purged += expired
+                continue
+            with self._writable(name) as segment:
+                purged += segment.purge_records(
+                    cutoff, data_type=data_type, tool_id=tool_id, batch_size=batch_size
+                )
+        return purged
+
+    def purge_table(self, table, cutoff, batch_size=500):
+        """
+        Deletes web search or usage records older than a cutoff from the usage file. See AgentDatabase.purge_table.
+
+        Returns:
+            int: The number of records deleted.
+        """
+        return self.usage_db.purge_table(table, cutoff, batch_size=batch_size)
+
+    def _drop_segment(self, name):
+        with self._lock:
+            self._close_segment(name)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self._path(name) + suffix):
+                    os.remove(self._path(name) + suffix)
+            self.manifest = read_manifest(self.segment_dir)
+            if self.manifest["archived"].pop(name, None) is not None:
+                write_manifest(self.segment_dir, self.manifest)
+        logger.info(f"Dropped expired segment {name}")
+
+    def archive_segment(self, name):
+        """
+        Seals a segment and reopens it read-only, immutable and memory-mapped.
+
+        Args:
+            name (str): The segment file name.
+
+        Returns:
+            dict: The segment's "records", "min_timestamp_ms" and "max_timestamp_ms", as stored in the manifest.
+        """
+        with self._lock:
+            self._close_segment(name)
+            segment = SQLiteAgentDatabase(self._path(name))
+            try:
+                stats = segment.seal()
+            finally:
+                segment.close()
+            self.manifest = read_manifest(self.segment_dir)
+            self.manifest["archived"][name] = stats
+            write_manifest(self.segment_dir, self.manifest)
+        logger.info(f"Archived segment {name}: {stats}")
+        return stats
+
+    @timed("db.segmented.compact")
+    def compact(self):
+        """
+        Compacts the segments still being written to and archives those older than archive_after_days.
+        """
+        cutoff_ms = to_epoch_ms(
+            datetime.datetime.now() - datetime.timedelta(days=self.archive_after_days)
+        )
+        active = [
+            name
+            for name in self.segment_names()
+            if name not in self.manifest["archived"]
+        ]
+        for name in active:
+            if self.segment_bounds(name)[1] < cutoff_ms:
+                try:
+                    self.archive_segment(name)
+                except Exception as e:
+                    logger.info(f"An error occurred archiving segment {name}: {e}")
+            else:
+                self._open(name).compact()
+        self.usage_db.compact()
+
+    def warm(self):
+        """
+        Opens and warms the segment currently being written to and the usage file. Older segments are
+        opened on first use. See AgentDatabase.warm.
+
+        Returns:
+            int: The number of records in the current segment.
+        """
+        self.usage_db.warm()
+        current = self._open(self.segment_name(to_epoch_ms(datetime.datetime.now())))
+        return current.warm()
+
+    def storage_bytes(self):
+        """
+        Returns the size of the database on disk.
+
+        Returns:
+            int: The total size of the files in the segment directory in bytes.
+        """
+        return sum(
+            entry.stat().st_size
+            for entry in os.scandir(self.segment_dir)
+            if entry.is_file()
+        )
+
+    def close(self):
+        """Closes every open segment and the usage file."""
+        with self._lock:
+            for name in list(self._segments):
+                self._close_segment(name)
+        self.usage_db.close()
+        self._executor.shutdown()
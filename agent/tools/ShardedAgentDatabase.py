@@ -0,0 +1,566 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from agent.utils.database_utils import (
+    create_agent_database,
+    merge_field_statistics,
+)
+from agent.utils.metrics_utils import timed
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+SHARD_EXTENSIONS = {"tinydb": ".json", "sqlite": ".sqlite3"}
+
+
+def shard_index(user_id, shard_count):
+    """
+    Maps a user ID to a shard. Uses a stable hash, so every process routes a user to the same shard.
+
+    Args:
+        user_id (str): The ID of the user.
+        shard_count (int): The number of shards.
+
+    Returns:
+        int: The shard index, in [0, shard_count).
+    """
+    digest = hashlib.md5(str(user_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def read_manifest(shard_dir):
+    """
+    Reads the shard layout of a sharded database directory.
+
+    Args:
+        shard_dir (str): The directory holding the shard files.
+
+    Returns:
+        dict: The manifest ("backend", "shard_count", "generation"), or None if the directory has no manifest.
+    """
+    path = os.path.join(shard_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(shard_dir, manifest):
+    """
+    Atomically replaces the manifest of a sharded database directory.
+
+    Args:
+        shard_dir (str): The directory holding the shard files.
+        manifest (dict): The new manifest.
+    """
+    path = os.path.join(shard_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file)
+    os.replace(path + ".tmp", path)
+
+
+def shard_paths(shard_dir, manifest):
+    """
+    Returns the file paths of every shard described by a manifest.
+
+    Args:
+        shard_dir (str): The directory holding the shard files.
+        manifest (dict): The shard layout.
+
+    Returns:
+        list: One path per shard, in shard order.
+    """
+    extension = SHARD_EXTENSIONS[manifest["backend"]]
+    return [
+        os.path.join(shard_dir, f"shard_g{manifest['generation']}_{i}{extension}")
+        for i in range(manifest["shard_count"])
+    ]
+
+
+class ShardedAgentDatabase:
+    """
+    Routes AgentDatabase operations to one of N shard databases by a hash of the user ID.
+
+    Each user's records, usage, web searches and per-user/per-conversation aggregates live in a single shard, so rooms for
+    different users write to different files. Operations that are not scoped to a user are fanned out to all
+    shards in parallel and merged.
+    """
+
+    def __init__(
+        self, shard_dir="agent_database_shards", backend="sqlite", shard_count=8
+    ):
+        """
+        Opens the shards, creating the directory and manifest on first use.
+
+        Args:
+            shard_dir (str, optional): Directory holding the shard files. Defaults to "agent_database_shards".
+            backend (str, optional): Storage backend of each shard for a new directory. Defaults to "sqlite".
+            shard_count (int, optional): Number of shards for a new directory. Defaults to 8.
+
+        An existing directory keeps the backend and shard count recorded in its manifest; use rebalance_shards
+        to change them.
+        """
+        self.shard_dir = shard_dir
+        os.makedirs(shard_dir, exist_ok=True)
+        manifest = read_manifest(shard_dir)
+        if manifest is None:
+            manifest = {"backend": backend, "shard_count": shard_count, "generation": 0}
+            write_manifest(shard_dir, manifest)
+        self.manifest = manifest
+        self.shards = [
+            create_agent_database(manifest["backend"], path)
+            for path in shard_paths(shard_dir, manifest)
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.shards), thread_name_prefix="db_shard"
+        )
+
+    @property
+    def shard_count(self):
+        return len(self.shards)
+
+    def shard_for(self, user_id):
+        """
+        Returns the shard database that holds a user's data.
+
+        Args:
+            user_id (str): The ID of the user.
+
+        Returns:
+            AgentDatabase | SQLiteAgentDatabase: The shard.
+        """
+        return self.shards[shard_index(user_id, self.shard_count)]
+
+    def add_listener(self, listener):
+        """
+        Registers a store listener on every shard. See AgentDatabase.add_listener.
+        """
+        for shard in self.shards:
+            shard.add_listener(listener)
+
+    def _fan_out(self, method, *args, **kwargs):
+        """
+        Calls the same method on every shard in parallel.
+
+        Returns:
+            list: The result from each shard, in shard order.
+        """
+        futures = [
+            self._executor.submit(getattr(shard, method), *args, **kwargs)
+            for shard in self.shards
+        ]
+        return [future.result() for future in futures]
+
+    def store_image(self, user_id, conversation_id, tool_id, image_data):
+        """
+        Stores image data in the user's shard. See AgentDatabase.store_image.
+        """
+        return self.shard_for(user_id).store_image(
+            user_id, conversation_id, tool_id, image_data
+        )
+
+    def store_text(self, user_id, conversation_id, tool_id, data_type, text_data):
+        """
+        Stores text data in the user's shard. See AgentDatabase.store_text.
+        """
+        return self.shard_for(user_id).store_text(
+            user_id, conversation_id, tool_id, data_type, text_data
+        )
+
+    def store_usage(
+        self,
+        user_id,
+        conversation_id,
+        tool_id,
+        model,
+        prompt_tokens,
+        completion_tokens,
+        total_tokens,
+        cost_usd=None,
+    ):
+        """
+        Stores a usage record in the user's shard. See AgentDatabase.store_usage.
+        """
+        return self.shard_for(user_id).store_usage(
+            user_id,
+            conversation_id,
+            tool_id,
+            model,
+            prompt_tokens,
+            completion_tokens,
+            total_tokens,
+            cost_usd=cost_usd,
+        )
+
+    @timed("db.sharded.insert_records")
+    def insert_records(self, records):
+        """
+        Inserts already-built records, grouped by shard and written to the shards in parallel.
+
+        Args:
+            records (Iterable[dict]): Records with the standard fields.
+
+        Returns:
+            int: The number of records inserted.
+        """
+        return sum(self._insert_grouped("insert_records", records))
+
+    def insert_usage_records(self, records):
+        """
+        Inserts already-built usage records, grouped by shard. See AgentDatabase.insert_usage_records.
+
+        Returns:
+            int: The number of usage records inserted.
+        """
+        return sum(self._insert_grouped("insert_usage_records", records))
+
+    def _insert_grouped(self, method, records):
+        groups = [[] for _ in self.shards]
+        for record in records:
+            groups[shard_index(record["user_id"], self.shard_count)].append(record)
+        futures = [
+            self._executor.submit(getattr(shard, method), group)
+            for shard, group in zip(self.shards, groups)
+            if group
+        ]
+        return [future.result() for future in futures]
+
+    def get_usage_totals(self, scope, key):
+        """
+        Retrieves the running usage aggregate for a user, conversation, tool or day.
+
+        Per-user totals come from the user's shard. Other scopes are summed across shards.
+
+        Args:
+            scope (str): One of "user", "conversation", "tool" or "day".
+            key (str): The user ID, conversation ID, tool ID or date ("YYYY-MM-DD").
+
+        Returns:
+            dict: The usage totals. See AgentDatabase.get_usage_totals.
+        """
+        if scope == "user":
+            return self.shard_for(key).get_usage_totals(scope, key)
+        per_shard = self._fan_out("get_usage_totals", scope, key)
+        return {
+            field: sum(totals[field] for totals in per_shard) for field in per_shard[0]
+        }
+
+    def store_web_search(
+        self,
+        user_id,
+        conversation_id,
+        question,
+        answer,
+        citations,
+        model=None,
+        status=None,
+        latency_ms=None,
+        usage=None,
+    ):
+        """
+        Stores a structured web search in the user's shard. See AgentDatabase.store_web_search.
+        """
+        return self.shard_for(user_id).store_web_search(
+            user_id,
+            conversation_id,
+            question,
+            answer,
+            citations,
+            model=model,
+            status=status,
+            latency_ms=latency_ms,
+            usage=usage,
+        )
+
+    def insert_web_search_records(self, records):
+        """
+        Inserts already-built web search records, grouped by shard. See AgentDatabase.insert_web_search_records.
+
+        Returns:
+            int: The number of web searches inserted.
+        """
+        return sum(self._insert_grouped("insert_web_search_records", records))
+
+    def all_web_searches(self):
+        """
+        Retrieves every web search record from every shard, ordered by timestamp.
+
+        Returns:
+            list: All web search dictionaries.
+        """
+        return self._merge(self._fan_out("all_web_searches"))
+
+    def find_citations(self, user_id, terms=None, url=None, limit=50):
+        """
+        Looks up the pages cited by a user's web searches in the user's shard. See AgentDatabase.find_citations.
+        """
+        return self.shard_for(user_id).find_citations(
+            user_id, terms=terms, url=url, limit=limit
+        )
+
+    @timed("db.sharded.get_data_by_message_id")
+    def get_data_by_message_id(self, unique_id):
+        """
+        Retrieves data by unique ID, looking in all shards in parallel.
+
+        Args:
+            unique_id (str): The unique ID of the data to retrieve.
+
+        Returns:
+            dict: The data dictionary if found, None otherwise.
+        """
+        for result in self._fan_out("get_data_by_message_id", unique_id):
+            if result:
+                return result
+        return None
+
+    def get_data_by_user_id(self, user_id, remove_image_data=True, fields=None):
+        """
+        Retrieves data by user ID from the user's shard. See AgentDatabase.get_data_by_user_id.
+        """
+        return self.shard_for(user_id).get_data_by_user_id(
+            user_id, remove_image_data=remove_image_data, fields=fields
+        )
+
+    def get_page_by_user_id(
+        self, user_id, cursor=None, limit=100, remove_image_data=True, fields=None
+    ):
+        """
+        Retrieves one page of a user's records from the user's shard. See AgentDatabase.get_page_by_user_id.
+        """
+        return self.shard_for(user_id).get_page_by_user_id(
+            user_id, cursor, limit, remove_image_data, fields
+        )
+
+    def iter_data_by_user_id(
+        self, user_id, remove_image_data=True, fields=None, batch_size=500
+    ):
+        """
+        Streams a user's records from the user's shard. See AgentDatabase.iter_data_by_user_id.
+        """
+        return self.shard_for(user_id).iter_data_by_user_id(
+            user_id, remove_image_data, fields, batch_size
+        )
+
+    @timed("db.sharded.get_data_by_time_range")
+    def get_data_by_time_range(
+        self,
+        start,
+        end=None,
+        user_id=None,
+        remove_image_data=True,
+        image_payloads=True,
+    ):
+        """
+        Retrieves the records stored in a time range, from the user's shard when a user is given, otherwise
+        from all shards in parallel. See AgentDatabase.get_data_by_time_range.
+        """
+        if user_id is not None:
+            return self.shard_for(user_id).get_data_by_time_range(
+                start,
+                end,
+                user_id=user_id,
+                remove_image_data=remove_image_data,
+                image_payloads=image_payloads,
+            )
+        return self._merge(
+            self._fan_out(
+                "get_data_by_time_range",
+                start,
+                end,
+                remove_image_data=remove_image_data,
+                image_payloads=image_payloads,
+            )
+        )
+
+    def delete_data(self, unique_id):
+        """
+        Deletes data by unique ID from whichever shard holds it.
+
+        Args:
+            unique_id (str): The unique ID of the data to delete.
+        """
+        self._fan_out("delete_data", unique_id)
+
+    @timed("db.sharded.search_text")
+    def search_text(self, text, user_id=None, limit=50):
+        """
+        Finds text records containing the given words. Searches only the user's shard when a user is given,
+        otherwise all shards in parallel.
+
+        Returns:
+            list: Matching data dictionaries. See AgentDatabase.search_text.
+        """
+        if user_id is not None:
+            return self.shard_for(user_id).search_text(
+                text, user_id=user_id, limit=limit
+            )
+        results = self._fan_out("search_text", text, limit=limit)
+        return [record for shard_results in results for record in shard_results][:limit]
+
+    @timed("db.sharded.all")
+    def all(self):
+        """
+        Retrieves every record from every shard, ordered by timestamp.
+
+        Returns:
+            list: All data dictionaries.
+        """
+        return self._merge(self._fan_out("all"))
+
+    def field_statistics(self, option_fields):
+        """
+        Summarizes the stored records' fields across every shard. See AgentDatabase.field_statistics.
+        """
+        return merge_field_statistics(self._fan_out("field_statistics", option_fields))
+
+    def all_usage(self):
+        """
+        Retrieves every usage record from every shard, ordered by timestamp.
+
+        Returns:
+            list: All usage dictionaries.
+        """
+        return self._merge(self._fan_out("all_usage"))
+
+    @timed("db.sharded.search")
+    def search(self, query):
+        """
+        Runs a TinyDB query on every shard in parallel and merges the results by timestamp.
+
+        Args:
+            query (tinydb.queries.QueryLike): The query condition.
+
+        Returns:
+            list: The matching data dictionaries.
+        """
+        return self._merge(self._fan_out("search", query))
+
+    @staticmethod
+    def _merge(results):
+        return sorted(
+            (record for shard_results in results for record in shard_results),
+            key=lambda record: record["timestamp"],
+        )
+
+    @timed("db.sharded.purge_records")
+    def purge_records(self, cutoff, data_type=None, tool_id=None, batch_size=500):
+        """
+        Deletes records older than a cutoff from every shard in parallel. See AgentDatabase.purge_records.
+
+        Returns:
+            int: The number of records deleted.
+        """
+        return sum(
+            self._fan_out(
+                "purge_records",
+                cutoff,
+                data_type=data_type,
+                tool_id=tool_id,
+                batch_size=batch_size,
+            )
+        )
+
+    def purge_table(self, table, cutoff, batch_size=500):
+        """
+        Deletes web search or usage records older than a cutoff from every shard in parallel.
+        See AgentDatabase.purge_table.
+
+        Returns:
+            int: The number of records deleted.
+        """
+        return sum(self._fan_out("purge_table", table, cutoff, batch_size=batch_size))
+
+    def compact(self):
+        """Compacts every shard in parallel."""
+        self._fan_out("compact")
+
+    def warm(self):
+        """
+        Warms every shard in parallel. See AgentDatabase.warm.
+
+        Returns:
+            int: The number of records across all shards.
+        """
+        return sum(self._fan_out("warm"))
+
+    def storage_bytes(self):
+        """
+        Returns the size of the database on disk.
+
+        Returns:
+            int: The total size of all shards in bytes.
+        """
+        return sum(self._fan_out("storage_bytes"))
+
+    def close(self):
+        """Closes every shard."""
+        self._fan_out("close")
+        self._executor.shutdown()
+
+
+def rebalance_shards(shard_dir, shard_count, backend=None, remove_old=True):
+    """
+    Rewrites a sharded database into a new number of shards, e.g. to split shards as traffic grows.
+
+    The new layout is written as a new generation of shard files next to the old one, and the manifest is
+    swapped atomically once every record, usage row and web search has been copied, so a crash part-way leaves the
+    old layout in place. Workers should be drained while this runs: writes made to the old generation after
+    it has been read are not carried over.
+
+    Args:
+        shard_dir (str): The sharded database directory.
+        shard_count (int): The new number of shards.
+        backend (str, optional): The new shard backend. Defaults to the current backend.
+        remove_old (bool, optional): Whether to delete the old generation's files afterwards. Defaults to True.
+
+    Returns:
+        dict: The new manifest plus the number of "records", "usage" and "web_searches" rows copied.
+    """
+    old_manifest = read_manifest(shard_dir)
+    if old_manifest is None:
+        raise ValueError(f"No sharded database found in {shard_dir}")
+    new_manifest = {
+        "backend": backend or old_manifest["backend"],
+        "shard_count": shard_count,
+        "generation": old_manifest["generation"] + 1,
+    }
+
+    old_shards = [
+        create_agent_database(old_manifest["backend"], path)
+        for path in shard_paths(shard_dir, old_manifest)
+    ]
+    new_shards = [
+        create_agent_database(new_manifest["backend"], path)
+        for path in shard_paths(shard_dir, new_manifest)
+    ]
+
+    copied = {"records": 0, "usage": 0, "web_searches": 0}
+    for old_shard in old_shards:
+        for method, read, key in (
+            ("insert_records", "all", "records"),
+            ("insert_usage_records", "all_usage", "usage"),
+            ("insert_web_search_records", "all_web_searches", "web_searches"),
+        ):
+            source = getattr(old_shard, read)()
+            groups = [[] for _ in new_shards]
+            for record in source:
+                groups[shard_index(record["user_id"], shard_count)].append(record)
+            for new_shard, group in zip(new_shards, groups):
+                if group:
+                    copied[key] += getattr(new_shard, method)(group)
+        old_shard.close()
+    for new_shard in new_shards:
+        new_shard.close()
+
+    write_manifest(shard_dir, new_manifest)
+    if remove_old:
+        for path in shard_paths(shard_dir, old_manifest):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    logger.info(f"Rebalanced {shard_dir} into {shard_count} shards: {copied}")
+    return {**new_manifest, **copied}
@@ -0,0 +1,451 @@
+import asyncio
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+from agent.utils.metrics_utils import METRICS
+from agent.config import (
+    UPSTREAM_LIMITS,
+    UPSTREAM_SHARED_STATE,
+    UPSTREAM_THROTTLE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter: holds up to `burst` tokens and refills at `rate` tokens per second.
+    Not thread-safe on its own; UpstreamScheduler only touches it with its lock held.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Initializes a full bucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            burst (int): Maximum tokens held.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+    def try_take(self, now: float) -> bool:
+        """
+        Takes a token if one is available.
+
+        Args:
+            now (float): The current time.monotonic().
+
+        Returns:
+            bool: True if a token was taken.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self, now: float) -> float:
+        """
+        Returns how long until a token is available.
+
+        Args:
+            now (float): The current time.monotonic().
+
+        Returns:
+            float: Seconds, 0 if a token is available now.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return max(0.0, self.updated - now)
+        return max(0.0, self.updated - now) + (1 - self.tokens) / self.rate
+
+    def pause(self, now: float, seconds: float) -> None:
+        """
+        Empties the bucket and stops it refilling for the given time, e.g. after the upstream answered 429.
+
+        Args:
+            now (float): The current time.monotonic().
+            seconds (float): How long to pause.
+        """
+        self._refill(now)
+        self.tokens = 0.0
+        self.updated = max(self.updated, now + seconds)
+
+
+class SharedTokenBucket:
+    """
+    A token bucket kept in a SQLite file, so every worker process on the host takes its tokens from the same
+    bucket and a 429 seen by one process pauses them all. Each take or pause is one short transaction. Times are
+    wall clock, since time.monotonic() cannot be compared between processes, so the `now` arguments are ignored.
+
+    Not thread-safe on its own; UpstreamScheduler only touches it with its lock held.
+    """
+
+    # how long a bucket reports no tokens after the shared state could not be read, e.g. the file was locked
+    RETRY_SECONDS = 0.05
+
+    def __init__(self, conn: sqlite3.Connection, key: str, rate: float, burst: int):
+        """
+        Opens the bucket, creating it full if no process has used it yet.
+
+        Args:
+            conn (sqlite3.Connection): Connection to the shared state file, in autocommit mode.
+            key (str): The bucket's name, e.g. "perplexity/sonar".
+            rate (float): Tokens added per second.
+            burst (int): Maximum tokens held.
+        """
+        self.conn = conn
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        # the state as last read, for seconds_until_token
+        self.tokens = float(burst)
+        self.updated = time.time()
+        conn.execute(
+            "INSERT OR IGNORE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+            (key, self.tokens, self.updated),
+        )
+
+    def _update(self, change: Callable):
+        # applies change(tokens, updated, now) -> (tokens, updated, result) to the refilled shared state
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated = self.conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            if now > updated:
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                updated = now
+            tokens, updated, result = change(tokens, updated, now)
+            self.conn.execute(
+                "UPDATE buckets SET tokens = ?, updated = ? WHERE key = ?",
+                (tokens, updated, self.key),
+            )
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        self.tokens, self.updated = tokens, updated
+        return result
+
+    def try_take(self, now: float) -> bool:
+        """
+        Takes a token if one is available.
+
+        Args:
+            now (float): Ignored, see the class docstring.
+
+        Returns:
+            bool: True if a token was taken.
+        """
+
+        def take(tokens, updated, now):
+            if tokens >= 1:
+                return tokens - 1, updated, True
+            return tokens, updated, False
+
+        try:
+            return self._update(take)
+        except sqlite3.OperationalError as e:
+            logger.info(f"Could not read the shared token bucket {self.key}: {e}")
+            self.tokens, self.updated = 0.0, time.time() + self.RETRY_SECONDS
+            return False
+
+    def seconds_until_token(self, now: float) -> float:
+        """
+        Returns how long until a token is available, from the state as last read.
+
+        Args:
+            now (float): Ignored, see the class docstring.
+
+        Returns:
+            float: Seconds, 0 if a token is available now.
+        """
+        now = time.time()
+        tokens = self.tokens
+        if now > self.updated:
+            tokens = min(self.burst, tokens + (now - self.updated) * self.rate)
+        if tokens >= 1:
+            return max(0.0, self.updated - now)
+        return max(0.0, self.updated - now) + (1 - tokens) / self.rate
+
+    def pause(self, now: float, seconds: float) -> None:
+        """
+        Empties the bucket and stops it refilling for the given time, in every process.
+
+        Args:
+            now (float): Ignored, see the class docstring.
+            seconds (float): How long to pause.
+        """
+        try:
+            self._update(
+                lambda tokens, updated, now: (0.0, max(updated, now + seconds), None)
+            )
+        except sqlite3.OperationalError as e:
+            logger.info(f"Could not pause the shared token bucket {self.key}: {e}")
+
+
+class _Request:
+    __slots__ = (
+        "upstream",
+        "model",
+        "priority",
+        "fnc",
+        "args",
+        "kwargs",
+        "future",
+        "enqueued",
+    )
+
+    def __init__(self, upstream, model, priority, fnc, args, kwargs):
+        self.upstream = upstream
+        self.model = model
+        self.priority = priority
+        self.fnc = fnc
+        self.args = args
+        self.kwargs = kwargs
+        self.future = concurrent.futures.Future()
+        self.enqueued = time.monotonic()
+
+
+def is_rate_limited(result=None, error: Optional[BaseException] = None) -> bool:
+    """
+    Returns whether an upstream response or error means the request was rate limited.
+
+    Args:
+        result (optional): The response, e.g. a requests.Response from Perplexity.
+        error (BaseException, optional): The exception raised, e.g. openai.RateLimitError.
+
+    Returns:
+        bool: True for HTTP 429 responses and errors.
+    """
+    if error is not None:
+        return getattr(error, "status_code", None) == 429
+    return getattr(result, "status_code", None) == 429
+
+
+class UpstreamScheduler:
+    """
+    Schedules the blocking upstream model calls of every job in a worker process, within rate limits shared by
+    every worker process on the host.
+
+    Calls are queued per upstream ("perplexity", "openai") in priority order, interactive tool calls ahead of
+    background work such as speculative searches, and first come first served within a priority. A call is
+    started when its upstream is below its concurrency limit and the token bucket for its upstream and model has
+    a token, and runs on the scheduler's own thread pool. A 429 from an upstream pauses that bucket for
+    UPSTREAM_THROTTLE_SECONDS, so one rate limited request slows everyone down briefly instead of every room
+    retrying into the limit.
+
+    LiveKit runs each job, i.e. each room, in its own process, so the token buckets are kept in the
+    shared_state SQLite file and every room on the host draws from the same buckets. The concurrency limit
+    applies per process.
+
+    The time each call spends queued is recorded as "scheduler.<upstream>.queue_wait" and kept in queue_waits.
+    The scheduler is thread-safe and can be awaited from any event loop.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Dict]] = None,
+        shared_state: Optional[str] = UPSTREAM_SHARED_STATE,
+    ):
+        """
+        Starts the scheduler.
+
+        Args:
+            limits (Dict[str, Dict], optional): Per upstream "max_concurrency", "requests_per_second" and "burst",
+                with optional per model overrides of the last two under "models". Defaults to UPSTREAM_LIMITS.
+            shared_state (str, optional): SQLite file holding the token buckets shared with other processes, or
+                None to keep them in this process. Defaults to UPSTREAM_SHARED_STATE.
+        """
+        self.limits = limits or UPSTREAM_LIMITS
+        self._shared = None
+        if shared_state is not None:
+            self._shared = sqlite3.connect(
+                shared_state, isolation_level=None, check_same_thread=False, timeout=1.0
+            )
+            self._shared.execute("PRAGMA journal_mode=WAL")
+            self._shared.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        self._queues: Dict[str, list] = {upstream: [] for upstream in self.limits}
+        self._running: Dict[str, int] = {upstream: 0 for upstream in self.limits}
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.queue_waits = collections.defaultdict(
+            lambda: collections.deque(maxlen=10000)
+        )
+        self.stats = collections.Counter()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=sum(limit["max_concurrency"] for limit in self.limits.values()),
+            thread_name_prefix="upstream",
+        )
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, name="upstream-scheduler", daemon=True
+        )
+        self._dispatcher.start()
+
+    def _bucket(self, upstream: str, model: str) -> TokenBucket:
+        bucket = self._buckets.get((upstream, model))
+        if bucket is None:
+            limit = self.limits[upstream]
+            limit = {**limit, **limit.get("models", {}).get(model, {})}
+            if self._shared is not None:
+                bucket = SharedTokenBucket(
+                    self._shared,
+                    f"{upstream}/{model}",
+                    limit["requests_per_second"],
+                    limit["burst"],
+                )
+            else:
+                bucket = TokenBucket(limit["requests_per_second"], limit["burst"])
+            self._buckets[(upstream, model)] = bucket
+        return bucket
+
+    async def submit(
+        self,
+        upstream: str,
+        model: str,
+        fnc: Callable,
+        /,
+        *args,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs,
+    ):
+        """
+        Queues a blocking upstream call and waits for its result.
+
+        Args:
+            upstream (str): The upstream the call goes to, a key of the limits.
+            model (str): The model the call uses, which selects the token bucket.
+            fnc (Callable): The blocking call.
+            *args: Positional arguments for fnc.
+            priority (int, optional): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND. Defaults to PRIORITY_INTERACTIVE.
+            **kwargs: Keyword arguments for fnc.
+
+        Returns:
+            The call's result. Cancelling the awaiting task removes the call from the queue if it has not started.
+        """
+        request = _Request(upstream, model, priority, fnc, args, kwargs)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("UpstreamScheduler is closed")
+            heapq.heappush(
+                self._queues[upstream], (priority, next(self._sequence), request)
+            )
+            self.stats[
+                f"{upstream}.{PRIORITY_NAMES.get(priority, priority)}.submitted"
+            ] += 1
+            self._cond.notify()
+        return await asyncio.wrap_future(request.future)
+
+    def _dispatch_loop(self) -> None:
+        with self._cond:
+            while not self._closed:
+                self._cond.wait(self._dispatch())
+
+    def _dispatch(self) -> Optional[float]:
+        # starts every queued call that its upstream's concurrency and its bucket allow; returns how long to
+        # wait before a bucket has a token for a call that is still queued, or None to wait for a notify
+        now = time.monotonic()
+        wait = None
+        for upstream, queue in self._queues.items():
+            max_concurrency = self.limits[upstream]["max_concurrency"]
+            while queue and self._running[upstream] < max_concurrency:
+                chosen = None
+                for entry in sorted(queue):
+                    request = entry[2]
+                    if request.future.cancelled():
+                        chosen = entry
+                        break
+                    bucket = self._bucket(upstream, request.model)
+                    if bucket.try_take(now):
+                        chosen = entry
+                        break
+                    delay = bucket.seconds_until_token(now)
+                    wait = delay if wait is None else min(wait, delay)
+                if chosen is None:
+                    break
+                queue.remove(chosen)
+                heapq.heapify(queue)
+                request = chosen[2]
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                self._running[upstream] += 1
+                queue_wait = now - request.enqueued
+                priority = PRIORITY_NAMES.get(request.priority, request.priority)
+                self.queue_waits[(upstream, priority)].append(queue_wait)
+                METRICS.observe(f"scheduler.{upstream}.queue_wait", queue_wait)
+                self._pool.submit(self._execute, request)
+        return wait
+
+    def _execute(self, request: _Request) -> None:
+        result, error = None, None
+        try:
+            result = request.fnc(*request.args, **request.kwargs)
+        except BaseException as e:
+            error = e
+        with self._cond:
+            self._running[request.upstream] -= 1
+            if is_rate_limited(result, error):
+                self.stats[f"{request.upstream}.throttled"] += 1
+                METRICS.increment(f"scheduler.{request.upstream}.throttled")
+                self._bucket(request.upstream, request.model).pause(
+                    time.monotonic(), UPSTREAM_THROTTLE_SECONDS
+                )
+            self._cond.notify()
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(result)
+
+    def queued(self) -> Dict[str, int]:
+        """
+        Returns how many calls are waiting for each upstream.
+
+        Returns:
+            Dict[str, int]: Upstream -> queued calls.
+        """
+        with self._cond:
+            return {upstream: len(queue) for upstream, queue in self._queues.items()}
+
+    def close(self) -> None:
+        """Stops dispatching, cancels every queued call and waits for running calls to finish."""
+        with self._cond:
+            self._closed = True
+            for queue in self._queues.values():
+                for _, _, request in queue:
+                    request.future.cancel()
+                queue.clear()
+            self._cond.notify()
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
+        if self._shared is not None:
+            self._shared.close()
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from agent.tools.HedgedExecutor import FallbackCache
+from agent.utils.metrics_utils import METRICS
+from agent.utils.url_utils import canonicalize_url, extract_html_title
+from agent.config import (
+    HTTP_POOL_SIZE,
+    URL_VALIDATION_TIMEOUT_SECONDS,
+    URL_VALIDATION_DEADLINE_SECONDS,
+    URL_VALIDATION_MAX_CONCURRENCY,
+    URL_VALIDATION_MAX_BYTES,
+    URL_TITLE_MAX_CHARS,
+    URL_VALIDATION_USER_AGENT,
+    URL_DEAD_STATUSES,
+    URL_CACHE_SIZE,
+    URL_CACHE_TTL_SECONDS,
+    URL_DEAD_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# link checks shared by every job in the process, so popular retailer pages are only fetched once per TTL;
+# dead links are cached for less time, in case they were only briefly down
+URL_CACHE = FallbackCache(URL_CACHE_SIZE, URL_CACHE_TTL_SECONDS)
+DEAD_URL_CACHE = FallbackCache(URL_CACHE_SIZE, URL_DEAD_CACHE_TTL_SECONDS)
+
+
+class UrlValidator:
+    """
+    Checks links before open_urls opens them: follows redirects, drops dead links and merges duplicates.
+
+    Each URL is fetched with a streamed GET through a pooled session, reading at most max_bytes to find the
+    page title. A link is dead if the request fails to connect or the final response has one of the
+    URL_DEAD_STATUSES (404 and 410 by default); other errors such as 403 or 503 are what retailers often answer
+    automated requests with, so those links are kept. Results are cached by canonical URL, and URLs that are the
+    same page after canonicalization, or that redirect to the same page, are opened once.
+
+    A batch is checked concurrently and given deadline_seconds in total. Links not checked by then are kept
+    as given rather than dropped, since a slow site is not a dead one.
+
+    Counters: "url_validation.checked", "url_validation.cached", "url_validation.dead",
+    "url_validation.duplicates" and "url_validation.unchecked".
+    """
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout_seconds: float = URL_VALIDATION_TIMEOUT_SECONDS,
+        deadline_seconds: float = URL_VALIDATION_DEADLINE_SECONDS,
+        max_concurrency: int = URL_VALIDATION_MAX_CONCURRENCY,
+        max_bytes: int = URL_VALIDATION_MAX_BYTES,
+        cache: FallbackCache = URL_CACHE,
+        dead_cache: FallbackCache = DEAD_URL_CACHE,
+    ):
+        """
+        Initializes the validator.
+
+        Args:
+            session (requests.Session, optional): The session links are fetched with. Defaults to a new pooled session.
+            pool_size (int, optional): Hosts kept in a new session's pool, and pooled connections per host.
+                Defaults to HTTP_POOL_SIZE.
+            timeout_seconds (float, optional): Connect and read timeout per request. Defaults to URL_VALIDATION_TIMEOUT_SECONDS.
+            deadline_seconds (float, optional): Time allowed to check a batch. Defaults to URL_VALIDATION_DEADLINE_SECONDS.
+            max_concurrency (int, optional): The most links checked at once per batch. Defaults to URL_VALIDATION_MAX_CONCURRENCY.
+            max_bytes (int, optional): The most bytes of a page read to find its title. Defaults to URL_VALIDATION_MAX_BYTES.
+            cache (FallbackCache, optional): Where live links are cached. Defaults to the process-wide cache.
+            dead_cache (FallbackCache, optional): Where dead links are cached. Defaults to the process-wide cache.
+        """
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = URL_VALIDATION_USER_AGENT
+        self.session = session
+        self.timeout_seconds = timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_concurrency = max_concurrency
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.dead_cache = dead_cache
+
+    def check(self, url: str) -> Dict:
+        """
+        Fetches a URL, following redirects, and returns what it points to. Blocking; results are cached.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            Dict: The "url" checked, its "status" (None if the request failed), "final_url" after redirects,
+            page "title" (or None), whether it is "alive", whether it came from the "cached" results, and the
+            "error" if the request failed.
+        """
+        key = canonicalize_url(url)
+        cached = self.cache.get(key) or self.dead_cache.get(key)
+        if cached is not None:
+            METRICS.increment("url_validation.cached")
+            return {**cached, "url": url, "cached": True}
+
+        METRICS.increment("url_validation.checked")
+        result = {"url": url, "status": None, "final_url": url, "title": None}
+        try:
+            with self.session.get(
+                url, stream=True, allow_redirects=True, timeout=self.timeout_seconds
+            ) as response:
+                result["status"] = response.status_code
+                result["final_url"] = response.url
+                content_type = response.headers.get("Content-Type", "")
+                # error pages have titles too, such as "Access denied", which are not the page the user wants
+                if response.ok and "html" in content_type:
+                    body = b""
+                    for chunk in response.iter_content(chunk_size=8192):
+                        body += chunk
+                        if len(body) >= self.max_bytes or b"</title" in body.lower():
+                            break
+                    result["title"] = extract_html_title(
+                        body, content_type, max_chars=URL_TITLE_MAX_CHARS
+                    )
+            result["alive"] = result["status"] not in URL_DEAD_STATUSES
+        except requests.RequestException as e:
+            result["alive"] = False
+            result["error"] = type(e).__name__
+        if not result["alive"]:
+            METRICS.increment("url_validation.dead")
+        (self.cache if result["alive"] else self.dead_cache).put(key, result)
+        return {**result, "cached": False}
+
+    async def validate(self, urls: List[str]) -> List[Dict]:
+        """
+        Checks a batch of URLs concurrently, in worker threads, and merges duplicates.
+
+        Args:
+            urls (List[str]): The URLs, in the order they should be opened.
+
+        Returns:
+            List[Dict]: One result per distinct page, in the order of the first URL pointing to it, as returned
+            by check(). Dead links are included with "alive" False; links not checked before the deadline are
+            included with "alive" True and "status" None. Each has the "duplicates" that were merged into it.
+        """
+        start = time.perf_counter()
+        distinct = {}
+        for url in urls:
+            distinct.setdefault(canonicalize_url(url), []).append(url)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def check(url):
+            async with semaphore:
+                return await asyncio.to_thread(self.check, url)
+
+        tasks = [asyncio.create_task(check(group[0])) for group in distinct.values()]
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline_seconds)
+        for task in pending:
+            # the request carries on in its worker thread and its result is still cached
+            task.cancel()
+
+        results = {}
+        for task, group in zip(tasks, distinct.values()):
+            if task in done and task.exception() is None:
+                result = task.result()
+            else:
+                METRICS.increment("url_validation.unchecked")
+                result = {
+                    "url": group[0],
+                    "status": None,
+                    "final_url": group[0],
+                    "title": None,
+                    "alive": True,
+                    "cached": False,
+                }
+            # links to different URLs can redirect to the same page
+            merged = results.get(canonicalize_url(result["final_url"]))
+            if merged is not None:
+                merged["duplicates"].extend(group)
+                continue
+            results[canonicalize_url(result["final_url"])] = {
+                **result,
+                "duplicates": group[1:],
+            }
+
+        duplicates = sum(len(result["duplicates"]) for result in results.values())
+        if duplicates:
+            METRICS.increment("url_validation.duplicates", duplicates)
+        METRICS.observe("url_validation.batch", time.perf_counter() - start)
+        return list(results.values())
+
+    def close(self) -> None:
+        """Closes the pooled connections."""
+        self.session.close()
@@ -1,16 +1,165 @@
-import tinydb
-from typing import List, Dict, Any
+import collections
+import logging
+import os
+from typing import Any, Callable, Dict, List
+from agent.config import (
+    DATABASE_BACKEND,
+    TOOL_DATABASE_NAME,
+    SQLITE_DATABASE_NAME,
+    SHARD_DIRECTORY,
+    SHARD_BACKEND,
+    SHARD_COUNT,
+    SEGMENT_DIRECTORY,
+    SEGMENT_SPAN_DAYS,
+    SEGMENT_ARCHIVE_AFTER_DAYS,
+    SEGMENT_MMAP_BYTES,
+)
 
+logger = logging.getLogger(__name__)
 
-def get_schema_from_db(db: tinydb.TinyDB) -> Dict[str, Dict[str, set]]:
+# the tables besides the records that retention rules can purge by age
+PURGEABLE_TABLES = ("web_searches", "usage")
+
+
+def create_agent_database(backend: str = DATABASE_BACKEND, db_file: str = None):
+    """
+    Opens the conversation and tool use database for the configured storage backend.
+
+    Args:
+        backend (str, optional): "tinydb", "sqlite", "sharded" or "segmented". Defaults to DATABASE_BACKEND.
+        db_file (str, optional): Path to the database file, or the shard or segment directory.
+            Defaults to the backend's configured location.
+
+    Returns:
+        AgentDatabase | SQLiteAgentDatabase | ShardedAgentDatabase | SegmentedAgentDatabase: The opened database.
+
+    Raises:
+        ValueError: If the backend is not recognised.
+    """
+    if backend == "tinydb":
+        from agent.tools.AgentDatabase import AgentDatabase
+
+        return AgentDatabase(db_file or TOOL_DATABASE_NAME)
+    if backend == "sqlite":
+        from agent.tools.SQLiteAgentDatabase import SQLiteAgentDatabase
+
+        if (
+            db_file is None
+            and not os.path.exists(SQLITE_DATABASE_NAME)
+            and os.path.exists(TOOL_DATABASE_NAME)
+        ):
+            logger.info(
+                f"Creating {SQLITE_DATABASE_NAME}, but the conversations logged so far are in "
+                f"{TOOL_DATABASE_NAME}. Migrate them with: python -m scripts.migrate_tinydb_to_sqlite "
+                f"{TOOL_DATABASE_NAME} {SQLITE_DATABASE_NAME}"
+            )
+        return SQLiteAgentDatabase(db_file or SQLITE_DATABASE_NAME)
+    if backend == "sharded":
+        from agent.tools.ShardedAgentDatabase import ShardedAgentDatabase
+
+        return ShardedAgentDatabase(
+            db_file or SHARD_DIRECTORY, backend=SHARD_BACKEND, shard_count=SHARD_COUNT
+        )
+    if backend == "segmented":
+        from agent.tools.SegmentedAgentDatabase import SegmentedAgentDatabase
+
+        return SegmentedAgentDatabase(
+            db_file or SEGMENT_DIRECTORY,
+            span_days=SEGMENT_SPAN_DAYS,
+            archive_after_days=SEGMENT_ARCHIVE_AFTER_DAYS,
+            mmap_size=SEGMENT_MMAP_BYTES,
+        )
+    raise ValueError(f"Unknown database backend: {backend}")
+
+
+def notify_listeners(listeners: List[Callable], records: List[Dict[str, Any]]) -> None:
+    """
+    Passes newly stored records to the callbacks registered with a database's add_listener.
+
+    A failing listener is logged and skipped, so it cannot fail the write that triggered it.
+
+    Args:
+        listeners (List[Callable]): The callbacks.
+        records (List[Dict[str, Any]]): The records that were stored.
+    """
+    for listener in listeners:
+        try:
+            listener(records)
+        except Exception as e:
+            logger.info(f"Store listener failed: {e}")
+
+
+# the record fields convert_database_entries_to_conversation needs
+CONVERSATION_FIELDS = ["timestamp", "tool_id", "data_type", "data"]
+
+
+def project_record(record: Dict[str, Any], fields: List[str] = None) -> Dict[str, Any]:
+    """
+    Keeps only the given fields of a record.
+
+    Args:
+        record (Dict[str, Any]): The record.
+        fields (List[str], optional): The fields to keep. Defaults to None (all fields).
+
+    Returns:
+        Dict[str, Any]: The projected record, or the record itself if no fields are given.
+    """
+    if fields is None:
+        return record
+    return {field: record.get(field) for field in fields}
+
+
+def count_field_statistics(records, option_fields: List[str]) -> Dict[str, Dict]:
     """
-    Extracts the schema from a TinyDB database.
+    Counts the types each field holds and the values of the option fields, for a backend's field_statistics.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): The records.
+        option_fields (List[str]): Fields whose values are counted.
+
+    Returns:
+        Dict[str, Dict]: "types" maps each field to the set of Python type names it holds, "options" maps each
+        option field to a Counter of its values.
+    """
+    types = {}
+    options = {field: collections.Counter() for field in option_fields}
+    for record in records:
+        for key, value in record.items():
+            types.setdefault(key, set()).add(type(value).__name__)
+            if key in options:
+                options[key][value] += 1
+    return {"types": types, "options": options}
+
+
+def merge_field_statistics(statistics: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+    """
+    Merges the field statistics of several databases, e.g. the shards or segments of a store.
+
+    Args:
+        statistics (List[Dict[str, Dict]]): The field_statistics of each database.
+
+    Returns:
+        Dict[str, Dict]: The combined statistics, in the same shape.
+    """
+    types = {}
+    options = {}
+    for part in statistics:
+        for field, type_names in part["types"].items():
+            types.setdefault(field, set()).update(type_names)
+        for field, counts in part["options"].items():
+            options.setdefault(field, collections.Counter()).update(counts)
+    return {"types": types, "options": options}
+
+
+def get_schema_from_db(db) -> Dict[str, Dict[str, set]]:
+    """
+    Extracts the schema from a TinyDB database or AgentDatabase.
 
     This function analyzes all records in the database to infer the schema.
     It identifies unique keys and their associated data types.  It also identifies if the keys are options and stores them.
 
     Args:
-        db (tinydb.TinyDB): The TinyDB database instance.
+        db (tinydb.TinyDB | AgentDatabase): Any database exposing all().
 
     Returns:
         Dict[str, Dict[str, set]]: A dictionary representing the schema.
@@ -35,7 +184,7 @@ def get_schema_from_db(db: tinydb.TinyDB) -> Dict[str, Dict[str, set]]:
     return schema
 
 
-def run_generated_query(db: tinydb.TinyDB, query_string: str) -> List[Dict[str, Any]]:
+def run_generated_query(db, query_string: str) -> List[Dict[str, Any]]:
     """
     Executes a TinyDB query generated as a string.
 
@@ -44,12 +193,14 @@ def run_generated_query(db: tinydb.TinyDB, query_string: str) -> List[Dict[str,
     It handles potential errors during query execution and returns either the query results or an error message.
 
     Args:
-        db (tinydb.TinyDB): The TinyDB database instance.
+        db (tinydb.TinyDB | AgentDatabase): Any database exposing search() for TinyDB queries.
         query_string (str): The query string generated by the LLM.
 
     Returns:
         List[Dict[str, Any]]: The result of the query. Returns an empty list if there is an error.
     """
+    import tinydb
+
     try:
         # Provide the necessary context for eval: the tinydb module and the Query class
         operation = query_string.split("(")[0].split(".")[1]
@@ -0,0 +1,432 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+from typing import Dict, List, Optional
+import numpy as np
+from agent.utils.time_utils import epoch_ms_to_datetime, record_epoch_ms, to_epoch_ms
+from agent.config import (
+    EXPORT_FORMAT,
+    EXPORT_IMAGES,
+    EXPORT_FIRST_RUN_DAYS,
+    EXPORT_SETTLE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_STATE_NAME = "export_state.json"
+# every exported column; "data_chars" is the length of the record's data, so image sizes can be analysed
+# even though image payloads are not exported
+EXPORT_COLUMNS = [
+    "id",
+    "timestamp_ms",
+    "user_id",
+    "conversation_id",
+    "tool_id",
+    "data_type",
+    "data",
+    "data_chars",
+]
+INTEGER_COLUMNS = ["timestamp_ms", "data_chars"]
+# low-cardinality string columns, stored dictionary encoded
+CATEGORY_COLUMNS = ["user_id", "conversation_id", "tool_id", "data_type"]
+
+
+def resolve_export_format(export_format: str = EXPORT_FORMAT) -> str:
+    """
+    Resolves the "auto" export format to "parquet" if pyarrow is installed and "numpy" otherwise.
+
+    Args:
+        export_format (str, optional): "auto", "parquet" or "numpy". Defaults to EXPORT_FORMAT.
+
+    Returns:
+        str: "parquet" or "numpy".
+
+    Raises:
+        ValueError: If the format is not recognised.
+    """
+    if export_format == "auto":
+        try:
+            import pyarrow  # noqa: F401
+
+            return "parquet"
+        except ImportError:
+            return "numpy"
+    if export_format not in ("parquet", "numpy"):
+        raise ValueError(f"Unknown export format: {export_format}")
+    return export_format
+
+
+def read_export_state(export_dir: str) -> Optional[dict]:
+    """
+    Reads the state an export directory keeps between runs.
+
+    Args:
+        export_dir (str): The export directory.
+
+    Returns:
+        dict: "format", "runs", "watermark_ms" (the newest exported timestamp) and "watermark_ids" (the IDs
+        exported at exactly that time), or None if nothing has been exported yet.
+    """
+    path = os.path.join(export_dir, EXPORT_STATE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_export_state(export_dir: str, state: dict) -> None:
+    """
+    Atomically replaces the state of an export directory.
+
+    Args:
+        export_dir (str): The export directory.
+        state (dict): The new state.
+    """
+    path = os.path.join(export_dir, EXPORT_STATE_NAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(path + ".tmp", path)
+
+
+def export_row(record: dict) -> dict:
+    """
+    Converts a record to an export row. Image payloads are replaced by None; the record's ID references them.
+
+    Args:
+        record (dict): A stored record, optionally read without its payload and with its "data_chars".
+
+    Returns:
+        dict: The row, with one value per EXPORT_COLUMNS entry.
+    """
+    data = record.get("data")
+    data_chars = (
+        record["data_chars"]
+        if "data_chars" in record
+        else len(data) if isinstance(data, str) else 0
+    )
+    return {
+        "id": record["id"],
+        "timestamp_ms": record_epoch_ms(record),
+        "user_id": record.get("user_id"),
+        "conversation_id": record.get("conversation_id"),
+        "tool_id": record.get("tool_id"),
+        "data_type": record.get("data_type"),
+        "data": (
+            None if record.get("data_type") == "image" or data is None else str(data)
+        ),
+        "data_chars": data_chars or 0,
+    }
+
+
+def _day_windows(start_ms: int, end_ms: int):
+    # local calendar days, matching the local "timestamp" strings records are stored with
+    day = epoch_ms_to_datetime(start_ms).date()
+    while True:
+        next_day_ms = to_epoch_ms(
+            datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+        )
+        yield day, start_ms, min(next_day_ms, end_ms)
+        if next_day_ms >= end_ms:
+            return
+        day += datetime.timedelta(days=1)
+        start_ms = next_day_ms
+
+
+def _columns(rows: List[dict]) -> Dict[str, list]:
+    return {column: [row[column] for row in rows] for column in EXPORT_COLUMNS}
+
+
+def _write_parquet(path: str, columns: Dict[str, list]) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrays = {}
+    for column, values in columns.items():
+        if column in INTEGER_COLUMNS:
+            arrays[column] = pa.array(values, type=pa.int64())
+        elif column in CATEGORY_COLUMNS:
+            arrays[column] = pa.array(values, type=pa.string()).dictionary_encode()
+        else:
+            arrays[column] = pa.array(values, type=pa.string())
+    pq.write_table(pa.table(arrays), path, compression="zstd")
+
+
+def _write_numpy(path: str, columns: Dict[str, list]) -> None:
+    # one file per column: int64 arrays for integers, int32 codes plus a JSON list of categories for category
+    # columns (-1 is null), and a UTF-8 blob with int64 offsets and a null mask for free text
+    os.makedirs(path)
+    for column, values in columns.items():
+        if column in INTEGER_COLUMNS:
+            np.save(os.path.join(path, f"{column}.npy"), np.asarray(values, np.int64))
+        elif column in CATEGORY_COLUMNS:
+            categories = sorted({value for value in values if value is not None})
+            index = {value: code for code, value in enumerate(categories)}
+            codes = np.fromiter(
+                (index.get(value, -1) for value in values), np.int32, len(values)
+            )
+            np.save(os.path.join(path, f"{column}.codes.npy"), codes)
+            with open(os.path.join(path, f"{column}.categories.json"), "w") as file:
+                json.dump(categories, file)
+        else:
+            encoded = [(value or "").encode("utf-8") for value in values]
+            offsets = np.zeros(len(encoded) + 1, np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            np.save(os.path.join(path, f"{column}.offsets.npy"), offsets)
+            np.save(
+                os.path.join(path, f"{column}.nulls.npy"),
+                np.fromiter((value is None for value in values), bool, len(values)),
+            )
+            with open(os.path.join(path, f"{column}.bin"), "wb") as file:
+                file.write(b"".join(encoded))
+
+
+def _remove_part(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def export_new_records(
+    database,
+    export_dir: str,
+    export_format: str = EXPORT_FORMAT,
+    images: str = EXPORT_IMAGES,
+    since=None,
+    until=None,
+) -> dict:
+    """
+    Exports the records stored since the previous run to day-partitioned columnar files.
+
+    Records are read one local calendar day at a time with get_data_by_time_range, so only a day's records are
+    held in memory, and each day with new records gets a new part file, e.g. "day=2025-01-31/part-00003.parquet",
+    so earlier parts are never rewritten. Parts are written under a hidden temporary name and renamed into place
+    once the state covers them, so readers never see a partial part and a rerun after a crash neither fails nor
+    duplicates rows. Image payloads are never read. The newest exported timestamp is kept in the directory's state
+    file, and the next run starts from it. Records inserted later with an older timestamp (e.g. by a migration) are
+    not picked up; export them into a fresh directory.
+
+    Args:
+        database: Any conversation database backend.
+        export_dir (str): The export directory, created if needed.
+        export_format (str, optional): "auto", "parquet" (needs pyarrow) or "numpy". A directory keeps the
+            format of its first run. Defaults to EXPORT_FORMAT.
+        images (str, optional): "reference" exports image records without their payload, "exclude" skips them.
+            Defaults to EXPORT_IMAGES.
+        since (int | str | datetime.datetime, optional): Where the first run starts. Defaults to
+            EXPORT_FIRST_RUN_DAYS days ago.
+        until (int | str | datetime.datetime, optional): Where the run stops (exclusive). Defaults to
+            EXPORT_SETTLE_SECONDS before now, so writes in flight are not skipped.
+
+    Returns:
+        dict: The format, the number of rows exported and the part files written.
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    state = read_export_state(export_dir)
+    if state is None:
+        if since is None:
+            since = datetime.datetime.now() - datetime.timedelta(
+                days=EXPORT_FIRST_RUN_DAYS
+            )
+        state = {
+            "format": resolve_export_format(export_format),
+            "runs": 0,
+            "watermark_ms": to_epoch_ms(since),
+            "watermark_ids": [],
+        }
+    if until is None:
+        until = datetime.datetime.now() - datetime.timedelta(
+            seconds=EXPORT_SETTLE_SECONDS
+        )
+    end_ms = to_epoch_ms(until)
+    # a run interrupted between saving its state and renaming its last part leaves the rename to this one
+    pending = state.pop("pending", None)
+    if pending and os.path.exists(os.path.join(export_dir, pending[0])):
+        os.replace(
+            os.path.join(export_dir, pending[0]), os.path.join(export_dir, pending[1])
+        )
+    writer = _write_parquet if state["format"] == "parquet" else _write_numpy
+    run = state["runs"] + 1
+    exported_ids = set(state["watermark_ids"])
+    report = {"format": state["format"], "rows": 0, "parts": []}
+    if state["watermark_ms"] >= end_ms:
+        return report
+
+    for day, start_ms, stop_ms in _day_windows(state["watermark_ms"], end_ms):
+        records = database.get_data_by_time_range(
+            start_ms,
+            stop_ms,
+            remove_image_data=images == "exclude",
+            image_payloads=False,
+        )
+        rows = sorted(
+            (
+                export_row(record)
+                for record in records
+                if record["id"] not in exported_ids
+            ),
+            key=lambda row: row["timestamp_ms"],
+        )
+        if not rows:
+            continue
+        partition = os.path.join(export_dir, f"day={day.isoformat()}")
+        os.makedirs(partition, exist_ok=True)
+        # temporary parts left here by an interrupted run hold rows its state does not cover, which are
+        # exported again now
+        for name in os.listdir(partition):
+            if name.startswith(".part-"):
+                _remove_part(os.path.join(partition, name))
+        name = f"part-{run:05d}" + (".parquet" if state["format"] == "parquet" else "")
+        path = os.path.join(partition, name)
+        temp_path = os.path.join(partition, f".{name}.tmp")
+        writer(temp_path, _columns(rows))
+        report["rows"] += len(rows)
+        report["parts"].append(path)
+
+        watermark_ms = rows[-1]["timestamp_ms"]
+        if watermark_ms != state["watermark_ms"]:
+            state["watermark_ids"] = []
+        state["watermark_ms"] = watermark_ms
+        state["watermark_ids"] += [
+            row["id"] for row in rows if row["timestamp_ms"] == watermark_ms
+        ]
+        exported_ids = set(state["watermark_ids"])
+        # the state is saved after every part, so an interrupted run resumes after the last complete day, and
+        # the part is only renamed into place once the state covers its rows
+        state["runs"] = run
+        state["pending"] = [
+            os.path.relpath(temp_path, export_dir),
+            os.path.relpath(path, export_dir),
+        ]
+        write_export_state(export_dir, state)
+        os.replace(temp_path, path)
+
+    logger.info(f"Exported {report['rows']} records to {len(report['parts'])} parts")
+    return report
+
+
+def _partitions(export_dir: str, start_day=None, end_day=None):
+    for name in sorted(os.listdir(export_dir)):
+        if not name.startswith("day="):
+            continue
+        day = datetime.date.fromisoformat(name[len("day=") :])
+        if (start_day is None or day >= start_day) and (
+            end_day is None or day <= end_day
+        ):
+            yield day, os.path.join(export_dir, name)
+
+
+def _read_numpy_column(path: str, column: str) -> np.ndarray:
+    if column in INTEGER_COLUMNS:
+        return np.load(os.path.join(path, f"{column}.npy"))
+    if column in CATEGORY_COLUMNS:
+        codes = np.load(os.path.join(path, f"{column}.codes.npy"))
+        with open(os.path.join(path, f"{column}.categories.json")) as file:
+            categories = np.array(json.load(file) + [""], dtype=str)
+        # code -1 (null) picks the trailing ""
+        return categories[codes]
+    offsets = np.load(os.path.join(path, f"{column}.offsets.npy"))
+    with open(os.path.join(path, f"{column}.bin"), "rb") as file:
+        blob = file.read()
+    return np.array(
+        [blob[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])],
+        dtype=str,
+    )
+
+
+def read_export_columns(
+    export_dir: str,
+    columns: List[str],
+    start_day: Optional[datetime.date] = None,
+    end_day: Optional[datetime.date] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Reads columns of an export as NumPy arrays, only opening the day partitions in range.
+
+    Args:
+        export_dir (str): The export directory.
+        columns (List[str]): The columns to read; "day" gives each row's partition date as datetime64[D].
+        start_day (datetime.date, optional): First day to read. Defaults to None (the first partition).
+        end_day (datetime.date, optional): Last day to read (inclusive). Defaults to None (the last partition).
+
+    Returns:
+        Dict[str, np.ndarray]: One array per column, int64 for integers and strings otherwise, with nulls as "".
+    """
+    state = read_export_state(export_dir)
+    export_format = state["format"] if state else "numpy"
+    stored = [column for column in columns if column != "day"]
+    chunks = {column: [] for column in columns}
+    for day, partition in _partitions(export_dir, start_day, end_day):
+        for part in sorted(os.listdir(partition)):
+            if part.startswith("."):
+                continue
+            path = os.path.join(partition, part)
+            if export_format == "parquet":
+                import pyarrow.parquet as pq
+
+                table = pq.read_table(path, columns=stored)
+                part_columns = {}
+                for column in stored:
+                    values = table.column(column).combine_chunks()
+                    if hasattr(values, "dictionary_decode"):
+                        values = values.dictionary_decode()
+                    if column in INTEGER_COLUMNS:
+                        part_columns[column] = values.to_numpy(zero_copy_only=False)
+                    else:
+                        part_columns[column] = np.array(
+                            values.fill_null("").to_pylist(), dtype=str
+                        )
+                rows = table.num_rows
+            else:
+                part_columns = {
+                    column: _read_numpy_column(path, column) for column in stored
+                }
+                rows = len(
+                    np.load(os.path.join(path, "timestamp_ms.npy"), mmap_mode="r")
+                )
+            for column in stored:
+                chunks[column].append(part_columns[column])
+            if "day" in chunks:
+                chunks["day"].append(np.full(rows, np.datetime64(day, "D")))
+    empty = {column: np.array([], dtype=str) for column in columns}
+    empty.update(
+        {column: np.array([], dtype=np.int64) for column in INTEGER_COLUMNS},
+        day=np.array([], dtype="datetime64[D]"),
+    )
+    return {
+        column: np.concatenate(parts) if parts else empty[column]
+        for column, parts in chunks.items()
+    }
+
+
+def tool_usage_per_day(
+    export_dir: str,
+    start_day: Optional[datetime.date] = None,
+    end_day: Optional[datetime.date] = None,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Counts tool calls per day from an export, as one vectorised scan over the day, tool_id and data_type columns.
+
+    Args:
+        export_dir (str): The export directory.
+        start_day (datetime.date, optional): First day to count. Defaults to None (the first partition).
+        end_day (datetime.date, optional): Last day to count (inclusive). Defaults to None (the last partition).
+
+    Returns:
+        Dict[str, Dict[str, int]]: ISO date -> tool_id -> number of calls (tool "input" records).
+    """
+    columns = read_export_columns(
+        export_dir, ["day", "tool_id", "data_type"], start_day, end_day
+    )
+    calls = (columns["data_type"] == "input") & (columns["tool_id"] != "")
+    days, tools = columns["day"][calls], columns["tool_id"][calls]
+    keys, counts = np.unique(
+        np.char.add(np.char.add(days.astype(str), "|"), tools), return_counts=True
+    )
+    usage = {}
+    for key, count in zip(keys, counts):
+        day, tool_id = key.split("|", 1)
+        usage.setdefault(day, {})[tool_id] = int(count)
+    return usage
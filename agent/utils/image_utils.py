@@ -1,19 +1,267 @@
 import io
+import asyncio
 import base64
+import logging
+import math
+import re
+import numpy as np
 from livekit import rtc
-from PIL import Image
+from PIL import Image, ImageFilter
 from livekit.agents import llm, utils
+from agent.utils.metrics_utils import span
+from agent.config import (
+    ADAPTIVE_IMAGE_POLICY,
+    IMAGE_MODEL,
+    IMAGE_POLICIES,
+    IMAGE_TEXT_DENSITY_THRESHOLD,
+    IMAGE_TOKEN_COSTS,
+    SCREENSHOT_DELTA_MODE,
+    SCREENSHOT_DELTA_BLOCK,
+    SCREENSHOT_DELTA_THRESHOLD,
+    SCREENSHOT_DELTA_MAX_FRACTION,
+    CAMERA_BURST_FRAMES,
+    CAMERA_BURST_BUDGET_SECONDS,
+    CAMERA_SHARPNESS_WIDTH,
+)
 
+logger = logging.getLogger(__name__)
 
-def encode_image(image):
+# questions that need fine detail read off the image, e.g. prices and small print
+READ_TEXT_PATTERN = re.compile(
+    r"\b(price|prices|priced|cost|costs|how much|text|say|says|read|written|number|spec|specs|"
+    r"size|sizes|rating|ratings|review|reviews|stars|shipping|total|discount|deal|model)\b"
+)
+# questions about what an object is, which a low resolution image answers
+OBJECT_PATTERN = re.compile(
+    r"\b(what is this|what's this|what am i holding|identify|brand|colou?r|what kind|what type|"
+    r"similar|look like|looks like|material|made of|recogni[sz]e)\b"
+)
+
+
+def encode_image(image, quality=None):
+    """
+    Encodes a PIL image as a base64 JPEG.
+
+    Args:
+        image (PIL.Image.Image): The image.
+        quality (int, optional): JPEG quality from 1 to 95. Defaults to None, PIL's default of 75.
+
+    Returns:
+        str: The base64 encoded JPEG.
+    """
     buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
+    if quality is None:
+        image.save(buffered, format="JPEG")
+    else:
+        image.save(buffered, format="JPEG", quality=quality)
     return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
 
+def text_density(image):
+    """
+    Estimates how much of an image is text or fine detail, as the fraction of edge pixels in a small greyscale copy.
+
+    Args:
+        image (PIL.Image.Image): The image.
+
+    Returns:
+        float: The fraction of edge pixels, between 0 and 1. Product pages with prices and specs score high,
+        photos of a single object low.
+    """
+    small = image.convert("L")
+    small.thumbnail((256, 256))
+    histogram = small.filter(ImageFilter.FIND_EDGES).histogram()
+    return sum(histogram[40:]) / max(1, sum(histogram))
+
+
+def select_image_policy(question, image=None, adaptive=ADAPTIVE_IMAGE_POLICY):
+    """
+    Picks the resolution, JPEG quality and OpenAI detail level to send an image at, from the question and,
+    when it is available, the image content.
+
+    Questions about prices, specs or other text get "read_text", questions about what an object is get "object".
+    Otherwise the image decides: text heavy images get "read_text" and the rest "layout".
+
+    Args:
+        question (str): The question asked about the image.
+        image (PIL.Image.Image, optional): The image, if it has already been captured. Defaults to None.
+        adaptive (bool, optional): Whether to adapt at all. Defaults to ADAPTIVE_IMAGE_POLICY; when False the
+            "legacy" policy is always returned.
+
+    Returns:
+        tuple: The policy name and the policy, a dict with "max_width", "jpeg_quality" and "detail".
+    """
+    if not adaptive:
+        return "legacy", IMAGE_POLICIES["legacy"]
+    question = (question or "").lower()
+    if READ_TEXT_PATTERN.search(question):
+        name = "read_text"
+    elif OBJECT_PATTERN.search(question):
+        name = "object"
+    elif image is not None and text_density(image) >= IMAGE_TEXT_DENSITY_THRESHOLD:
+        name = "read_text"
+    else:
+        name = "layout"
+    return name, IMAGE_POLICIES[name]
+
+
+def resize_to_width(image, max_width):
+    """
+    Scales an image down to a maximum width, keeping its aspect ratio. Images that are already narrower are
+    returned unchanged.
+
+    Args:
+        image (PIL.Image.Image): The image.
+        max_width (int): The maximum width in pixels.
+
+    Returns:
+        PIL.Image.Image: The resized image.
+    """
+    width, height = image.size
+    if width <= max_width:
+        return image
+    return image.resize((max_width, max(1, int(height * max_width / width))))
+
+
+def estimate_image_tokens(width, height, detail="high", model=IMAGE_MODEL):
+    """
+    Estimates the input tokens OpenAI bills for an image, using its published tiling rules.
+
+    "low" detail costs a flat base amount. "high" (and "auto", which behaves as high for images larger than
+    512px) scales the image to fit 2048x2048, then its shortest side to 768px, and adds a cost per 512px tile.
+
+    Args:
+        width (int): Image width in pixels.
+        height (int): Image height in pixels.
+        detail (str, optional): "low", "high" or "auto". Defaults to "high".
+        model (str, optional): The model, which selects the costs from IMAGE_TOKEN_COSTS. Defaults to IMAGE_MODEL.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    costs = IMAGE_TOKEN_COSTS.get(model, IMAGE_TOKEN_COSTS["default"])
+    if detail == "low" or (detail == "auto" and max(width, height) <= 512):
+        return costs["base"]
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return costs["base"] + costs["tile"] * tiles
+
+
+def to_grey_array(image):
+    """
+    Converts an image to the greyscale array screenshot_delta compares.
+
+    Args:
+        image (PIL.Image.Image): The image.
+
+    Returns:
+        np.ndarray: A (height, width) uint8 array.
+    """
+    return np.asarray(image.convert("L"), dtype=np.uint8)
+
+
+def screenshot_delta(
+    previous,
+    current,
+    block=SCREENSHOT_DELTA_BLOCK,
+    threshold=SCREENSHOT_DELTA_THRESHOLD,
+):
+    """
+    Finds the region that changed between two captures of the screen with a block diff: the mean absolute grey
+    level difference is computed for every block x block tile, and tiles above the threshold count as changed.
+
+    Args:
+        previous (np.ndarray): The previous capture, from to_grey_array, or None.
+        current (np.ndarray): The new capture, from to_grey_array.
+        block (int, optional): Tile size in pixels. Defaults to SCREENSHOT_DELTA_BLOCK.
+        threshold (float, optional): Mean grey level difference above which a tile has changed.
+            Defaults to SCREENSHOT_DELTA_THRESHOLD.
+
+    Returns:
+        tuple: The bounding box (left, top, right, bottom) of the changed tiles, or None if nothing changed, and
+        the fraction of the screen the box covers. Returns None instead if the captures cannot be compared
+        (there is no previous capture or the screen size changed).
+    """
+    if previous is None or previous.shape != current.shape:
+        return None
+    height, width = current.shape
+    pad = ((0, -height % block), (0, -width % block))
+    diff = np.abs(current.astype(np.int16) - previous.astype(np.int16))
+    diff = np.pad(diff, pad)
+    rows, cols = diff.shape[0] // block, diff.shape[1] // block
+    changed = diff.reshape(rows, block, cols, block).mean(axis=(1, 3)) > threshold
+    if not changed.any():
+        return None, 0.0
+    changed_rows = np.flatnonzero(changed.any(axis=1))
+    changed_cols = np.flatnonzero(changed.any(axis=0))
+    box = (
+        int(changed_cols[0]) * block,
+        int(changed_rows[0]) * block,
+        min(width, (int(changed_cols[-1]) + 1) * block),
+        min(height, (int(changed_rows[-1]) + 1) * block),
+    )
+    fraction = (box[2] - box[0]) * (box[3] - box[1]) / (width * height)
+    return box, fraction
+
+
+def encode_full_screenshot(screenshot, policy):
+    """
+    Encodes a whole screenshot at an image policy's resolution and JPEG quality.
+
+    Args:
+        screenshot (PIL.Image.Image): The full resolution screenshot.
+        policy (dict): The image policy from select_image_policy.
+
+    Returns:
+        tuple: The base64 JPEG and the policy's detail level.
+    """
+    image = resize_to_width(screenshot, policy["max_width"])
+    return encode_image(image, quality=policy["jpeg_quality"]), policy["detail"]
+
+
+def encode_screenshot(screenshot, policy, delta=None, mode=SCREENSHOT_DELTA_MODE):
+    """
+    Encodes a screenshot for a vision request, sending only what changed since the previous one when that is small.
+
+    Args:
+        screenshot (PIL.Image.Image): The full resolution screenshot.
+        policy (dict): The image policy from select_image_policy.
+        delta (tuple, optional): The result of screenshot_delta against the previous capture. Defaults to None.
+        mode (str, optional): "composite" sends a low resolution full frame plus the changed region at the policy's
+            resolution, "crop" sends only the changed region and "off" always sends the full frame.
+            Defaults to SCREENSHOT_DELTA_MODE.
+
+    Returns:
+        tuple: How the screenshot was sent ("full", "unchanged", "crop" or "composite"), and a list of
+        (base64 JPEG, detail level) pairs to send in that order. An unchanged screen is sent as a full frame, as
+        there is no region to crop.
+    """
+    scale = min(1.0, policy["max_width"] / screenshot.size[0])
+
+    if mode == "off" or delta is None or delta[1] > SCREENSHOT_DELTA_MAX_FRACTION:
+        return "full", [encode_full_screenshot(screenshot, policy)]
+    box = delta[0]
+    if box is None:
+        return "unchanged", [encode_full_screenshot(screenshot, policy)]
+
+    # the crop keeps the scale the full frame would have been sent at, so text stays as legible
+    crop = screenshot.crop(box)
+    crop = crop.resize(
+        (max(1, int(crop.size[0] * scale)), max(1, int(crop.size[1] * scale)))
+    )
+    crop_image = (encode_image(crop, quality=policy["jpeg_quality"]), policy["detail"])
+    if mode == "crop":
+        return "crop", [crop_image]
+    low_res_frame = encode_full_screenshot(screenshot, IMAGE_POLICIES["object"])
+    return "composite", [low_res_frame, crop_image]
+
+
 def convert_base64_to_pil(base64_string):
     try:
-        image_bytes = io.BytesIO(base64.b16decode(base64_string))
+        image_bytes = io.BytesIO(base64.b64decode(base64_string))
         image = Image.open(image_bytes)
         return image
     except Exception as e:
@@ -42,22 +290,169 @@ async def get_latest_image(room: rtc.Room):
             await video_stream.aclose()
 
 
-async def capture_image_from_video_stream(room: rtc.Room):
-    latest_image = await get_latest_image(room)
+def laplacian_variance(grey):
+    """
+    Scores how sharp an image is as the variance of its Laplacian. Blur removes the high frequencies the
+    Laplacian responds to, so motion-blurred frames score far lower than steady ones of the same scene.
+
+    Args:
+        grey (np.ndarray): A (height, width) greyscale array.
+
+    Returns:
+        float: The sharpness score, higher is sharper.
+    """
+    grey = grey.astype(np.float32)
+    laplacian = (
+        grey[:-2, 1:-1]
+        + grey[2:, 1:-1]
+        + grey[1:-1, :-2]
+        + grey[1:-1, 2:]
+        - 4 * grey[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+# offsets of the red, green and blue bytes in each pixel of the packed video formats
+_RGB_CHANNELS = {
+    rtc.VideoBufferType.RGBA: (0, 1, 2),
+    rtc.VideoBufferType.BGRA: (2, 1, 0),
+    rtc.VideoBufferType.ARGB: (1, 2, 3),
+    rtc.VideoBufferType.ABGR: (3, 2, 1),
+}
+
+
+def frame_sharpness(frame: rtc.VideoFrame, max_width=CAMERA_SHARPNESS_WIDTH):
+    """
+    Scores the sharpness of a video frame with laplacian_variance on a subsampled greyscale copy.
+
+    Args:
+        frame (rtc.VideoFrame): The frame.
+        max_width (int, optional): The frame is subsampled to at most this width before scoring.
+            Defaults to CAMERA_SHARPNESS_WIDTH.
+
+    Returns:
+        float: The sharpness score, higher is sharper.
+    """
+    step = max(1, math.ceil(frame.width / max_width))
+    if frame.type in (
+        rtc.VideoBufferType.I420,
+        rtc.VideoBufferType.I420A,
+        rtc.VideoBufferType.NV12,
+    ):
+        # the first plane of these formats is already the luma
+        plane = np.frombuffer(frame.get_plane(0), dtype=np.uint8)
+        grey = plane.reshape(frame.height, -1)[::step, : frame.width : step]
+    else:
+        if frame.type not in _RGB_CHANNELS:
+            frame = frame.convert(rtc.VideoBufferType.RGBA)
+        red, green, blue = _RGB_CHANNELS[frame.type]
+        pixels = np.frombuffer(frame.data, dtype=np.uint8).reshape(
+            frame.height, frame.width, 4
+        )[::step, ::step]
+        grey = (
+            pixels[..., red].astype(np.uint16) * 77
+            + pixels[..., green].astype(np.uint16) * 150
+            + pixels[..., blue].astype(np.uint16) * 29
+        ) >> 8
+    return laplacian_variance(grey)
+
+
+async def select_sharpest_frame(
+    frames,
+    max_frames=CAMERA_BURST_FRAMES,
+    budget_seconds=CAMERA_BURST_BUDGET_SECONDS,
+):
+    """
+    Reads a burst of frames and returns the sharpest.
+
+    The first frame is always waited for. After that frames are read until max_frames have been scored or
+    budget_seconds have passed since the burst started, whichever comes first.
 
-    image_options = utils.images.EncodeOptions()
+    Args:
+        frames: An async iterator of rtc.VideoFrame.
+        max_frames (int, optional): Maximum frames to score. Defaults to CAMERA_BURST_FRAMES.
+        budget_seconds (float, optional): Time allowed for the burst. Defaults to CAMERA_BURST_BUDGET_SECONDS.
+
+    Returns:
+        rtc.VideoFrame: The sharpest frame, or None if the iterator ended without a frame.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None
+    best, best_score, scores = None, None, []
+    while len(scores) < max_frames:
+        timeout = None if deadline is None else deadline - loop.time()
+        if timeout is not None and timeout <= 0:
+            break
+        try:
+            frame = await asyncio.wait_for(frames.__anext__(), timeout)
+        except (StopAsyncIteration, asyncio.TimeoutError):
+            break
+        if deadline is None:
+            deadline = loop.time() + budget_seconds
+        with span("image.score_frame"):
+            score = frame_sharpness(frame)
+        scores.append(score)
+        if best_score is None or score > best_score:
+            best, best_score = frame, score
+    if len(scores) > 1:
+        logger.info(
+            f"Picked frame {scores.index(best_score) + 1} of {len(scores)}, sharpness {best_score:.0f} "
+            f"(worst {min(scores):.0f})"
+        )
+    return best
+
+
+async def get_sharpest_image(
+    room: rtc.Room,
+    max_frames=CAMERA_BURST_FRAMES,
+    budget_seconds=CAMERA_BURST_BUDGET_SECONDS,
+):
+    video_stream = None
+    try:
+        video_track = await get_video_track(room)
+        # the stream only needs to buffer one burst; older frames are dropped
+        video_stream = rtc.VideoStream(video_track, capacity=max_frames)
+
+        async def frames():
+            async for event in video_stream:
+                yield event.frame
+
+        return await select_sharpest_frame(frames(), max_frames, budget_seconds)
+    finally:
+        if video_stream:
+            await video_stream.aclose()
+
+
+def encode_video_frame(frame: rtc.VideoFrame, quality=75):
+    image_options = utils.images.EncodeOptions(quality=quality)
     image_options.resize_options = utils.images.ResizeOptions(
         width=512, height=512, strategy="scale_aspect_fit"
     )
 
     res = {"pil_image": None, "b64_image": None}
-    if latest_image:
-        image_content = llm.ChatImage(image=latest_image)
-        encoded_data = base64.b64encode(
-            utils.images.encode(image_content.image, image_options)
-        )
-        pil_image = convert_base64_to_pil(encoded_data)
-        res["pil_image"] = pil_image
-        res["b64_image"] = encoded_data.decode("utf-8")
+    if frame:
+        with span("image.encode_frame"):
+            image_content = llm.ChatImage(image=frame)
+            encoded_data = base64.b64encode(
+                utils.images.encode(image_content.image, image_options)
+            )
+            pil_image = convert_base64_to_pil(encoded_data)
+            res["pil_image"] = pil_image
+            res["b64_image"] = encoded_data.decode("utf-8")
 
     return res
+
+
+async def capture_image_from_video_stream(
+    room: rtc.Room,
+    quality=75,
+    burst_frames=CAMERA_BURST_FRAMES,
+    budget_seconds=CAMERA_BURST_BUDGET_SECONDS,
+):
+    with span("image.capture_frame"):
+        if burst_frames > 1:
+            latest_image = await get_sharpest_image(room, burst_frames, budget_seconds)
+        else:
+            latest_image = await get_latest_image(room)
+
+    return encode_video_frame(latest_image, quality=quality)
@@ -0,0 +1,310 @@
+import re
+from typing import Optional, Set
+
+# words that carry no topic, ignored when comparing an utterance with a tool call's question
+STOPWORDS = {
+    "a",
+    "about",
+    "an",
+    "and",
+    "any",
+    "are",
+    "at",
+    "be",
+    "can",
+    "could",
+    "do",
+    "does",
+    "for",
+    "from",
+    "get",
+    "give",
+    "have",
+    "hey",
+    "how",
+    "i",
+    "if",
+    "in",
+    "is",
+    "it",
+    "just",
+    "know",
+    "let",
+    "like",
+    "me",
+    "my",
+    "of",
+    "on",
+    "one",
+    "or",
+    "please",
+    "so",
+    "some",
+    "tell",
+    "that",
+    "the",
+    "there",
+    "this",
+    "to",
+    "want",
+    "was",
+    "we",
+    "what",
+    "whats",
+    "where",
+    "which",
+    "who",
+    "will",
+    "with",
+    "would",
+    "you",
+    "your",
+}
+
+# phrases that suggest the user wants something looked up online, with how strongly they suggest it
+SEARCH_INTENT_PATTERNS = [
+    (re.compile(r"\b(search|look up|google|find out)\b"), 0.6),
+    (re.compile(r"\b(buy|purchase|order|shop for|in stock|available)\b"), 0.5),
+    (
+        re.compile(r"\b(price|prices|cost|costs|cheap|cheaper|cheapest|deal|deals)\b"),
+        0.5,
+    ),
+    (
+        re.compile(r"\b(discount|sale|coupon|shipping|afford|budget|under \$?\d+)\b"),
+        0.4,
+    ),
+    (
+        re.compile(r"\b(best|top rated|review|reviews|compare|comparison|vs|versus)\b"),
+        0.4,
+    ),
+    (
+        re.compile(
+            r"\b(recommend|recommendation|recommendations|alternative|alternatives)\b"
+        ),
+        0.4,
+    ),
+    (re.compile(r"\b(where can i|where do i|who sells|which store|online)\b"), 0.4),
+    (re.compile(r"\b(latest|new|newest|release|released|today|this year)\b"), 0.2),
+    (re.compile(r"(\$\s?\d+|\b\d+\s?(dollars|bucks|pounds|euros)\b)"), 0.3),
+]
+
+# phrases that point at a different tool (the screen, the camera or the user's history), which rule a search out
+OTHER_TOOL_PATTERNS = [
+    re.compile(r"\b(screen|screenshot|tab|page i'm on|this page|this site)\b"),
+    re.compile(r"\b(camera|holding|in my hand|picture|photo|look at this)\b"),
+    re.compile(r"\b(last time|earlier|before|previous|previously|history|did i)\b"),
+    re.compile(
+        r"\b(open|navigate to|go to) (the |that |those )?(link|links|url|urls|site)\b"
+    ),
+]
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9$]+")
+
+# a question about the pages a past web search cited names a kind of page and how it was given to the user,
+# e.g. "what sites did you show me for monitors?"; nouns are singular, as query_terms returns them
+CITATION_NOUNS = {
+    "site",
+    "website",
+    "link",
+    "url",
+    "source",
+    "citation",
+    "page",
+    "store",
+    "shop",
+    "retailer",
+}
+CITATION_VERBS = {
+    "show",
+    "showed",
+    "shown",
+    "gave",
+    "give",
+    "given",
+    "sent",
+    "send",
+    "found",
+    "find",
+    "cited",
+    "cite",
+    "used",
+    "use",
+    "recommend",
+    "recommended",
+    "suggested",
+    "suggest",
+    "shared",
+    "share",
+    "opened",
+    "open",
+}
+# words in such questions that refer to when the search happened rather than what it was about
+CITATION_IGNORED_TERMS = {
+    "did",
+    "again",
+    "all",
+    "earlier",
+    "before",
+    "previously",
+    "ago",
+    "last",
+    "time",
+    "yesterday",
+    "today",
+    "week",
+    "month",
+    "those",
+    "these",
+    "other",
+}
+
+# a question that recalls a product from earlier conversations, e.g. "the office chair we discussed" or
+# "remind me what we said about the monitor"
+PRODUCT_RECALL_PATTERN = re.compile(
+    r"\b(we|you|i) (discuss|discussed|talk about|talked about|look at|looked at|mention|mentioned|said about|"
+    r"see|saw|compare|compared|consider|considered|like|liked|search for|searched for|find|found|show me|"
+    r"showed me|recommend|recommended|suggest|suggested)\b|\b(remind me|remember|recall)\b"
+)
+# words in such questions that are about the recalling rather than the product
+PRODUCT_RECALL_IGNORED_TERMS = CITATION_IGNORED_TERMS | {
+    "discuss",
+    "discussed",
+    "talk",
+    "talked",
+    "look",
+    "looked",
+    "mention",
+    "see",
+    "compare",
+    "consider",
+    "search",
+    "find",
+    "show",
+    "recommend",
+    "suggest",
+    "mentioned",
+    "said",
+    "saw",
+    "compared",
+    "considered",
+    "liked",
+    "searched",
+    "found",
+    "showed",
+    "recommended",
+    "suggested",
+    "remind",
+    "remember",
+    "recall",
+    "name",
+    "were",
+    "again",
+    # what is being asked about the product rather than which product it is
+    "price",
+    "cost",
+    "much",
+    "link",
+    "called",
+}
+# words that ask about products in general, e.g. "which products did we look at yesterday?"
+PRODUCT_GENERIC_TERMS = {"product", "item", "thing", "model", "brand"}
+
+
+def search_intent_score(text: str) -> float:
+    """
+    Scores how likely an utterance is to lead to a web search, using keyword rules only, so it is cheap
+    enough to run on every committed user utterance.
+
+    Args:
+        text (str): The user's utterance.
+
+    Returns:
+        float: A score between 0 and 1. Utterances that mention the screen, the camera or past
+        conversations score 0, since those are answered by other tools.
+    """
+    text = (text or "").lower()
+    if len(_TOKEN_PATTERN.findall(text)) < 3:
+        return 0.0
+    if any(pattern.search(text) for pattern in OTHER_TOOL_PATTERNS):
+        return 0.0
+    score = sum(
+        weight for pattern, weight in SEARCH_INTENT_PATTERNS if pattern.search(text)
+    )
+    if text.rstrip().endswith("?"):
+        score += 0.1
+    return min(1.0, score)
+
+
+def query_terms(text: str) -> Set[str]:
+    """
+    Returns the topic words of a question, lower cased, without stopwords and with a plural "s" removed.
+
+    Args:
+        text (str): The question or utterance.
+
+    Returns:
+        Set[str]: The terms.
+    """
+    terms = set()
+    for token in _TOKEN_PATTERN.findall((text or "").lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.add(token)
+    return terms
+
+
+def query_similarity(a: Set[str], b: Set[str]) -> float:
+    """
+    Returns the Jaccard similarity of two sets of query terms.
+
+    Args:
+        a (Set[str]): Terms of the first query.
+        b (Set[str]): Terms of the second query.
+
+    Returns:
+        float: The similarity between 0 and 1, or 0 if both are empty.
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def citation_lookup_terms(text: str) -> Optional[Set[str]]:
+    """
+    Recognises questions about the pages past web searches cited, and returns what they were about.
+
+    Args:
+        text (str): The question, e.g. "What sites did you show me for monitors?".
+
+    Returns:
+        Set[str]: The topic terms, e.g. {"monitor"}, empty if the question names no topic, or None if the
+        question is not about cited pages.
+    """
+    terms = query_terms(text)
+    # some of the verbs, such as "give", are stopwords, so they are looked for in the raw words
+    words = set(_TOKEN_PATTERN.findall((text or "").lower()))
+    if not (terms & CITATION_NOUNS and words & CITATION_VERBS):
+        return None
+    return terms - CITATION_NOUNS - CITATION_VERBS - CITATION_IGNORED_TERMS
+
+
+def product_lookup_terms(text: str) -> Optional[Set[str]]:
+    """
+    Recognises questions that recall a product from earlier conversations, and returns what they describe.
+
+    Args:
+        text (str): The question, e.g. "What was the office chair we discussed last week?".
+
+    Returns:
+        Set[str]: The terms describing the product, e.g. {"office", "chair"}, empty if the question asks about
+        products in general, or None if the question does not recall a product.
+    """
+    if not PRODUCT_RECALL_PATTERN.search((text or "").lower()):
+        return None
+    terms = query_terms(text) - PRODUCT_RECALL_IGNORED_TERMS
+    if terms & PRODUCT_GENERIC_TERMS:
+        return terms - PRODUCT_GENERIC_TERMS
+    # a recall question that names no product, such as "what did we discuss?", is not about products
+    return terms or None
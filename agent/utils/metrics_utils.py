@@ -0,0 +1,454 @@
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from agent.config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    A fixed-bucket latency histogram, compatible with the Prometheus histogram model.
+    """
+
+    def __init__(self, name: str, buckets: List[float]):
+        """
+        Initializes an empty histogram.
+
+        Args:
+            name (str): The name of the stage being measured, e.g. "tool.search_the_web.upstream".
+            buckets (List[float]): Sorted upper bounds of the buckets, in seconds.
+        """
+        self.name = name
+        self.buckets = list(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Records a single observation.
+
+        Args:
+            value (float): The observed duration in seconds.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict:
+        """
+        Returns a point-in-time copy of the histogram.
+
+        Returns:
+            Dict: A dictionary with "count", "sum" and cumulative "buckets" (upper bound -> count).
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+            running += bucket_count
+            cumulative["+Inf" if bound == float("inf") else repr(bound)] = running
+        return {"count": count, "sum": total, "buckets": cumulative}
+
+
+class _Span:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """
+    A process-wide collection of latency histograms, keyed by stage name, and event counters, keyed by event name.
+
+    When the registry is disabled, spans are a shared no-op object and timed functions are
+    called straight through, so instrumentation can stay in place on hot paths.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: Optional[List[float]] = None):
+        """
+        Initializes the registry.
+
+        Args:
+            enabled (bool, optional): Whether observations are recorded. Defaults to False.
+            buckets (List[float], optional): Histogram bucket bounds in seconds. Defaults to METRICS_LATENCY_BUCKETS.
+        """
+        self.enabled = enabled
+        self.buckets = sorted(buckets or METRICS_LATENCY_BUCKETS)
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        """
+        Returns the histogram for a stage, creating it on first use.
+
+        Args:
+            name (str): The stage name.
+
+        Returns:
+            Histogram: The histogram for that stage.
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    name, Histogram(name, self.buckets)
+                )
+        return histogram
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Records a duration against a stage, if the registry is enabled.
+
+        Args:
+            name (str): The stage name.
+            seconds (float): The duration in seconds.
+        """
+        if self.enabled:
+            self.histogram(name).observe(seconds)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """
+        Adds to an event counter, if the registry is enabled.
+
+        Args:
+            name (str): The event name, e.g. "speculation.hit".
+            value (int, optional): The amount to add. Defaults to 1.
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Returns a snapshot of every event counter.
+
+        Returns:
+            Dict[str, int]: Event name -> count.
+        """
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def span(self, name: str):
+        """
+        Returns a context manager that times the enclosed block.
+
+        Args:
+            name (str): The stage name.
+
+        Returns:
+            A context manager. This is a shared no-op object when the registry is disabled.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self.histogram(name))
+
+    def reset(self) -> None:
+        """Drops all recorded histograms and counters."""
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """
+        Returns a snapshot of every histogram.
+
+        Returns:
+            Dict[str, Dict]: Stage name -> histogram snapshot.
+        """
+        return {
+            name: histogram.snapshot()
+            for name, histogram in sorted(self._histograms.items())
+        }
+
+    def to_prometheus_text(self) -> str:
+        """
+        Renders all histograms and counters in the Prometheus text exposition format.
+
+        Returns:
+            str: A histogram family, "agent_stage_latency_seconds", labelled by stage, and a counter family,
+            "agent_events_total", labelled by event.
+        """
+        family = "agent_stage_latency_seconds"
+        lines = [
+            f"# HELP {family} Latency of agent tool, upstream and database stages.",
+            f"# TYPE {family} histogram",
+        ]
+        for name, snapshot in self.to_dict().items():
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f'{family}_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{family}_sum{{stage="{name}"}} {snapshot["sum"]}')
+            lines.append(f'{family}_count{{stage="{name}"}} {snapshot["count"]}')
+        counters = self.counters()
+        if counters:
+            lines.append("# HELP agent_events_total Counts of agent events.")
+            lines.append("# TYPE agent_events_total counter")
+            for name, count in counters.items():
+                lines.append(f'agent_events_total{{event="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry(enabled=METRICS_ENABLED)
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the asyncio event loop wakes up from a short sleep.
+
+    Lag is the time a ready callback waits behind blocking work on the loop thread, which is what a
+    synchronous upstream call inside a tool costs every other task in the job. An on_slow hook is told about
+    every probe that woke more than slow_threshold late, e.g. to find out what held the loop.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        registry: Optional[MetricsRegistry] = None,
+        max_samples: int = 100000,
+        metric: str = "event_loop.lag",
+        slow_threshold: float = 0.1,
+        on_slow: Optional[Callable[[float, float, float], None]] = None,
+    ):
+        """
+        Initializes the monitor.
+
+        Args:
+            interval (float, optional): Seconds between probes. Defaults to 0.05.
+            registry (MetricsRegistry, optional): Registry that lag is also recorded to. Defaults to the
+                process-wide registry.
+            max_samples (int, optional): Maximum number of lag samples kept in memory. Defaults to 100000.
+            metric (str, optional): The histogram lag is recorded to. Defaults to "event_loop.lag".
+            slow_threshold (float, optional): Lag in seconds above which on_slow is called. Defaults to 0.1.
+            on_slow (Callable, optional): Called on the loop with the time.monotonic() a late probe was due to
+                wake at, the time it woke and its lag. Defaults to None.
+        """
+        self.interval = interval
+        self.registry = registry or METRICS
+        self.max_samples = max_samples
+        self.metric = metric
+        self.slow_threshold = slow_threshold
+        self.on_slow = on_slow
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            woke = time.monotonic()
+            lag = max(0.0, woke - expected)
+            if len(self.samples) < self.max_samples:
+                self.samples.append(lag)
+            self.registry.observe(self.metric, lag)
+            if self.on_slow is not None and lag > self.slow_threshold:
+                self.on_slow(expected, woke, lag)
+
+    def start(self) -> None:
+        """Starts probing the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        """Stops probing."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def span(name: str):
+    """
+    Times the enclosed block against the process-wide registry.
+
+    Args:
+        name (str): The stage name.
+
+    Returns:
+        A context manager.
+    """
+    return METRICS.span(name)
+
+
+def timed(name: str):
+    """
+    Decorator that times every call of a sync or async function against the process-wide registry.
+
+    Args:
+        name (str): The stage name.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(fnc):
+        if asyncio.iscoroutinefunction(fnc):
+
+            @functools.wraps(fnc)
+            async def async_wrapper(*args, **kwargs):
+                if not METRICS.enabled:
+                    return await fnc(*args, **kwargs)
+                with METRICS.span(name):
+                    return await fnc(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fnc)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return fnc(*args, **kwargs)
+            with METRICS.span(name):
+                return fnc(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def metrics_snapshot(registry: MetricsRegistry = METRICS) -> Dict[str, Any]:
+    """
+    Returns a snapshot of the registry's histograms and counters, as dumped and served as JSON.
+
+    Args:
+        registry (MetricsRegistry, optional): The registry. Defaults to the process-wide registry.
+
+    Returns:
+        Dict[str, Any]: The "timestamp", "histograms" and "counters".
+    """
+    return {
+        "timestamp": time.time(),
+        "histograms": registry.to_dict(),
+        "counters": registry.counters(),
+    }
+
+
+def dump_metrics_json(path: str, registry: MetricsRegistry = METRICS) -> None:
+    """
+    Writes a snapshot of the registry to a JSON file for offline analysis.
+
+    Args:
+        path (str): The output file path.
+        registry (MetricsRegistry, optional): The registry to dump. Defaults to the process-wide registry.
+    """
+    with open(path, "w") as file:
+        json.dump(metrics_snapshot(registry), file, indent=2)
+
+
+class _MetricsHTTPServer(ThreadingHTTPServer):
+    # on Windows SO_REUSEADDR lets a second process bind a port that is in use, so two processes could share one
+    allow_reuse_address = os.name != "nt"
+
+
+def start_metrics_server(
+    port: int,
+    host: str = "127.0.0.1",
+    registry: MetricsRegistry = METRICS,
+    port_count: int = 1,
+) -> Optional[ThreadingHTTPServer]:
+    """
+    Starts a local HTTP server that serves the registry in Prometheus text format on /metrics
+    and as JSON on /metrics.json, in the same shape as dump_metrics_json.
+
+    Args:
+        port (int): The first port to try, or 0 for any free port; the port bound is logged.
+        host (str, optional): The interface to bind. Defaults to "127.0.0.1".
+        registry (MetricsRegistry, optional): The registry to serve. Defaults to the process-wide registry.
+        port_count (int, optional): How many consecutive ports from port to try, so several processes on a
+            host each bind the next free one. Defaults to 1.
+
+    Returns:
+        ThreadingHTTPServer: The running server, or None if no port could be bound.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.to_prometheus_text().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics_snapshot(registry)).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    ports = [port] if port == 0 else range(port, port + port_count)
+    for candidate in ports:
+        try:
+            server = _MetricsHTTPServer((host, candidate), MetricsHandler)
+            break
+        except OSError as e:
+            error = e
+    else:
+        logger.info(
+            f"Unable to start metrics server on {host}:{port} "
+            f"(tried {len(ports)} ports): {error}"
+        )
+        return None
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(
+        f"Serving metrics on http://{host}:{server.server_address[1]}/metrics (pid {os.getpid()})"
+    )
+    return server
+
+
+def stop_metrics_server(server: ThreadingHTTPServer) -> None:
+    """
+    Stops a server started by start_metrics_server and releases its port.
+
+    Args:
+        server (ThreadingHTTPServer): The server.
+    """
+    server.shutdown()
+    server.server_close()
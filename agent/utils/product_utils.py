@@ -0,0 +1,388 @@
+import re
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlsplit
+from agent.utils.intent_utils import STOPWORDS, query_terms
+
+# brands whose name starts a product mention even when the model name has no digits, e.g. "Steelcase Leap";
+# lower case, multi-word brands included
+KNOWN_BRANDS = {
+    "acer",
+    "adidas",
+    "amazon",
+    "anker",
+    "apple",
+    "asus",
+    "autonomous",
+    "beats",
+    "benq",
+    "bose",
+    "branch",
+    "breville",
+    "brooks",
+    "canon",
+    "casper",
+    "corsair",
+    "cuisinart",
+    "dell",
+    "dji",
+    "dyson",
+    "fitbit",
+    "fujifilm",
+    "garmin",
+    "google",
+    "gopro",
+    "herman miller",
+    "hp",
+    "hydro flask",
+    "ikea",
+    "instant pot",
+    "jabra",
+    "jbl",
+    "keychron",
+    "kindle",
+    "kitchenaid",
+    "lenovo",
+    "lg",
+    "logitech",
+    "microsoft",
+    "msi",
+    "new balance",
+    "nike",
+    "nikon",
+    "ninja",
+    "nintendo",
+    "nvidia",
+    "oneplus",
+    "panasonic",
+    "patagonia",
+    "philips",
+    "purple",
+    "razer",
+    "roku",
+    "samsung",
+    "sennheiser",
+    "shark",
+    "sonos",
+    "sony",
+    "steelcase",
+    "tempur-pedic",
+    "the north face",
+    "uplift",
+    "vitamix",
+    "yeti",
+}
+
+# nouns that name a kind of product; a mention's category is one of these, with at most one word before it
+CATEGORY_NOUNS = {
+    "backpack",
+    "blender",
+    "bottle",
+    "camera",
+    "chair",
+    "charger",
+    "console",
+    "controller",
+    "desk",
+    "drive",
+    "earbuds",
+    "headphones",
+    "headset",
+    "jacket",
+    "kettle",
+    "keyboard",
+    "lamp",
+    "laptop",
+    "lens",
+    "mattress",
+    "microphone",
+    "monitor",
+    "mouse",
+    "phone",
+    "printer",
+    "router",
+    "shoes",
+    "sneakers",
+    "speaker",
+    "speakers",
+    "tablet",
+    "tv",
+    "vacuum",
+    "watch",
+    "webcam",
+}
+
+_SENTENCE_PATTERN = re.compile(r"[^.!?\n]+(?:[.!?](?!\d)|$)", re.MULTILINE)
+_URL_PATTERN = re.compile(r"https?://[^\s'\"<>()\[\]{},]+")
+_PRICE_PATTERN = re.compile(r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d{2})?")
+# brands by their first word, longest first, so a brand is found with one dict lookup per word of a sentence
+_BRANDS_BY_FIRST_WORD: Dict[str, List[List[str]]] = {}
+for _brand in sorted(KNOWN_BRANDS, key=len, reverse=True):
+    _BRANDS_BY_FIRST_WORD.setdefault(_brand.split()[0], []).append(_brand.split())
+_WORD_PATTERN = re.compile(r"(?<![A-Za-z0-9])[A-Za-z][A-Za-z-]*")
+# a word of a product's name: capitalised, camel-cased ("iPhone") or starting with a digit ("32oz")
+_NAME_TOKEN_PATTERN = re.compile(
+    r"(?:[A-Z0-9][A-Za-z0-9+-]*|[a-z]+[A-Z][A-Za-z0-9+-]*)"
+)
+# a model code: letters and digits, e.g. "U2723QE", "WH-1000XM5" or "27GP850"
+_MODEL_CODE_PATTERN = re.compile(
+    r"^(?=[A-Za-z0-9-]*[0-9])(?=[A-Za-z0-9-]*[A-Za-z])[A-Za-z0-9-]{2,}$"
+)
+# an unknown brand followed by a model code, e.g. "Fellow Stagg EKG2"
+_UNKNOWN_BRAND_PATTERN = re.compile(
+    r"\b[A-Z][a-z]+(?:\s+[A-Z][A-Za-z]+){0,2}\s+(?=[A-Za-z-]*\d)[A-Z0-9][A-Za-z0-9-]*[A-Za-z0-9]\b"
+)
+_CATEGORY_PATTERN = re.compile(
+    r"^\s+(?:([a-z][a-z-]*)\s+)?("
+    + "|".join(sorted(CATEGORY_NOUNS, key=len, reverse=True))
+    + r")\b"
+)
+_NEXT_WORD_PATTERN = re.compile(r"\s+([^\s,;:]+)")
+_NON_KEY_PATTERN = re.compile(r"[^a-z0-9]")
+_DIGIT_PATTERN = re.compile(r"\d")
+_MAX_NAME_TOKENS = 4
+
+
+def product_key(name: str) -> str:
+    """
+    Returns the key products are merged by: the name lower-cased, with only its letters and digits,
+    so "Sony WH-1000XM5" and "sony wh1000xm5" are the same product.
+
+    Args:
+        name (str): The product name.
+
+    Returns:
+        str: The key.
+    """
+    return _NON_KEY_PATTERN.sub("", name.lower())
+
+
+def _is_name_token(token: str) -> bool:
+    return bool(_NAME_TOKEN_PATTERN.fullmatch(token)) and token.lower() not in STOPWORDS
+
+
+def _extend_name_from(sentence: str, end: int, tokens: int) -> int:
+    """Returns where the name words following position end stop."""
+    while tokens < _MAX_NAME_TOKENS:
+        match = _NEXT_WORD_PATTERN.match(sentence, end)
+        if match is None or not _is_name_token(match.group(1)):
+            break
+        end = match.end()
+        tokens += 1
+    return end
+
+
+def _brands(sentence: str) -> List[tuple]:
+    """Finds the known brands in a sentence, as (start, end, brand as written)."""
+    words = [
+        (match.start(), match.end(), match.group(0).lower())
+        for match in _WORD_PATTERN.finditer(sentence)
+    ]
+    found = []
+    position = 0
+    while position < len(words):
+        for brand in _BRANDS_BY_FIRST_WORD.get(words[position][2], ()):
+            candidate = words[position : position + len(brand)]
+            if [word for _, _, word in candidate] == brand and all(
+                sentence[previous[1] : word[0]].isspace()
+                for previous, word in zip(candidate, candidate[1:])
+            ):
+                start, end = candidate[0][0], candidate[-1][1]
+                found.append((start, end, " ".join(sentence[start:end].split())))
+                position += len(brand) - 1
+                break
+        position += 1
+    return found
+
+
+def _mentions(sentence: str) -> List[Dict]:
+    """Finds the product names in a sentence, with their position and category."""
+    mentions = []
+    taken = []
+    for start, brand_end, brand in _brands(sentence):
+        end = _extend_name_from(sentence, brand_end, 0)
+        if end == brand_end:
+            # a brand on its own ("the Dell") is too vague to index
+            continue
+        mentions.append({"brand": brand, "start": start, "end": end})
+        taken.append((start, end))
+    # a model code has a digit, so sentences without one are not searched for unknown brands
+    unknown_brands = (
+        _UNKNOWN_BRAND_PATTERN.finditer(sentence)
+        if _DIGIT_PATTERN.search(sentence)
+        else ()
+    )
+    for match in unknown_brands:
+        if any(start < match.end() and match.start() < end for start, end in taken):
+            continue
+        words = match.group(0).split()
+        start = match.start()
+        # the pattern takes a capitalised word that starts a sentence, such as "The", as part of the name
+        while len(words) > 2 and words[0].lower() in STOPWORDS:
+            start = sentence.index(words[1], start + len(words[0]))
+            words = words[1:]
+        if words[0].lower() in STOPWORDS or not _MODEL_CODE_PATTERN.match(words[-1]):
+            continue
+        mentions.append({"brand": None, "start": start, "end": match.end()})
+
+    for mention in mentions:
+        name = " ".join(sentence[mention["start"] : mention["end"]].split())
+        mention["name"] = name.rstrip("-+")
+        category = _CATEGORY_PATTERN.match(sentence[mention["end"] :])
+        mention["category"] = None
+        if category is not None:
+            modifier, noun = category.groups()
+            if modifier is None or modifier in STOPWORDS:
+                mention["category"] = noun
+            else:
+                mention["category"] = f"{modifier} {noun}"
+            mention["end"] += category.end()
+    return sorted(mentions, key=lambda mention: mention["start"])
+
+
+def parse_price(text: str) -> Optional[float]:
+    """
+    Parses a dollar amount such as "$1,395" or "$49.99".
+
+    Args:
+        text (str): The amount.
+
+    Returns:
+        float: The amount, or None if text has none.
+    """
+    match = _PRICE_PATTERN.search(text or "")
+    if match is None:
+        return None
+    return float(match.group(1).replace(",", "") + (match.group(2) or ""))
+
+
+def _url_key(url: str) -> str:
+    parts = urlsplit(url)
+    return product_key(f"{parts.hostname or ''}{parts.path}")
+
+
+def _url_matcher(name: str):
+    """Returns a predicate of a URL key that tells whether the URL names the product."""
+    originals = name.split()
+    codes = [
+        product_key(word)
+        for word in originals
+        if _MODEL_CODE_PATTERN.match(word) and len(product_key(word)) >= 3
+    ]
+    if codes:
+        return lambda key: any(code in key for code in codes)
+    if any(_MODEL_CODE_PATTERN.match(word) for word in originals):
+        # the only model codes are too short to find in a URL reliably
+        return lambda key: False
+    words = [word for word in map(product_key, originals) if word]
+    return lambda key: all(word in key for word in words)
+
+
+def url_matches_product(url: str, name: str) -> bool:
+    """
+    Returns whether a URL names a product, e.g. "bestbuy.com/site/dell-u2723qe-27-monitor/..." for
+    "Dell U2723QE": its model code, or else every word of its name, appears in the host or path.
+
+    Args:
+        url (str): The URL.
+        name (str): The product name.
+
+    Returns:
+        bool: True if the URL is about the product.
+    """
+    return _url_matcher(name)(_url_key(url))
+
+
+def extract_products(text: str) -> List[Dict]:
+    """
+    Finds the products a piece of text mentions, using local heuristics only, so it is cheap enough to run on
+    every stored record.
+
+    A product is a known brand followed by up to four words of a name ("Herman Miller Aeron"), or any
+    capitalised name followed by a model code ("Fellow Stagg EKG2"), with the kind of product right after it
+    ("office chair"). A dollar amount in the same sentence is its price; when a sentence names several
+    products, the amount goes to the nearest. URLs are attached to the product in their sentence when there
+    is only one, and to every product whose model code or name appears in their path.
+
+    Args:
+        text (str): The text, e.g. a tool's output or what the user said.
+
+    Returns:
+        List[Dict]: One entry per product, merged by product_key, with its "name", "brand" (None if not a known
+        brand), "category" (or None), "prices", "urls" and the query "terms" of the sentences it was mentioned in.
+    """
+    if not text:
+        return []
+    products: Dict[str, Dict] = {}
+    urls = [
+        (match.start(), match.group(0).rstrip(".;:!?"))
+        for match in _URL_PATTERN.finditer(text)
+    ]
+    # URLs are blanked out rather than removed, so their dots do not end sentences and their offsets still hold
+    masked = _URL_PATTERN.sub(lambda match: "\x00" * len(match.group(0)), text)
+    for match in _SENTENCE_PATTERN.finditer(masked):
+        sentence = match.group(0)
+        sentence_urls = [
+            url for start, url in urls if match.start() <= start < match.end()
+        ]
+        mentions = _mentions(sentence)
+        if not mentions:
+            continue
+        prices = [
+            (match.start(), parse_price(match.group(0)))
+            for match in _PRICE_PATTERN.finditer(sentence)
+        ]
+        terms = {term for term in query_terms(sentence) if not term.startswith("$")}
+        for mention in mentions:
+            product = products.setdefault(
+                product_key(mention["name"]),
+                {
+                    "name": mention["name"],
+                    "brand": mention["brand"],
+                    "category": None,
+                    "prices": [],
+                    "urls": [],
+                    "terms": set(),
+                },
+            )
+            product["category"] = product["category"] or mention["category"]
+            product["terms"] |= terms
+        for position, price in prices:
+            nearest = min(
+                mentions,
+                key=lambda mention: min(
+                    abs(position - mention["start"]), abs(position - mention["end"])
+                ),
+            )
+            product = products[product_key(nearest["name"])]
+            if price not in product["prices"]:
+                product["prices"].append(price)
+        if len(mentions) == 1:
+            product = products[product_key(mentions[0]["name"])]
+            product["urls"].extend(
+                url for url in sentence_urls if url not in product["urls"]
+            )
+
+    if urls and products:
+        url_keys = [(url, _url_key(url)) for _, url in urls]
+        for product in products.values():
+            matches = _url_matcher(product["name"])
+            product["urls"].extend(
+                url
+                for url, key in url_keys
+                if matches(key) and url not in product["urls"]
+            )
+    return list(products.values())
+
+
+def product_terms(product: Dict) -> Set[str]:
+    """
+    Returns the query terms of a product's name and category, e.g. {"herman", "miller", "aeron", "office",
+    "chair"}.
+
+    Args:
+        product (Dict): A product, as returned by extract_products.
+
+    Returns:
+        Set[str]: The terms.
+    """
+    return query_terms(f"{product['name']} {product['category'] or ''}")
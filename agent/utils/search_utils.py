@@ -0,0 +1,180 @@
+import datetime
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+from urllib.parse import urlsplit
+from agent.utils.time_utils import to_epoch_ms
+from agent.utils.url_utils import canonicalize_url
+
+# the web search fields every backend stores; "citations" is the list of cited URLs in the order they were cited
+WEB_SEARCH_FIELDS = [
+    "id",
+    "timestamp",
+    "timestamp_ms",
+    "user_id",
+    "conversation_id",
+    "question",
+    "answer",
+    "citations",
+    "model",
+    "status",
+    "latency_ms",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+]
+
+
+def build_web_search_record(
+    user_id,
+    conversation_id,
+    question,
+    answer,
+    citations,
+    model=None,
+    status=None,
+    latency_ms=None,
+    usage=None,
+) -> Dict:
+    """
+    Builds a structured web search record, as stored by store_web_search.
+
+    Args:
+        user_id (str): The ID of the user.
+        conversation_id (str): The ID of the conversation.
+        question (str): The question that was searched.
+        answer (str): The answer text, without the citation list, or None if the search failed.
+        citations (List[str]): The cited URLs, in citation order.
+        model (str, optional): The model that answered.
+        status (int, optional): The HTTP status of the response.
+        latency_ms (float, optional): How long the request took.
+        usage (dict, optional): Token counts, as returned by extract_perplexity_usage.
+
+    Returns:
+        Dict: The record, with the WEB_SEARCH_FIELDS.
+    """
+    now = datetime.datetime.now()
+    usage = usage or {}
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": str(now),
+        "timestamp_ms": to_epoch_ms(now),
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "question": question,
+        "answer": answer,
+        "citations": list(citations or []),
+        "model": model,
+        "status": status,
+        "latency_ms": latency_ms,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "total_tokens": usage.get("total_tokens"),
+    }
+
+
+def citation_domain(url: str) -> str:
+    """
+    Returns the site a URL belongs to: its host, lower-cased and without a leading "www.".
+
+    Args:
+        url (str): The URL.
+
+    Returns:
+        str: The domain, e.g. "bestbuy.com".
+    """
+    return urlsplit(canonicalize_url(url)).hostname or ""
+
+
+def citation_rows(search: Dict) -> List[Dict]:
+    """
+    Expands a web search record into one row per citation, as kept in the citation index.
+
+    Args:
+        search (Dict): A web search record.
+
+    Returns:
+        List[Dict]: The "search_id", 1-based "position", "url", "canonical_url" and "domain" of each citation.
+    """
+    return [
+        {
+            "search_id": search["id"],
+            "position": position,
+            "url": url,
+            "canonical_url": canonicalize_url(url),
+            "domain": citation_domain(url),
+        }
+        for position, url in enumerate(search["citations"], start=1)
+    ]
+
+
+def search_matches(search: Dict, terms: Optional[Set[str]]) -> bool:
+    """
+    Returns whether every term appears in a web search's question or answer, ignoring case.
+
+    Args:
+        search (Dict): A web search record.
+        terms (Set[str], optional): Lower-case terms, e.g. from query_terms. None or empty matches every search.
+
+    Returns:
+        bool: True if the search matches.
+    """
+    if not terms:
+        return True
+    text = f"{search['question'] or ''}\n{search['answer'] or ''}".lower()
+    return all(term in text for term in terms)
+
+
+def find_citations_in(
+    searches: Iterable[Dict],
+    terms: Optional[Set[str]] = None,
+    url: Optional[str] = None,
+    limit: int = 50,
+) -> List[Dict]:
+    """
+    Looks up citations in web search records, for backends that keep them in memory.
+
+    Args:
+        searches (Iterable[Dict]): One user's web search records, newest first.
+        terms (Set[str], optional): Only searches whose question or answer contains every term.
+        url (str, optional): Only citations of this page, compared by canonical URL.
+        limit (int, optional): The most citations returned. Defaults to 50.
+
+    Returns:
+        List[Dict]: Citations, as returned by find_citations.
+    """
+    canonical = canonicalize_url(url) if url else None
+    results = []
+    for search in searches:
+        if not search_matches(search, terms):
+            continue
+        for row in citation_rows(search):
+            if canonical is not None and row["canonical_url"] != canonical:
+                continue
+            results.append(citation_result(search, row))
+            if len(results) >= limit:
+                return results
+    return results
+
+
+def citation_result(search: Dict, row: Dict) -> Dict:
+    """
+    Joins a citation row with the search that cited it, in the form find_citations returns.
+
+    Args:
+        search (Dict): The web search record.
+        row (Dict): The citation row, from citation_rows.
+
+    Returns:
+        Dict: The "url", "domain", "position", "search_id", "question", "answer", "conversation_id" and
+        "timestamp" of the citation.
+    """
+    return {
+        "url": row["url"],
+        "domain": row["domain"],
+        "position": row["position"],
+        "search_id": search["id"],
+        "question": search["question"],
+        "answer": search["answer"],
+        "conversation_id": search["conversation_id"],
+        "timestamp": search["timestamp"],
+    }
@@ -0,0 +1,145 @@
+import datetime
+import re
+from typing import Optional, Tuple, Union
+
+TIMESTAMP_FIELDS = ("timestamp", "timestamp_ms")
+
+
+def timestamp_to_epoch_ms(timestamp: str) -> int:
+    """
+    Converts a stored timestamp string to milliseconds since the epoch.
+
+    Args:
+        timestamp (str): A timestamp as stored in the database, i.e. str(datetime.datetime.now()) in local
+            time, or a prefix of one such as "2025-01-01".
+
+    Returns:
+        int: Milliseconds since the epoch.
+    """
+    return int(datetime.datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+
+def epoch_ms_to_datetime(epoch_ms: int) -> datetime.datetime:
+    """
+    Converts milliseconds since the epoch to a local datetime.
+
+    Args:
+        epoch_ms (int): Milliseconds since the epoch.
+
+    Returns:
+        datetime.datetime: The local time.
+    """
+    return datetime.datetime.fromtimestamp(epoch_ms / 1000)
+
+
+def to_epoch_ms(value: Union[int, float, str, datetime.datetime]) -> int:
+    """
+    Normalises a time given as epoch milliseconds, a timestamp string or a datetime to epoch milliseconds.
+
+    Args:
+        value (int | float | str | datetime.datetime): The time.
+
+    Returns:
+        int: Milliseconds since the epoch.
+    """
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, str):
+        return timestamp_to_epoch_ms(value)
+    return int(value)
+
+
+def record_epoch_ms(record: dict) -> int:
+    """
+    Returns the epoch-millisecond timestamp of a record, computing it for records stored before the field existed.
+
+    Args:
+        record (dict): A record with a "timestamp" and possibly a "timestamp_ms".
+
+    Returns:
+        int: Milliseconds since the epoch.
+    """
+    if record.get("timestamp_ms") is not None:
+        return record["timestamp_ms"]
+    return timestamp_to_epoch_ms(record["timestamp"])
+
+
+def query_time_bounds(query) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Works out the time range a TinyDB query can match, from comparisons on "timestamp" or "timestamp_ms"
+    that are joined by &. Used to skip storage segments that cannot hold a match.
+
+    Args:
+        query: A tinydb.Query condition, or any other predicate.
+
+    Returns:
+        Tuple[Optional[int], Optional[int]]: The inclusive lower and upper bounds in epoch milliseconds,
+        None where the query does not bound the time.
+    """
+    return _hash_time_bounds(getattr(query, "_hash", None))
+
+
+# spoken references to a recent period, with how many days back they reach and how many days ago they end;
+# "last week" reaches back two weeks, since people say it of both the past seven days and the calendar week
+_RELATIVE_PERIODS = [
+    (re.compile(r"\byesterday\b"), 1, 0),
+    (re.compile(r"\btoday\b"), 0, None),
+    (re.compile(r"\b(this|past) week\b"), 7, None),
+    (re.compile(r"\blast week\b"), 14, None),
+    (re.compile(r"\b(this|past) month\b"), 31, None),
+    (re.compile(r"\blast month\b"), 62, None),
+]
+
+
+def relative_time_bounds(
+    text: str, now: Optional[datetime.datetime] = None
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Works out the time range a question refers to from phrases such as "yesterday" or "last week".
+
+    Args:
+        text (str): The question.
+        now (datetime.datetime, optional): The current local time. Defaults to now.
+
+    Returns:
+        Tuple[Optional[int], Optional[int]]: The inclusive lower and exclusive upper bounds in epoch
+        milliseconds, None where the question does not bound the time.
+    """
+    text = (text or "").lower()
+    now = now or datetime.datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    for pattern, days_back, ends_days_ago in _RELATIVE_PERIODS:
+        if pattern.search(text):
+            lower = to_epoch_ms(midnight - datetime.timedelta(days=days_back))
+            if ends_days_ago is None:
+                return lower, None
+            return lower, to_epoch_ms(midnight - datetime.timedelta(days=ends_days_ago))
+    return None, None
+
+
+def _hash_time_bounds(node) -> Tuple[Optional[int], Optional[int]]:
+    if not isinstance(node, tuple) or not node:
+        return None, None
+    if node[0] == "and":
+        lower, upper = None, None
+        for child in node[1]:
+            child_lower, child_upper = _hash_time_bounds(child)
+            if child_lower is not None:
+                lower = child_lower if lower is None else max(lower, child_lower)
+            if child_upper is not None:
+                upper = child_upper if upper is None else min(upper, child_upper)
+        return lower, upper
+    if len(node) != 3 or node[1] not in [(field,) for field in TIMESTAMP_FIELDS]:
+        return None, None
+    operator, _, value = node
+    try:
+        epoch_ms = to_epoch_ms(value)
+    except (TypeError, ValueError):
+        return None, None
+    if operator in (">", ">="):
+        return epoch_ms, None
+    if operator in ("<", "<="):
+        return None, epoch_ms
+    if operator == "==":
+        return epoch_ms, epoch_ms
+    return None, None
@@ -0,0 +1,93 @@
+import html
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# query parameters that only track where a click came from, and never change the page
+TRACKING_PARAMETERS = {
+    "gclid",
+    "fbclid",
+    "msclkid",
+    "dclid",
+    "yclid",
+    "mc_cid",
+    "mc_eid",
+    "igshid",
+    "ref_src",
+    "_hsenc",
+    "_hsmi",
+}
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_TITLE_PATTERN = re.compile(rb"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+_CHARSET_PATTERN = re.compile(r"charset=([\w-]+)", re.IGNORECASE)
+_TAG_PATTERN = re.compile(r"<[^>]*>")
+_UNSAFE_TITLE_CHARACTERS = re.compile(r'[<>`"{}]')
+
+
+def canonicalize_url(url):
+    """
+    Normalizes a URL so that links to the same page compare equal.
+
+    The scheme and host are lower-cased, a leading "www." and the default port are dropped, the fragment and
+    tracking parameters (utm_*, gclid, fbclid, ...) are removed, the remaining query parameters are sorted and
+    a trailing slash is removed from the path. A URL without a scheme is treated as https.
+
+    Args:
+        url (str): The URL.
+
+    Returns:
+        str: The canonical URL.
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[len("www.") :]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, _DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+    path = parts.path.rstrip("/")
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_")
+            and key.lower() not in TRACKING_PARAMETERS
+        )
+    )
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def extract_html_title(body, content_type="", max_chars=80):
+    """
+    Returns the contents of the <title> element at the start of an HTML document, made safe to show the model:
+    whitespace is collapsed, tags, control characters and the characters that could pass for markup or quoting
+    (<, >, `, ", {, }) are removed, and the title is cut to max_chars.
+
+    Args:
+        body (bytes): The first bytes of the document.
+        content_type (str, optional): The response's Content-Type header, used for its charset. Defaults to "".
+        max_chars (int, optional): The most characters kept, including a trailing "..." if cut. Defaults to 80.
+
+    Returns:
+        str: The title, or None if there is none in body.
+    """
+    match = _TITLE_PATTERN.search(body)
+    if match is None:
+        return None
+    charset = _CHARSET_PATTERN.search(content_type or "")
+    try:
+        title = match.group(1).decode(charset.group(1) if charset else "utf-8")
+    except (LookupError, UnicodeDecodeError):
+        title = match.group(1).decode("latin-1")
+    title = _TAG_PATTERN.sub("", html.unescape(title))
+    title = _UNSAFE_TITLE_CHARACTERS.sub("", title)
+    title = " ".join(title.split())
+    title = "".join(character for character in title if character.isprintable())
+    if len(title) > max_chars:
+        title = title[: max_chars - 3].rstrip() + "..."
+    return title or None
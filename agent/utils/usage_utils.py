@@ -0,0 +1,97 @@
+import json
+from typing import Dict
+from agent.config import MODEL_PRICING
+
+USAGE_AGGREGATE_SCOPES = ["user", "conversation", "tool", "day"]
+# the running totals each usage aggregate keeps
+USAGE_TOTAL_FIELDS = [
+    "requests",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "cost_usd",
+]
+
+
+def extract_openai_usage(response) -> Dict[str, int]:
+    """
+    Extracts token counts from an OpenAI chat completion.
+
+    Args:
+        response: The ChatCompletion returned by the OpenAI client.
+
+    Returns:
+        Dict[str, int]: "prompt_tokens", "completion_tokens" and "total_tokens". Counts are zero if the
+        response has no usage attached.
+    """
+    usage = getattr(response, "usage", None)
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+        "total_tokens": int(getattr(usage, "total_tokens", 0) or 0),
+    }
+
+
+def extract_perplexity_usage(response) -> Dict[str, int]:
+    """
+    Extracts token counts from a Perplexity chat completions response.
+
+    Args:
+        response (requests.Response): The HTTP response from the Perplexity API.
+
+    Returns:
+        Dict[str, int]: "prompt_tokens", "completion_tokens" and "total_tokens". Counts are zero if the
+        request failed or the body has no usage block.
+    """
+    try:
+        usage = json.loads(response.text).get("usage") or {}
+    except Exception:
+        usage = {}
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens", 0) or 0),
+        "completion_tokens": int(usage.get("completion_tokens", 0) or 0),
+        "total_tokens": int(usage.get("total_tokens", 0) or 0),
+    }
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimates the cost of a single model request from MODEL_PRICING.
+
+    Args:
+        model (str): The model name.
+        prompt_tokens (int): Number of input tokens.
+        completion_tokens (int): Number of output tokens.
+
+    Returns:
+        float: The estimated cost in USD, or 0.0 if the model has no pricing entry.
+    """
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (
+        prompt_tokens * pricing["prompt"] / 1e6
+        + completion_tokens * pricing["completion"] / 1e6
+        + pricing["request"]
+    )
+
+
+def usage_aggregate_keys(user_id, conversation_id, tool_id, timestamp):
+    """
+    Returns the (scope, key) pairs that a single usage record contributes to.
+
+    Args:
+        user_id (str): The ID of the user.
+        conversation_id (str): The ID of the conversation.
+        tool_id (str): The ID of the tool that made the request.
+        timestamp (str): The timestamp of the record, as stored in the database.
+
+    Returns:
+        list: One (scope, key) tuple per scope in USAGE_AGGREGATE_SCOPES.
+    """
+    return [
+        ("user", user_id),
+        ("conversation", conversation_id),
+        ("tool", tool_id),
+        ("day", timestamp[:10]),
+    ]
@@ -1,61 +1,136 @@
 from __future__ import annotations
+import atexit
 import logging
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 
 from livekit import rtc
 from livekit.agents import (
     AutoSubscribe,
     JobContext,
+    JobProcess,
     WorkerOptions,
     cli,
     llm,
 )
-from livekit.agents.multimodal import MultimodalAgent
+
+# plugins register themselves on import, which must happen on the main thread; with the thread job executor
+# (the default on Windows) prewarm and the entrypoint run on other threads, so the plugin is imported here
 from livekit.plugins import openai
-from openai import OpenAI
-import os
-from agent.tools.PerplexityChat import PerplexityChat
-from agent.tools.AgentTools import AgentTools
 from agent.prompts import RealTimeModelDriverPrompt
-from agent.tools.AgentDatabase import AgentDatabase
-from agent.tools.AgentConversationLogger import ConversationLogger
+from agent.utils.metrics_utils import (
+    METRICS,
+    dump_metrics_json,
+    start_metrics_server,
+    stop_metrics_server,
+)
+from agent.tools.JobProfiler import JobProfiler, profiling_requested
 from agent.config import (
     REALTIME_MODEL,
     REALTIME_TEMPERATURE,
     VOICE,
-    PPLX_MODEL,
-    TOOL_DATABASE_NAME,
     CONVERSATION_LOG_PREFIX,
+    METRICS_EXPORTER_PORT,
+    METRICS_EXPORTER_PORT_COUNT,
+    METRICS_JSON_DUMP_PATH,
 )
 import uuid
 
+if TYPE_CHECKING:
+    from agent.tools.ResourceRegistry import ResourceRegistry
+
 load_dotenv(dotenv_path=".env.local")
 logger = logging.getLogger("shopping_agent")
 logger.setLevel(logging.INFO)
 
+# the metrics server of this process, shared by every job it runs
+_metrics_server = None
+
+
+def serve_metrics():
+    """
+    Starts this process's metrics server on the first free port from METRICS_EXPORTER_PORT, if metrics are
+    enabled and it is not running yet. It is shut down when the process exits.
+    """
+    global _metrics_server
+    if not METRICS.enabled or _metrics_server is not None:
+        return
+    _metrics_server = start_metrics_server(
+        METRICS_EXPORTER_PORT, port_count=METRICS_EXPORTER_PORT_COUNT
+    )
+    if _metrics_server is not None:
+        atexit.register(stop_metrics_server, _metrics_server)
+
+
+def prewarm(proc: JobProcess):
+    """
+    Builds the process-wide resources while the worker process is idle, before it is assigned a job.
+
+    Args:
+        proc: The JobProcess being initialised.
+    """
+    # The job-only modules (the tools and their clients) are imported here rather than at the top of the module,
+    # so the worker's main process starts without them and each job process loads them before it is assigned a job.
+    from livekit.agents.multimodal import MultimodalAgent  # noqa: F401
+    from agent.tools.AgentTools import AgentTools  # noqa: F401
+    from agent.tools.AgentConversationLogger import ConversationLogger  # noqa: F401
+    from agent.tools.ResourceRegistry import ResourceRegistry
+
+    serve_metrics()
+    resources = ResourceRegistry.from_environment()
+    resources.warm()
+    resources.start_retention()
+    proc.userdata["resources"] = resources
+
 
 async def entrypoint(ctx: JobContext):
     logger.info(f"connecting to room {ctx.room.name}")
+    # create conversation id
+    conversation_id = str(uuid.uuid4())
+    if profiling_requested(ctx.room.name):
+        profiler = JobProfiler(ctx.room.name, conversation_id)
+        profiler.start()
+
+        async def _write_profile():
+            await profiler.aclose()
+
+        ctx.add_shutdown_callback(_write_profile)
+
+    if METRICS.enabled:
+        serve_metrics()
+
+        async def _dump_metrics():
+            dump_metrics_json(METRICS_JSON_DUMP_PATH.format(ctx.room.name))
+
+        ctx.add_shutdown_callback(_dump_metrics)
+
     await ctx.connect(auto_subscribe=AutoSubscribe.SUBSCRIBE_ALL)
 
     participant = await ctx.wait_for_participant()
     logger.info(f"Started agent for participant {participant.identity}")
 
-    # create conversation id
-    conversation_id = str(uuid.uuid4())
-    run_multimodal_agent(ctx, participant, conversation_id)
+    resources = ctx.proc.userdata.get("resources")
+    if resources is None:
+        from agent.tools.ResourceRegistry import ResourceRegistry
+
+        resources = ctx.proc.userdata["resources"] = ResourceRegistry.from_environment()
+        resources.start_retention()
+    run_multimodal_agent(ctx, participant, conversation_id, resources)
 
     logger.info("agent started")
 
 
 def run_multimodal_agent(
-    ctx: JobContext, participant: rtc.RemoteParticipant, conversation_id: str
+    ctx: JobContext,
+    participant: rtc.RemoteParticipant,
+    conversation_id: str,
+    resources: ResourceRegistry,
 ):
     """
     Sets up and runs a multimodal agent for a given participant in a LiveKit room.
 
-    This function initializes the necessary tools, models, and database connections
-    for the agent. It then configures the agent with specific instructions, voice,
+    This function initializes the necessary tools from the process-wide models and database
+    connection. It then configures the agent with specific instructions, voice,
     and temperature settings. The agent is equipped with tools for image generation,
     web search, and database interaction, enabling it to assist the participant
     with various tasks.
@@ -64,29 +139,28 @@ def run_multimodal_agent(
          ctx: The JobContext object providing access to the LiveKit room.
          participant: The rtc.RemoteParticipant object representing the user in the room.
          conversation_id: A unique identifier for the conversation.
+         resources: The process-wide clients and database, built by prewarm.
 
     Returns:
          None. This function starts the agent and logs the conversation.
 
-    Raises:
-         KeyError: If any required environment variables (e.g., OPENAI_API_KEY, PPLX_API_KEY) are not set.
-
     Example:
          ```
          # Assuming 'ctx' is a JobContext, 'participant' is an rtc.RemoteParticipant,
-         # and 'conversation_id' is a string.
-         run_multimodal_agent(ctx, participant, "unique_conversation_id")
+         # 'conversation_id' is a string and 'resources' is a ResourceRegistry.
+         run_multimodal_agent(ctx, participant, "unique_conversation_id", resources)
          ```
     """
+    from livekit.agents.multimodal import MultimodalAgent
+    from agent.tools.AgentTools import AgentTools
+    from agent.tools.AgentConversationLogger import ConversationLogger
+
     logger.info("Setting up tools")
 
-    # models that can be called in the tools
-    images_model = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-    web_model = PerplexityChat(
-        pplx_api_key=os.environ["PPLX_API_KEY"], pplx_model=PPLX_MODEL
-    )
-    # set up database
-    conversation_and_tool_use_database = AgentDatabase(TOOL_DATABASE_NAME)
+    # models that can be called in the tools, and the database, shared by every job in this process
+    images_model = resources.images_model
+    web_model = resources.web_model
+    conversation_and_tool_use_database = resources.database
 
     logger.info("starting multimodal agent")
 
@@ -111,6 +185,8 @@ def run_multimodal_agent(
         database=conversation_and_tool_use_database,
         user_id=participant.identity,
         conversation_id=conversation_id,
+        scheduler=resources.scheduler,
+        url_validator=resources.url_validator,
     )
 
     initial_context = llm.ChatContext().append(
@@ -134,7 +210,14 @@ def run_multimodal_agent(
         user_id=participant.identity,
         conversation_id=conversation_id,
         log=CONVERSATION_LOG_PREFIX + "_{}.txt".format(participant.identity),
+        speculator=tools.speculator,
     )
+    if tools.speculator is not None:
+        # livekit passes the shutdown reason to callbacks that take an argument, and a bound method's self counts
+        async def _close_speculator():
+            await tools.speculator.aclose()
+
+        ctx.add_shutdown_callback(_close_speculator)
     cp.start()
     agent.start(ctx.room, participant)
 
@@ -159,5 +242,6 @@ if __name__ == "__main__":
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
         )
     )
@@ -0,0 +1,367 @@
+"""
+Micro-benchmarks for AgentDatabase and database_utils as the number of stored records grows.
+
+Usage:
+    python -m benchmarks.benchmark_database --sizes 1000 10000 100000 --output database_benchmark.json
+    python -m benchmarks.benchmark_database --backend sqlite --baseline database_benchmark.json
+"""
+
+import argparse
+import functools
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from benchmarks.benchmark_utils import (
+    compare_to_baseline,
+    run_metadata,
+    summarize_latencies,
+    write_results,
+)
+from benchmarks.synthetic_data import SyntheticConversationGenerator
+from agent.tools.ProductIndex import ProductIndex
+from agent.tools.SchemaCatalog import SchemaCatalog
+from agent.utils.database_utils import (
+    CONVERSATION_FIELDS,
+    convert_database_entries_to_conversation,
+    create_agent_database,
+    get_schema_from_db,
+    run_generated_query,
+)
+
+GENERATED_QUERY = (
+    'db.search((tinydb.Query().data_type != "image") & (tinydb.Query().user_id == "{user_id}") '
+    '& (tinydb.Query().data.matches(".*office chair.*")))'
+)
+
+
+def clear_query_caches(database):
+    """
+    Clears TinyDB's query cache. TinyDB keeps the results of recent queries until the next write, so repeating a
+    read for the same user would otherwise time a copy of the cached list rather than the read. The SQLite
+    backends have no such cache.
+
+    Args:
+        database: Any conversation database backend.
+    """
+    for store in getattr(database, "shards", [database]):
+        clear_cache = getattr(getattr(store, "db", None), "clear_cache", None)
+        if clear_cache is not None:
+            clear_cache()
+
+
+def time_calls(fnc, arguments, before=None):
+    """
+    Times one call of fnc per argument.
+
+    Args:
+        fnc (Callable): The function to time.
+        arguments (list): One positional argument per call.
+        before (Callable, optional): Called without arguments before each call, outside the timing.
+            Defaults to None.
+
+    Returns:
+        tuple: (list of latencies in seconds, result of the last call).
+    """
+    latencies = []
+    result = None
+    for argument in arguments:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        result = fnc(argument)
+        latencies.append(time.perf_counter() - start)
+    return latencies, result
+
+
+def peak_memory(fnc, arguments, before=None):
+    """
+    Measures the peak Python memory allocated by each call of fnc.
+
+    Args:
+        fnc (Callable): The function to measure.
+        arguments (list): One positional argument per call.
+        before (Callable, optional): Called without arguments before each call, outside the measurement.
+            Defaults to None.
+
+    Returns:
+        float: The largest peak across the calls, in MiB.
+    """
+    peaks = []
+    for argument in arguments:
+        if before is not None:
+            before()
+        tracemalloc.start()
+        fnc(argument)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return max(peaks) / (1024 * 1024)
+
+
+def storage_bytes(path):
+    """
+    Returns the on-disk size of a database: the file plus any SQLite WAL/SHM files, or every file
+    under a shard directory.
+
+    Args:
+        path (str): The database file or directory.
+
+    Returns:
+        int: Total size in bytes.
+    """
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    return sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal", "-shm")
+        if os.path.exists(path + suffix)
+    )
+
+
+def benchmark_size(size, args, work_dir):
+    """
+    Loads a fresh database with `size` synthetic records and measures every operation against it.
+
+    Args:
+        size (int): Number of records to preload.
+        args (argparse.Namespace): The benchmark parameters.
+        work_dir (str): Directory for the database files.
+
+    Returns:
+        list: One result row per operation.
+    """
+    generator = SyntheticConversationGenerator(
+        num_users=args.users,
+        num_conversations=args.conversations,
+        image_bytes=args.image_bytes,
+        seed=args.seed,
+    )
+    db_file = os.path.join(work_dir, f"agent_database_{args.backend}_{size}")
+    database = create_agent_database(args.backend, db_file)
+
+    start = time.perf_counter()
+    records = list(generator.generate(size))
+    database.insert_records(records)
+    load_seconds = time.perf_counter() - start
+
+    sampler = random.Random(args.seed)
+    message_ids = [r["id"] for r in sampler.sample(records, min(args.repeats, size))]
+    user_ids = [sampler.choice(generator.users) for _ in range(args.repeats)]
+    scan_user_ids = user_ids[: args.scan_repeats]
+    del records
+
+    rows = [
+        {
+            "size": size,
+            "operation": "bulk_load",
+            **summarize_latencies([load_seconds]),
+            "throughput_per_s": size / load_seconds,
+        }
+    ]
+
+    insert_latencies = []
+    for i in range(args.inserts):
+        user_id = sampler.choice(generator.users)
+        start = time.perf_counter()
+        if i % 4 == 3:
+            database.store_image(
+                user_id, "bench", "question_screenshot", generator.image
+            )
+        else:
+            database.store_text(
+                user_id, "bench", None, "user_input_text", "benchmark turn"
+            )
+        insert_latencies.append(time.perf_counter() - start)
+    rows.append(
+        {
+            "size": size,
+            "operation": "insert",
+            **summarize_latencies(insert_latencies),
+            "throughput_per_s": len(insert_latencies) / sum(insert_latencies),
+        }
+    )
+
+    # reads start from a cold query cache, as the first read of each user in a job would
+    uncached = functools.partial(clear_query_caches, database)
+    latencies, _ = time_calls(
+        database.get_data_by_message_id, message_ids, before=uncached
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "get_data_by_message_id",
+            **summarize_latencies(latencies),
+        }
+    )
+
+    latencies, user_records = time_calls(
+        database.get_data_by_user_id, user_ids, before=uncached
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "get_data_by_user_id",
+            **summarize_latencies(latencies),
+        }
+    )
+
+    read_variants = {
+        "get_data_by_user_id_with_images": lambda user_id: database.get_data_by_user_id(
+            user_id, remove_image_data=False
+        ),
+        "get_data_by_user_id_projected": lambda user_id: database.get_data_by_user_id(
+            user_id, remove_image_data=False, fields=CONVERSATION_FIELDS
+        ),
+        "iter_data_by_user_id_projected": lambda user_id: sum(
+            1
+            for _ in database.iter_data_by_user_id(
+                user_id, remove_image_data=False, fields=CONVERSATION_FIELDS
+            )
+        ),
+    }
+    for operation, read in read_variants.items():
+        latencies, _ = time_calls(read, scan_user_ids, before=uncached)
+        rows.append(
+            {
+                "size": size,
+                "operation": operation,
+                **summarize_latencies(latencies),
+                "peak_memory_mb": peak_memory(read, scan_user_ids[:1], before=uncached),
+            }
+        )
+
+    latencies, schema = time_calls(
+        lambda _: get_schema_from_db(database), range(args.scan_repeats)
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "get_schema_from_db",
+            **summarize_latencies(latencies),
+            "prompt_chars": len(str(schema)),
+        }
+    )
+
+    catalog = SchemaCatalog(database)
+    build_seconds = catalog.refresh()
+    latencies, description = time_calls(catalog.describe, scan_user_ids)
+    rows.append(
+        {
+            "size": size,
+            "operation": "schema_catalog_describe",
+            **summarize_latencies(latencies),
+            "build_ms": 1000 * build_seconds,
+            "prompt_chars": len(description),
+        }
+    )
+
+    latencies, _ = time_calls(
+        lambda user_id: run_generated_query(
+            database, GENERATED_QUERY.format(user_id=user_id)
+        ),
+        scan_user_ids,
+        before=uncached,
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "run_generated_query",
+            **summarize_latencies(latencies),
+        }
+    )
+
+    # the same question as GENERATED_QUERY, answered from the product index; a user's first lookup reads their
+    # records into the index, later ones only look it up
+    index = ProductIndex(database)
+    load_latencies, _ = time_calls(
+        index.load_user, list(dict.fromkeys(scan_user_ids)), before=uncached
+    )
+    latencies, products = time_calls(
+        lambda user_id: index.find(user_id, terms={"office", "chair"}), scan_user_ids
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "product_index_find",
+            **summarize_latencies(latencies),
+            "user_load_ms": 1000 * max(load_latencies),
+            "products": len(products),
+        }
+    )
+
+    latencies, _ = time_calls(
+        convert_database_entries_to_conversation, [user_records] * args.repeats
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "convert_database_entries_to_conversation",
+            "entries": len(user_records),
+            **summarize_latencies(latencies),
+        }
+    )
+
+    rows.append(
+        {
+            "backend": args.backend,
+            "size": size,
+            "operation": "file_size",
+            "bytes": storage_bytes(db_file),
+        }
+    )
+    database.close()
+    return [{"backend": args.backend, **row} for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default="tinydb",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--image-bytes", type=int, default=20000)
+    parser.add_argument("--inserts", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--scan-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="database_benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="agent_db_bench_")
+    rows = []
+    try:
+        for size in args.sizes:
+            for row in benchmark_size(size, args, work_dir):
+                print(json.dumps(row))
+                rows.append(row)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {"meta": run_metadata(**vars(args)), "results": rows}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        results["comparison"] = compare_to_baseline(
+            rows, baseline, ["backend", "size", "operation"], tolerance=args.tolerance
+        )
+        for row in results["comparison"]:
+            if row["regression"]:
+                print(f"REGRESSION: {row}")
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
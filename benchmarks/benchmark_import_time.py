@@ -0,0 +1,170 @@
+"""
+Worker cold start benchmark: how long a fresh Python process takes to import the agent (the point at which the
+worker is ready to register) and to import it and run the prewarm step (the point at which a job process is
+ready to accept a job), plus a `-X importtime` profile of the slowest modules on the import path.
+
+Every measurement starts a new interpreter, so nothing is shared with or cached by the benchmark process.
+
+Usage:
+    python -m benchmarks.benchmark_import_time --repeats 10 --top 25
+    python -m benchmarks.benchmark_import_time --baseline import_time_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.benchmark_utils import (
+    compare_to_baseline,
+    run_metadata,
+    summarize_latencies,
+    write_results,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASUREMENTS = {
+    "worker_ready": "import agent_driver",
+    "job_process_ready": (
+        "import agent_driver\n"
+        "from livekit.agents import JobProcess\n"
+        "agent_driver.prewarm(JobProcess())"
+    ),
+}
+
+
+def run_python(code, work_dir, extra_args=()):
+    """
+    Runs code in a new interpreter from the given directory, with the repo on the path and stand-in API keys.
+
+    Args:
+        code (str): The code to run.
+        work_dir (str): The working directory, which is where the database files get created.
+        extra_args (tuple, optional): Extra interpreter arguments, e.g. ("-X", "importtime").
+
+    Returns:
+        tuple: The wall clock seconds from process start to exit, and the process's stderr.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in [REPO_ROOT, env.get("PYTHONPATH")] if p
+    )
+    env.setdefault("OPENAI_API_KEY", "stand-in")
+    env.setdefault("PPLX_API_KEY", "stand-in")
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, *extra_args, "-c", code],
+        cwd=work_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{completed.stderr}")
+    return elapsed, completed.stderr
+
+
+def parse_importtime(stderr):
+    """
+    Parses the report written by `python -X importtime`.
+
+    Args:
+        stderr (str): The interpreter's stderr.
+
+    Returns:
+        List[dict]: One row per imported module with its name, nesting depth, and self and cumulative
+        import time in milliseconds, in import order.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append(
+            {
+                "module": name.strip(),
+                "depth": depth,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return modules
+
+
+def import_profile(work_dir, top):
+    """
+    Profiles `import agent_driver` and summarises where the time goes.
+
+    Args:
+        work_dir (str): The working directory for the interpreter.
+        top (int): How many modules to report.
+
+    Returns:
+        dict: Total import time, module count, the slowest modules by cumulative time and the slowest
+        by self time.
+    """
+    _, stderr = run_python("import agent_driver", work_dir, ("-X", "importtime"))
+    modules = parse_importtime(stderr)
+    top_level = [m for m in modules if m["depth"] == 1]
+    return {
+        "total_ms": sum(m["cumulative_ms"] for m in top_level),
+        "modules": len(modules),
+        "top_cumulative": sorted(
+            modules, key=lambda m: m["cumulative_ms"], reverse=True
+        )[:top],
+        "top_self": sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--output", default="import_time_benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="agent_import_bench_")
+    rows = []
+    try:
+        # one untimed run so the timed runs see a warm file system cache
+        run_python(MEASUREMENTS["job_process_ready"], work_dir)
+        for measurement, code in MEASUREMENTS.items():
+            samples = [run_python(code, work_dir)[0] for _ in range(args.repeats)]
+            row = {"measurement": measurement, **summarize_latencies(samples)}
+            print(json.dumps(row))
+            rows.append(row)
+        profile = import_profile(work_dir, args.top)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"import agent_driver: {profile['total_ms']:.1f}ms")
+    for module in profile["top_cumulative"]:
+        print(f"{module['cumulative_ms']:10.1f}ms  {module['module']}")
+
+    results = {
+        "meta": run_metadata(**vars(args)),
+        "results": rows,
+        "import_profile": profile,
+    }
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        results["comparison"] = compare_to_baseline(
+            rows, baseline, ["measurement"], tolerance=args.tolerance
+        )
+        for row in results["comparison"]:
+            if row["regression"]:
+                print(f"REGRESSION: {row}")
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Offline benchmark of the link checks open_urls makes before opening citations.
+
+A local web server stands in for the retailers, with live product pages, redirects from old URLs, dead links
+and pages that refuse automated requests. Each batch is a citation list drawn from a pool of popular pages,
+with the tracking parameters, fragments and trailing slashes real citations carry. Batches are checked one
+URL at a time without a cache ("sequential", the cost of checking links naively) and with UrlValidator, and
+the report compares the time per batch, requests made, dead links that would be opened and duplicate tabs.
+
+Usage:
+    python -m benchmarks.benchmark_open_urls --batches 200 --site-median-ms 150
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from benchmarks.benchmark_utils import (
+    compare_to_baseline,
+    run_metadata,
+    summarize_latencies,
+    write_results,
+)
+from benchmarks.stand_ins import LatencyProfile, WebsiteStandIn
+from agent.tools.HedgedExecutor import FallbackCache
+from agent.tools.UrlValidator import UrlValidator
+from agent.utils.url_utils import canonicalize_url
+
+# (path kind, weight) of the links in a citation list
+LINK_KINDS = [("product", 6), ("old", 2), ("gone", 1), ("blocked", 1)]
+DECORATIONS = [
+    "",
+    "/",
+    "?utm_source=perplexity",
+    "?ref_src=citation&utm_medium=ai",
+    "#reviews",
+]
+
+
+def citation_batches(base_url, batches, popular, per_batch, seed):
+    """
+    Generates citation lists.
+
+    Args:
+        base_url (str): The stand-in's URL.
+        batches (int): Number of lists.
+        popular (int): Number of distinct pages the links are drawn from, the most popular most often.
+        per_batch (int): Links per list.
+        seed (int): Random seed.
+
+    Returns:
+        List[List[str]]: The lists.
+    """
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight in LINK_KINDS for _ in range(weight)]
+    weights = [1 / (rank + 1) for rank in range(popular)]
+    lists = []
+    for _ in range(batches):
+        urls = []
+        for _ in range(per_batch):
+            number = rng.choices(range(popular), weights)[0]
+            urls.append(
+                f"{base_url}/{rng.choice(kinds)}/{number}{rng.choice(DECORATIONS)}"
+            )
+        lists.append(urls)
+    return lists
+
+
+def landing_page(url):
+    """
+    Returns the canonical URL of the page a stand-in link lands on, following its redirect.
+    """
+    return canonicalize_url(url).replace("/old/", "/product/")
+
+
+def check_sequentially(validator, urls):
+    """
+    Checks every URL in turn, without merging duplicates.
+
+    Returns:
+        List[str]: The live links, as cited.
+    """
+    checked = [validator.check(url) for url in urls]
+    return [result["url"] for result in checked if result["alive"]]
+
+
+async def open_batch(mode, validator, urls):
+    """
+    Returns the URLs open_urls would open for a citation list in the given mode.
+    """
+    if mode == "unchecked":
+        return list(urls)
+    if mode == "sequential":
+        return await asyncio.to_thread(check_sequentially, validator, urls)
+    return [r["url"] for r in await validator.validate(urls) if r["alive"]]
+
+
+async def run(args):
+    """
+    Opens every citation list in each mode against the stand-in.
+
+    Returns:
+        List[dict]: One row per mode, with the links opened, dead links and duplicate tabs among them,
+        requests made and the latency per batch.
+    """
+    site = WebsiteStandIn(
+        LatencyProfile(args.site_median_ms, args.sigma), seed=args.seed
+    ).start()
+    batches = citation_batches(
+        site.url, args.batches, args.popular, args.per_batch, args.seed
+    )
+    rows = []
+    try:
+        for mode in ["unchecked", "sequential", "validator"]:
+            validator = UrlValidator(
+                cache=FallbackCache(args.cache_size),
+                dead_cache=FallbackCache(args.cache_size),
+            )
+            if mode == "sequential":
+                # every entry expires straight away, so nothing is served from the cache
+                validator.cache.ttl_seconds = validator.dead_cache.ttl_seconds = -1
+            served_before = site.requests_served
+            latencies, opened, dead_opened, duplicate_tabs = [], 0, 0, 0
+            for urls in batches:
+                start = time.perf_counter()
+                to_open = await open_batch(mode, validator, urls)
+                latencies.append(time.perf_counter() - start)
+                pages = [landing_page(url) for url in to_open]
+                opened += len(pages)
+                dead_opened += sum("/gone/" in page for page in pages)
+                duplicate_tabs += len(pages) - len(set(pages))
+            validator.close()
+            rows.append(
+                {
+                    "mode": mode,
+                    "batches": len(batches),
+                    "links": sum(len(urls) for urls in batches),
+                    "opened": opened,
+                    "dead_opened": dead_opened,
+                    "duplicate_tabs": duplicate_tabs,
+                    "requests": site.requests_served - served_before,
+                    **summarize_latencies(latencies),
+                }
+            )
+    finally:
+        site.stop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batches", type=int, default=100)
+    parser.add_argument("--per-batch", type=int, default=5)
+    parser.add_argument("--popular", type=int, default=40)
+    parser.add_argument("--site-median-ms", type=float, default=150)
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="open_urls_benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    for row in rows:
+        print(json.dumps(row))
+
+    results = {"meta": run_metadata(**vars(args)), "results": rows}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        results["comparison"] = compare_to_baseline(
+            rows, baseline["results"], ["mode"], tolerance=args.tolerance
+        )
+        for row in results["comparison"]:
+            if row["regression"]:
+                print(f"REGRESSION: {row}")
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
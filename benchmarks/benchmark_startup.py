@@ -0,0 +1,148 @@
+"""
+Per-job startup benchmark: how long a job takes from being assigned to having its tools ready and its first
+web search answered, with resources built per job (the old behaviour) and with a prewarmed ResourceRegistry.
+
+Usage:
+    python -m benchmarks.benchmark_startup --backend tinydb --records 20000 --jobs 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from benchmarks.benchmark_utils import run_metadata, summarize_latencies, write_results
+from benchmarks.fake_room import FakeRoom, FakeScreenshotSource, fake_frame_source
+from benchmarks.stand_ins import LatencyProfile, PerplexityStandIn
+from benchmarks.synthetic_data import SyntheticConversationGenerator
+from agent.tools.AgentTools import AgentTools
+from agent.tools.ResourceRegistry import ResourceRegistry
+from agent.utils.database_utils import create_agent_database
+
+
+async def run_job(resources, index):
+    """
+    Runs the per-job part of startup: builds the tools and answers one web search.
+
+    Args:
+        resources (ResourceRegistry): The clients and database the job uses.
+        index (int): The job index.
+
+    Returns:
+        tuple: Seconds to build the tools, and seconds to answer the first search.
+    """
+    start = time.perf_counter()
+    tools = AgentTools(
+        FakeRoom(f"room_{index}", seed=index),
+        resources.images_model,
+        resources.web_model,
+        database=resources.database,
+        user_id=f"user_{index}",
+        conversation_id=str(uuid.uuid4()),
+        frame_source=fake_frame_source,
+        screenshot_source=FakeScreenshotSource(seed=index),
+    )
+    setup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await tools.search_the_web(
+        user_question="What is the best price for an office chair?"
+    )
+    first_request_seconds = time.perf_counter() - start
+    return setup_seconds, first_request_seconds
+
+
+def build_resources(db_path, args, pplx):
+    return ResourceRegistry(
+        "stand-in",
+        "stand-in",
+        database=create_agent_database(args.backend, db_path),
+        openai_base_url="http://127.0.0.1:1/v1",
+        pplx_base_url=pplx.url + "/chat/completions",
+    )
+
+
+async def run(args, work_dir):
+    """
+    Preloads a database, then times args.jobs jobs in each mode.
+
+    Args:
+        args (argparse.Namespace): The benchmark parameters.
+        work_dir (str): Directory for the database files.
+
+    Returns:
+        dict: The report.
+    """
+    db_path = os.path.join(work_dir, "agent_database")
+    database = create_agent_database(args.backend, db_path)
+    database.insert_records(
+        SyntheticConversationGenerator(seed=args.seed).generate(args.records)
+    )
+    database.close()
+
+    pplx = PerplexityStandIn(LatencyProfile(args.pplx_median_ms, 0.1)).start()
+    report = {}
+    try:
+        setups, firsts = [], []
+        for i in range(args.jobs):
+            start = time.perf_counter()
+            resources = build_resources(db_path, args, pplx)
+            resource_seconds = time.perf_counter() - start
+            setup_seconds, first_seconds = await run_job(resources, i)
+            setups.append(resource_seconds + setup_seconds)
+            firsts.append(first_seconds)
+            resources.close()
+        report["per_job_resources"] = {
+            "job_setup": summarize_latencies(setups),
+            "first_request": summarize_latencies(firsts),
+        }
+
+        start = time.perf_counter()
+        resources = build_resources(db_path, args, pplx)
+        resources.warm()
+        prewarm_seconds = time.perf_counter() - start
+        setups, firsts = [], []
+        for i in range(args.jobs):
+            setup_seconds, first_seconds = await run_job(resources, i)
+            setups.append(setup_seconds)
+            firsts.append(first_seconds)
+        resources.close()
+        report["prewarmed_registry"] = {
+            "prewarm": summarize_latencies([prewarm_seconds]),
+            "job_setup": summarize_latencies(setups),
+            "first_request": summarize_latencies(firsts),
+        }
+    finally:
+        pplx.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default="tinydb",
+    )
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--pplx-median-ms", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="startup_benchmark.json")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="agent_startup_bench_")
+    try:
+        report = asyncio.run(run(args, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    write_results(args.output, {"meta": run_metadata(**vars(args)), "results": report})
+
+
+if __name__ == "__main__":
+    main()
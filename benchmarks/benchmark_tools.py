@@ -0,0 +1,260 @@
+"""
+Offline end-to-end latency harness for AgentTools.
+
+Runs many simulated rooms concurrently on one event loop, each calling every tool against local
+stand-ins for Perplexity and OpenAI, a FakeRoom video source and a fake screenshot source, and
+reports per-tool throughput, tail latency and event-loop lag.
+
+Usage:
+    python -m benchmarks.benchmark_tools --rooms 20 --calls 5 --pplx-median-ms 1500 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from openai import OpenAI
+from benchmarks.benchmark_utils import run_metadata, summarize_latencies, write_results
+from benchmarks.fake_room import FakeRoom, FakeScreenshotSource, fake_frame_source
+from benchmarks.stand_ins import LatencyProfile, OpenAIStandIn, PerplexityStandIn
+from agent.tools.AgentTools import AgentTools
+from agent.tools.PerplexityChat import PerplexityChat
+from agent.tools.UpstreamScheduler import UpstreamScheduler
+from agent.utils.database_utils import create_agent_database
+from agent.utils.metrics_utils import EventLoopLagMonitor
+from agent.config import CAMERA_BURST_FRAMES
+
+TOOL_CALLS = {
+    "get_todays_date_and_time": lambda tools: tools.get_todays_date_and_time(),
+    "search_the_web": lambda tools: tools.search_the_web(
+        user_question="What is the best price for the Herman Miller Aeron chair?"
+    ),
+    "search_the_web_multi": lambda tools: tools.search_the_web_multi(
+        user_questions=[
+            "What is the best price for the Sony WH-1000XM5?",
+            "What is the best price for the Bose QuietComfort Ultra?",
+            "What is the best price for the Apple AirPods Max?",
+        ]
+    ),
+    "question_screenshot": lambda tools: tools.question_screenshot(
+        user_question="Is the price of this chair reasonable?"
+    ),
+    "question_camera_image": lambda tools: tools.question_camera_image(
+        user_question="What product am I holding up?"
+    ),
+    "query_conversation_logs": lambda tools: tools.query_conversation_logs(
+        user_question="Find my conversations about office chairs"
+    ),
+}
+
+
+def build_tools(index, args, pplx, openai_stand_in, database, scheduler=None):
+    """
+    Builds the AgentTools instance for one simulated room.
+
+    Args:
+        index (int): The room index.
+        args (argparse.Namespace): The harness parameters.
+        pplx (PerplexityStandIn): The running Perplexity stand-in.
+        openai_stand_in (OpenAIStandIn): The running OpenAI stand-in.
+        database (AgentDatabase | SQLiteAgentDatabase): The database shared by all rooms.
+        scheduler (UpstreamScheduler, optional): The scheduler shared by all rooms. Defaults to None.
+
+    Returns:
+        AgentTools: The tools for that room.
+    """
+    return AgentTools(
+        FakeRoom(
+            f"room_{index}",
+            frame_delay=args.frame_delay_ms / 1000,
+            blur_rate=args.blur_rate,
+            seed=index,
+        ),
+        OpenAI(api_key="stand-in", base_url=openai_stand_in.url + "/v1", max_retries=0),
+        PerplexityChat(
+            pplx_api_key="stand-in", base_url=pplx.url + "/chat/completions"
+        ),
+        database=database,
+        user_id=f"user_{index % args.users}",
+        conversation_id=str(uuid.uuid4()),
+        frame_source=functools.partial(
+            fake_frame_source, burst_frames=args.burst_frames
+        ),
+        screenshot_source=FakeScreenshotSource(seed=index),
+        hedging=args.hedging,
+        scheduler=scheduler,
+    )
+
+
+async def simulate_room(tools, args, latencies):
+    """
+    Calls every selected tool `args.calls` times, recording each call's latency.
+
+    Args:
+        tools (AgentTools): The tools for this room.
+        args (argparse.Namespace): The harness parameters.
+        latencies (dict): Tool name -> list of latencies in seconds, appended to in place.
+    """
+    for _ in range(args.calls):
+        for name in args.tools:
+            start = time.perf_counter()
+            await TOOL_CALLS[name](tools)
+            latencies[name].append(time.perf_counter() - start)
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000)
+
+
+async def run(args, work_dir):
+    """
+    Starts the stand-ins, runs all simulated rooms concurrently and builds the report.
+
+    Args:
+        args (argparse.Namespace): The harness parameters.
+        work_dir (str): Directory for the database file.
+
+    Returns:
+        dict: The report.
+    """
+    pplx = PerplexityStandIn(
+        LatencyProfile(
+            args.pplx_median_ms, args.sigma, args.error_rate, args.error_status
+        ),
+        seed=args.seed,
+    ).start()
+    openai_stand_in = OpenAIStandIn(
+        LatencyProfile(
+            args.openai_median_ms, args.sigma, args.error_rate, args.error_status
+        ),
+        seed=args.seed + 1,
+    ).start()
+    database = create_agent_database(
+        args.backend, os.path.join(work_dir, "agent_database")
+    )
+    latencies = {name: [] for name in args.tools}
+    monitor = EventLoopLagMonitor(interval=args.lag_interval_ms / 1000)
+    scheduler = UpstreamScheduler() if args.scheduler else None
+
+    try:
+        rooms = [
+            build_tools(i, args, pplx, openai_stand_in, database, scheduler)
+            for i in range(args.rooms)
+        ]
+        monitor.start()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(simulate_room(tools, args, latencies) for tools in rooms)
+        )
+        wall_seconds = time.perf_counter() - start
+        await monitor.aclose()
+    finally:
+        if scheduler is not None:
+            scheduler.close()
+        pplx.stop()
+        openai_stand_in.stop()
+
+    hedges = {}
+    for tools in rooms:
+        for tool_id, executor in tools._executors.items():
+            for name, count in executor.stats.items():
+                hedges.setdefault(tool_id, {}).setdefault(name, 0)
+                hedges[tool_id][name] += count
+
+    frames_captured = sum(tools._room.frames_captured for tools in rooms)
+    blurred_captured = sum(tools._room.blurred_captured for tools in rooms)
+
+    total_calls = sum(len(v) for v in latencies.values())
+    return {
+        "wall_seconds": wall_seconds,
+        "total_calls": total_calls,
+        "throughput_per_s": total_calls / wall_seconds,
+        "tools": {
+            name: {
+                **summarize_latencies(samples),
+                "throughput_per_s": len(samples) / wall_seconds,
+            }
+            for name, samples in latencies.items()
+        },
+        "event_loop_lag": summarize_latencies(monitor.samples),
+        "hedges": hedges,
+        "scheduler_queue_wait": (
+            {
+                f"{upstream}.{priority}": summarize_latencies(list(waits))
+                for (upstream, priority), waits in scheduler.queue_waits.items()
+            }
+            if scheduler is not None
+            else None
+        ),
+        "camera_frames": {
+            "captured": frames_captured,
+            "blurred": blurred_captured,
+            "blurred_fraction": blurred_captured / max(1, frames_captured),
+        },
+        "upstream_requests": {
+            "perplexity": pplx.requests_served,
+            "openai": openai_stand_in.requests_served,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default="tinydb",
+    )
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=3)
+    parser.add_argument(
+        "--tools", nargs="+", default=list(TOOL_CALLS), choices=list(TOOL_CALLS)
+    )
+    parser.add_argument("--pplx-median-ms", type=float, default=1500)
+    parser.add_argument("--openai-median-ms", type=float, default=1200)
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--frame-delay-ms", type=float, default=33)
+    parser.add_argument(
+        "--blur-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of camera frames that are blurred",
+    )
+    parser.add_argument(
+        "--burst-frames",
+        type=int,
+        default=CAMERA_BURST_FRAMES,
+        help="Camera frames to pick the sharpest from, 1 to send the first frame",
+    )
+    parser.add_argument("--think-ms", type=float, default=0)
+    parser.add_argument(
+        "--hedging", action="store_true", help="Send hedged duplicate requests"
+    )
+    parser.add_argument(
+        "--scheduler",
+        action="store_true",
+        help="Share an UpstreamScheduler (UPSTREAM_LIMITS) between the rooms",
+    )
+    parser.add_argument("--lag-interval-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="tools_benchmark.json")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="agent_tools_bench_")
+    try:
+        report = asyncio.run(run(args, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    write_results(args.output, {"meta": run_metadata(**vars(args)), "results": report})
+
+
+if __name__ == "__main__":
+    main()
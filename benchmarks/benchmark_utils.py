@@ -0,0 +1,115 @@
+import json
+import platform
+import statistics
+import time
+from typing import Any, Dict, List
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    Returns the nearest-rank percentile of a list of samples.
+
+    Args:
+        samples (List[float]): The samples.
+        fraction (float): The percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float: The percentile value, or 0.0 for an empty list.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize_latencies(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarizes latency samples given in seconds.
+
+    Args:
+        samples (List[float]): Latencies in seconds.
+
+    Returns:
+        Dict[str, float]: Sample count and mean/p50/p95/p99/max latencies in milliseconds.
+    """
+    return {
+        "samples": len(samples),
+        "mean_ms": 1000 * statistics.fmean(samples) if samples else 0.0,
+        "p50_ms": 1000 * percentile(samples, 0.50),
+        "p95_ms": 1000 * percentile(samples, 0.95),
+        "p99_ms": 1000 * percentile(samples, 0.99),
+        "max_ms": 1000 * max(samples) if samples else 0.0,
+    }
+
+
+def run_metadata(**extra) -> Dict[str, Any]:
+    """
+    Returns metadata describing the environment a benchmark ran in.
+
+    Args:
+        **extra: Additional fields to record, e.g. the benchmark parameters.
+
+    Returns:
+        Dict[str, Any]: The metadata.
+    """
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        **extra,
+    }
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    """
+    Writes benchmark results to a JSON file.
+
+    Args:
+        path (str): The output path.
+        results (Dict[str, Any]): The results.
+    """
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def compare_to_baseline(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    key_fields: List[str],
+    metric: str = "p50_ms",
+    tolerance: float = 0.2,
+) -> List[Dict[str, Any]]:
+    """
+    Compares benchmark rows against a baseline run and flags regressions.
+
+    Args:
+        results (List[Dict[str, Any]]): Rows from the current run.
+        baseline (List[Dict[str, Any]]): Rows from the baseline run.
+        key_fields (List[str]): Fields that identify the same measurement in both runs.
+        metric (str, optional): The latency field to compare. Defaults to "p50_ms".
+        tolerance (float, optional): Allowed relative slowdown before a row is flagged. Defaults to 0.2.
+
+    Returns:
+        List[Dict[str, Any]]: One row per measurement present in both runs, with the baseline and
+        current values, the relative change and a "regression" flag.
+    """
+    baseline_rows = {tuple(row[k] for k in key_fields): row for row in baseline}
+    comparison = []
+    for row in results:
+        key = tuple(row[k] for k in key_fields)
+        if key not in baseline_rows or metric not in row:
+            continue
+        before = baseline_rows[key][metric]
+        after = row[metric]
+        change = (after - before) / before if before else 0.0
+        comparison.append(
+            {
+                **{k: row[k] for k in key_fields},
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "regression": change > tolerance,
+            }
+        )
+    return comparison
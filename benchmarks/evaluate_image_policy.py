@@ -0,0 +1,279 @@
+"""
+Offline evaluation of the adaptive image policy: re-encodes stored (or synthetic) vision question images with the
+legacy settings and with the policy select_image_policy picks, and reports the bytes uploaded and image tokens
+billed under each, per policy.
+
+Stored images are read from a conversation database and paired with the question asked in the same tool call.
+Images that cannot be decoded (e.g. the random payloads of benchmarks.synthetic_data) are skipped.
+
+--delta-sequences evaluates follow-up screenshots instead: each sequence is a synthetic screen followed by the
+same screen with one region redrawn (a dropdown, a cart update), and the follow-up is encoded as a full frame
+and with encode_screenshot's delta modes.
+
+Usage:
+    python -m benchmarks.evaluate_image_policy --backend sqlite --db-file agent_database.sqlite3
+    python -m benchmarks.evaluate_image_policy --synthetic 200
+    python -m benchmarks.evaluate_image_policy --delta-sequences 50
+"""
+
+import argparse
+import base64
+import io
+import json
+import random
+import time
+from PIL import Image
+from benchmarks.benchmark_utils import run_metadata, write_results
+from benchmarks.fake_room import FakeScreenshotSource, synthetic_product_image
+from agent.utils.database_utils import create_agent_database
+from agent.utils.image_utils import (
+    encode_screenshot,
+    estimate_image_tokens,
+    resize_to_width,
+    screenshot_delta,
+    select_image_policy,
+    to_grey_array,
+)
+
+SYNTHETIC_QUESTIONS = [
+    ("screen", "Is the price of this chair reasonable?"),
+    ("screen", "What does the shipping total come to?"),
+    ("screen", "Which of these products would you pick?"),
+    ("screen", "What colour options are there?"),
+    ("camera", "What am I holding?"),
+    ("camera", "What brand is this?"),
+    ("camera", "How much does this usually cost?"),
+    ("camera", "Can you find similar items?"),
+]
+
+
+def render(image, source, question, adaptive):
+    """
+    Resizes and encodes an image the way the tool would send it.
+
+    Args:
+        image (PIL.Image.Image): The captured image.
+        source (str): "screen" for question_screenshot or "camera" for question_camera_image.
+        question (str): The question asked about the image.
+        adaptive (bool): Whether to use the adaptive policy or the legacy settings.
+
+    Returns:
+        dict: The policy name, encoded bytes, estimated tokens and encode time in milliseconds.
+    """
+    start = time.perf_counter()
+    if source == "screen":
+        name, policy = select_image_policy(question, image, adaptive=adaptive)
+        resized = resize_to_width(image, policy["max_width"])
+    else:
+        name, policy = select_image_policy(question, adaptive=adaptive)
+        resized = image.copy()
+        resized.thumbnail((512, 512))
+    buffered = io.BytesIO()
+    resized.convert("RGB").save(buffered, format="JPEG", quality=policy["jpeg_quality"])
+    return {
+        "policy": name,
+        "bytes": len(buffered.getvalue()),
+        "tokens": estimate_image_tokens(*resized.size, detail=policy["detail"]),
+        "encode_ms": 1000 * (time.perf_counter() - start),
+    }
+
+
+def stored_samples(database):
+    """
+    Yields the vision questions stored in a database with their images.
+
+    Args:
+        database: Any conversation database backend.
+
+    Yields:
+        tuple: The source ("screen" or "camera"), question and PIL image.
+    """
+    sources = {"question_screenshot": "screen", "question_camera_image": "camera"}
+    records = sorted(
+        (r for r in database.all() if r.get("tool_id") in sources),
+        key=lambda r: (r["conversation_id"], r["timestamp"]),
+    )
+    questions = {}
+    for record in records:
+        key = (record["conversation_id"], record["tool_id"])
+        if record["data_type"] == "input":
+            questions[key] = record["data"]
+        elif record["data_type"] == "image" and record.get("data"):
+            try:
+                image = Image.open(io.BytesIO(base64.b64decode(record["data"])))
+                image.load()
+            except Exception:
+                continue
+            yield sources[record["tool_id"]], questions.get(key, ""), image
+
+
+def synthetic_samples(count, seed):
+    """
+    Yields synthetic screenshots and camera frames, each paired with a sample question.
+
+    Args:
+        count (int): Number of samples.
+        seed (int): Random seed.
+
+    Yields:
+        tuple: The source ("screen" or "camera"), question and PIL image.
+    """
+    rng = random.Random(seed)
+    screens = FakeScreenshotSource(seed=seed)
+    for i in range(count):
+        source, question = SYNTHETIC_QUESTIONS[i % len(SYNTHETIC_QUESTIONS)]
+        if source == "screen":
+            image = screens()
+        else:
+            image = synthetic_product_image(
+                1280, 720, rng, text_lines=rng.randint(0, 12)
+            )
+        yield source, question, image
+
+
+def evaluate(samples):
+    """
+    Compares the legacy and adaptive encodings of every sample.
+
+    Args:
+        samples: Iterable of (source, question, image) tuples.
+
+    Returns:
+        dict: Totals per adaptive policy and overall, with the bytes and tokens saved.
+    """
+    groups = {}
+    for source, question, image in samples:
+        legacy = render(image, source, question, adaptive=False)
+        adaptive = render(image, source, question, adaptive=True)
+        for key in (f"{source}/{adaptive['policy']}", "all"):
+            group = groups.setdefault(
+                key,
+                {
+                    "samples": 0,
+                    "legacy_bytes": 0,
+                    "adaptive_bytes": 0,
+                    "legacy_tokens": 0,
+                    "adaptive_tokens": 0,
+                    "adaptive_encode_ms": 0.0,
+                },
+            )
+            group["samples"] += 1
+            group["legacy_bytes"] += legacy["bytes"]
+            group["adaptive_bytes"] += adaptive["bytes"]
+            group["legacy_tokens"] += legacy["tokens"]
+            group["adaptive_tokens"] += adaptive["tokens"]
+            group["adaptive_encode_ms"] += adaptive["encode_ms"]
+
+    for group in groups.values():
+        group["bytes_saved"] = 1 - group["adaptive_bytes"] / max(
+            1, group["legacy_bytes"]
+        )
+        group["tokens_saved"] = 1 - group["adaptive_tokens"] / max(
+            1, group["legacy_tokens"]
+        )
+        group["adaptive_encode_ms"] /= group["samples"]
+    return dict(sorted(groups.items()))
+
+
+def evaluate_delta(count, seed):
+    """
+    Compares sending follow-up screenshots as full frames with sending them with each delta mode.
+
+    Args:
+        count (int): Number of screenshot pairs.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Totals per mode, with how the follow-ups were sent and the bytes and tokens saved against full frames.
+    """
+    rng = random.Random(seed)
+    screens = FakeScreenshotSource(seed=seed)
+    question = "What does the shipping total come to?"
+    modes = ["off", "crop", "composite"]
+    totals = {
+        mode: {"samples": 0, "bytes": 0, "tokens": 0, "diff_ms": 0.0, "sent": {}}
+        for mode in modes
+    }
+    for _ in range(count):
+        first = screens()
+        second = first.copy()
+        width = rng.randint(first.size[0] // 8, first.size[0] // 3)
+        height = rng.randint(first.size[1] // 8, first.size[1] // 3)
+        patch = synthetic_product_image(
+            width, height, rng, text_lines=rng.randint(2, 8)
+        )
+        second.paste(
+            patch,
+            (
+                rng.randint(0, first.size[0] - width),
+                rng.randint(0, first.size[1] - height),
+            ),
+        )
+        start = time.perf_counter()
+        delta = screenshot_delta(to_grey_array(first), to_grey_array(second))
+        diff_ms = 1000 * (time.perf_counter() - start)
+        _, policy = select_image_policy(question, second)
+        for mode in modes:
+            sent_as, images = encode_screenshot(second, policy, delta, mode=mode)
+            total = totals[mode]
+            total["samples"] += 1
+            total["diff_ms"] += diff_ms
+            total["sent"][sent_as] = total["sent"].get(sent_as, 0) + 1
+            for data, detail in images:
+                image = Image.open(io.BytesIO(base64.b64decode(data)))
+                total["bytes"] += len(base64.b64decode(data))
+                total["tokens"] += estimate_image_tokens(*image.size, detail=detail)
+
+    full = totals["off"]
+    for total in totals.values():
+        total["diff_ms"] /= max(1, total["samples"])
+        total["bytes_saved"] = 1 - total["bytes"] / max(1, full["bytes"])
+        total["tokens_saved"] = 1 - total["tokens"] / max(1, full["tokens"])
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default=None,
+        help="Evaluate the images stored in this database",
+    )
+    parser.add_argument("--db-file", default=None)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="Also evaluate this many synthetic screenshots and camera frames",
+    )
+    parser.add_argument(
+        "--delta-sequences",
+        type=int,
+        default=0,
+        help="Also evaluate this many follow-up screenshots sent as deltas",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="image_policy_evaluation.json")
+    args = parser.parse_args()
+    if args.backend is None and not args.synthetic and not args.delta_sequences:
+        parser.error("pass --backend, --synthetic and/or --delta-sequences")
+
+    results = {}
+    if args.backend is not None:
+        database = create_agent_database(args.backend, args.db_file)
+        try:
+            results["stored"] = evaluate(stored_samples(database))
+        finally:
+            database.close()
+    if args.synthetic:
+        results["synthetic"] = evaluate(synthetic_samples(args.synthetic, args.seed))
+    if args.delta_sequences:
+        results["delta"] = evaluate_delta(args.delta_sequences, args.seed)
+
+    print(json.dumps(results, indent=2))
+    write_results(args.output, {"meta": run_metadata(**vars(args)), "results": results})
+
+
+if __name__ == "__main__":
+    main()
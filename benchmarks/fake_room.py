@@ -0,0 +1,207 @@
+"""
+Offline stand-ins for the LiveKit room, the realtime model and the local screen, used to drive AgentTools and
+ConversationLogger without a LiveKit server.
+"""
+
+import asyncio
+import random
+import weakref
+from types import SimpleNamespace
+from livekit import rtc
+from livekit.agents import utils
+from livekit.agents.llm import ChatMessage
+from PIL import Image, ImageDraw, ImageFilter
+from agent.utils.image_utils import encode_video_frame, select_sharpest_frame
+from agent.config import CAMERA_BURST_FRAMES, CAMERA_BURST_BUDGET_SECONDS
+
+
+def synthetic_product_image(width, height, rng, text_lines=12):
+    """
+    Draws a synthetic product-page style image: a header bar, a product photo block and lines of text.
+
+    Args:
+        width (int): Image width in pixels.
+        height (int): Image height in pixels.
+        rng (random.Random): Random source for colours and layout.
+        text_lines (int, optional): Number of text lines to draw. Defaults to 12.
+
+    Returns:
+        PIL.Image.Image: An RGB image.
+    """
+    image = Image.new("RGB", (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, height // 12), fill=(35, 47, 62))
+    colour = tuple(rng.randint(40, 220) for _ in range(3))
+    draw.rectangle((width // 20, height // 6, width // 2, height * 3 // 4), fill=colour)
+    for i in range(text_lines):
+        y = height // 6 + i * height // (2 * text_lines)
+        draw.text(
+            (width * 11 // 20, y),
+            f"Product detail line {i}: ${rng.randint(20, 999)}.99",
+            fill=(20, 20, 20),
+        )
+    return image
+
+
+class FakeRoom:
+    """
+    A stand-in for rtc.Room that serves synthetic video frames.
+
+    Use fake_frame_source as the AgentTools frame_source to capture frames from it.
+    """
+
+    def __init__(
+        self, name, width=1280, height=720, frame_delay=0.0, blur_rate=0.0, seed=0
+    ):
+        """
+        Initializes the room.
+
+        Args:
+            name (str): The room name.
+            width (int, optional): Frame width in pixels. Defaults to 1280.
+            height (int, optional): Frame height in pixels. Defaults to 720.
+            frame_delay (float, optional): Seconds to wait before a frame is available, simulating
+                the time to the next frame on a real stream. Defaults to 0.0.
+            blur_rate (float, optional): Fraction of frames that are blurred, as if the user was still
+                moving the item. Defaults to 0.0.
+            seed (int, optional): Random seed. Defaults to 0.
+        """
+        self.name = name
+        self.remote_participants = {}
+        self.width = width
+        self.height = height
+        self.frame_delay = frame_delay
+        self.blur_rate = blur_rate
+        self.frames_captured = 0
+        self.blurred_captured = 0
+        self._blurred = weakref.WeakSet()
+        self._rng = random.Random(seed)
+
+    async def next_frame(self) -> rtc.VideoFrame:
+        """
+        Returns the next synthetic frame as an RGBA rtc.VideoFrame.
+
+        Returns:
+            rtc.VideoFrame: The frame.
+        """
+        if self.frame_delay:
+            await asyncio.sleep(self.frame_delay)
+        image = synthetic_product_image(self.width, self.height, self._rng)
+        blurred = self.blur_rate and self._rng.random() < self.blur_rate
+        if blurred:
+            image = image.filter(ImageFilter.GaussianBlur(4))
+        image = image.convert("RGBA")
+        frame = rtc.VideoFrame(
+            self.width, self.height, rtc.VideoBufferType.RGBA, image.tobytes()
+        )
+        if blurred:
+            self._blurred.add(frame)
+        return frame
+
+    def record_capture(self, frame: rtc.VideoFrame) -> None:
+        """
+        Counts a frame sent to the vision model, and whether it was a blurred one.
+
+        Args:
+            frame (rtc.VideoFrame): The frame that was captured.
+        """
+        self.frames_captured += 1
+        if frame in self._blurred:
+            self.blurred_captured += 1
+
+    async def frames(self):
+        """
+        Yields frames for as long as the caller reads them, like iterating an rtc.VideoStream.
+
+        Yields:
+            rtc.VideoFrame: The next frame.
+        """
+        while True:
+            yield await self.next_frame()
+
+
+async def fake_frame_source(
+    room: FakeRoom,
+    quality=75,
+    burst_frames=CAMERA_BURST_FRAMES,
+    budget_seconds=CAMERA_BURST_BUDGET_SECONDS,
+):
+    """
+    Drop-in replacement for capture_image_from_video_stream that reads from a FakeRoom.
+
+    Args:
+        room (FakeRoom): The room to capture from.
+        quality (int, optional): JPEG quality. Defaults to 75.
+        burst_frames (int, optional): Frames to pick the sharpest from. Defaults to CAMERA_BURST_FRAMES.
+        budget_seconds (float, optional): Time allowed for the burst. Defaults to CAMERA_BURST_BUDGET_SECONDS.
+
+    Returns:
+        dict: {"pil_image": ..., "b64_image": ...}, as returned by capture_image_from_video_stream.
+    """
+    if burst_frames > 1:
+        frames = room.frames()
+        try:
+            frame = await select_sharpest_frame(frames, burst_frames, budget_seconds)
+        finally:
+            await frames.aclose()
+    else:
+        frame = await room.next_frame()
+    room.record_capture(frame)
+    return encode_video_frame(frame, quality=quality)
+
+
+class FakeScreenshotSource:
+    """
+    A callable stand-in for ImageGrab.grab that returns synthetic product-page screenshots.
+    """
+
+    def __init__(self, width=2560, height=1440, seed=0):
+        """
+        Initializes the source.
+
+        Args:
+            width (int, optional): Screenshot width in pixels. Defaults to 2560.
+            height (int, optional): Screenshot height in pixels. Defaults to 1440.
+            seed (int, optional): Random seed. Defaults to 0.
+        """
+        self.width = width
+        self.height = height
+        self._rng = random.Random(seed)
+
+    def __call__(self):
+        return synthetic_product_image(self.width, self.height, self._rng, 30)
+
+
+class FakeMultimodalAgent(utils.EventEmitter):
+    """
+    A stand-in for MultimodalAgent that emits the events ConversationLogger listens to on demand.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._playing_handle = None
+
+    def user_said(self, text: str) -> None:
+        """
+        Emits user_speech_committed for a user utterance.
+
+        Args:
+            text (str): What the user said.
+        """
+        self.emit("user_started_speaking")
+        self.emit("user_stopped_speaking")
+        self.emit("user_speech_committed", ChatMessage(role="user", content=text))
+
+    def agent_said(self, text: str) -> None:
+        """
+        Emits the events of the agent speaking a reply, as if it was played in full.
+
+        Args:
+            text (str): What the agent said.
+        """
+        self._playing_handle = SimpleNamespace(
+            _tr_fwd=SimpleNamespace(played_text=text)
+        )
+        self.emit("agent_started_speaking")
+        self.emit("agent_stopped_speaking")
+        self.emit("agent_speech_committed")
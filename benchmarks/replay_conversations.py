@@ -0,0 +1,456 @@
+"""
+Replays recorded conversations through AgentTools and ConversationLogger against local stand-ins for Perplexity
+and OpenAI, and reports the latency of every turn, so a change to the tools, the database or the logger can be
+checked against real traffic before it ships.
+
+Conversations are read from a conversation database: the user's committed speech, the agent's replies, and each
+tool call's question and image. Each is replayed into a fresh scratch database, with the tool calls made again
+against the stand-ins, at the recorded pacing (scaled by --speed, with gaps capped at --max-gap-seconds) or as
+fast as possible (--speed 0). Recorded images that cannot be decoded (e.g. the random payloads of
+benchmarks.synthetic_data) are replaced with synthetic ones. open_urls calls are not replayed, since they open a
+browser.
+
+The report has one row per turn (everything from one user utterance to the next) and a latency summary per
+operation, and both are compared with --baseline when given. Use the stand-ins' default constant latency
+(--sigma 0) so differences come from the code under test.
+
+Usage:
+    python -m benchmarks.replay_conversations --backend sqlite --db-file agent_database.sqlite3 --conversations 20
+    python -m benchmarks.replay_conversations --synthetic 400 --speed 0 --baseline replay.json
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+from livekit import rtc
+from openai import OpenAI
+from PIL import Image
+from benchmarks.benchmark_utils import (
+    compare_to_baseline,
+    run_metadata,
+    summarize_latencies,
+    write_results,
+)
+from benchmarks.fake_room import (
+    FakeMultimodalAgent,
+    FakeScreenshotSource,
+    synthetic_product_image,
+)
+from benchmarks.stand_ins import LatencyProfile, OpenAIStandIn, PerplexityStandIn
+from benchmarks.synthetic_data import SyntheticConversationGenerator
+from agent.tools.AgentConversationLogger import ConversationLogger
+from agent.tools.AgentTools import AgentTools
+from agent.tools.PerplexityChat import PerplexityChat
+from agent.utils.database_utils import create_agent_database
+from agent.utils.image_utils import encode_video_frame
+from agent.utils.time_utils import record_epoch_ms
+
+# the tools whose recorded calls are replayed, and the argument their question is passed as
+REPLAYED_TOOLS = {
+    "search_the_web": lambda tools, question: tools.search_the_web(
+        user_question=question
+    ),
+    "question_screenshot": lambda tools, question: tools.question_screenshot(
+        user_question=question
+    ),
+    "question_camera_image": lambda tools, question: tools.question_camera_image(
+        user_question=question
+    ),
+    "query_conversation_logs": lambda tools, question: tools.query_conversation_logs(
+        user_question=question
+    ),
+}
+
+
+@dataclass
+class ReplayEvent:
+    offset: float
+    """seconds since the start of the conversation"""
+    kind: str
+    """"user", "agent" or the tool_id of a tool call"""
+    text: str
+    """what was said, or the tool call's question"""
+    image: Optional[str] = None
+    """the base64 image a vision tool call was made with"""
+
+
+@dataclass
+class Session:
+    conversation_id: str
+    user_id: str
+    started_ms: int
+    events: List[ReplayEvent] = field(default_factory=list)
+
+
+def load_sessions(records, conversations=None, conversation_ids=None):
+    """
+    Groups stored records into replayable sessions.
+
+    Args:
+        records (Iterable[dict]): Stored records, including images.
+        conversations (int, optional): Keep only this many of the most recent conversations. Defaults to None (all).
+        conversation_ids (List[str], optional): Keep only these conversations. Defaults to None (all).
+
+    Returns:
+        List[Session]: The sessions, oldest first.
+    """
+    grouped = {}
+    for record in records:
+        if conversation_ids and record["conversation_id"] not in conversation_ids:
+            continue
+        grouped.setdefault(record["conversation_id"], []).append(record)
+
+    sessions = []
+    for conversation_id, group in grouped.items():
+        group.sort(key=record_epoch_ms)
+        start = record_epoch_ms(group[0])
+        session = Session(conversation_id, group[0]["user_id"], start)
+        pending = {}
+        for record in group:
+            offset = (record_epoch_ms(record) - start) / 1000
+            tool_id, data_type = record.get("tool_id"), record["data_type"]
+            if not tool_id and data_type == "user_input_text":
+                session.events.append(ReplayEvent(offset, "user", str(record["data"])))
+            elif not tool_id and data_type == "agent_output_text":
+                session.events.append(ReplayEvent(offset, "agent", str(record["data"])))
+            elif tool_id in REPLAYED_TOOLS and data_type == "input":
+                event = ReplayEvent(offset, tool_id, str(record["data"]))
+                session.events.append(event)
+                pending[tool_id] = event
+            elif data_type == "image" and tool_id in pending:
+                # the image is stored after the input of the call it was taken for
+                pending.pop(tool_id).image = record["data"]
+        if session.events:
+            sessions.append(session)
+
+    sessions.sort(key=lambda session: session.started_ms)
+    if conversations is not None:
+        sessions = sessions[-conversations:]
+    return sessions
+
+
+def decode_image(image_b64, rng):
+    """
+    Decodes a recorded base64 image, or draws a synthetic one if it cannot be decoded.
+
+    Args:
+        image_b64 (str): The recorded image.
+        rng (random.Random): Random source for the synthetic image.
+
+    Returns:
+        PIL.Image.Image: An RGB image.
+    """
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+        return image.convert("RGB")
+    except Exception:
+        return synthetic_product_image(1280, 720, rng)
+
+
+class ReplaySources:
+    """
+    The screenshot and camera sources of a replayed conversation, serving the image of the call being replayed.
+    """
+
+    def __init__(self, seed):
+        self.image = None
+        self._rng = random.Random(seed)
+        self._screens = FakeScreenshotSource(seed=seed)
+
+    def set_image(self, image_b64):
+        self.image = decode_image(image_b64, self._rng) if image_b64 else None
+
+    def screenshot(self):
+        return self.image if self.image is not None else self._screens()
+
+    async def frame(self, room, quality=75, **kwargs):
+        image = self.image or synthetic_product_image(1280, 720, self._rng)
+        frame = rtc.VideoFrame(
+            image.width,
+            image.height,
+            rtc.VideoBufferType.RGBA,
+            image.convert("RGBA").tobytes(),
+        )
+        return encode_video_frame(frame, quality=quality)
+
+
+async def replay_session(
+    session, index, args, pplx, openai_stand_in, database, work_dir
+):
+    """
+    Replays one conversation, timing every event.
+
+    Args:
+        session (Session): The conversation.
+        index (int): The conversation's index, used for seeds and file names.
+        args (argparse.Namespace): The replay parameters.
+        pplx (PerplexityStandIn): The running Perplexity stand-in.
+        openai_stand_in (OpenAIStandIn): The running OpenAI stand-in.
+        database: The scratch database the replay writes to.
+        work_dir (str): Directory for the conversation log file.
+
+    Returns:
+        List[dict]: One row per event, with the conversation, turn, operation and latency_ms.
+    """
+    sources = ReplaySources(seed=index)
+    conversation_id = str(uuid.uuid4())
+    tools = AgentTools(
+        None,
+        OpenAI(api_key="stand-in", base_url=openai_stand_in.url + "/v1", max_retries=0),
+        PerplexityChat(
+            pplx_api_key="stand-in", base_url=pplx.url + "/chat/completions"
+        ),
+        database=database,
+        user_id=session.user_id,
+        conversation_id=conversation_id,
+        frame_source=sources.frame,
+        screenshot_source=sources.screenshot,
+    )
+    model = FakeMultimodalAgent()
+    logger = ConversationLogger(
+        model=model,
+        log=os.path.join(work_dir, f"replay_{index}.log"),
+        database=database,
+        conversation_id=conversation_id,
+        user_id=session.user_id,
+        speculator=tools.speculator,
+    )
+    logger.start()
+
+    rows = []
+    turn = 0
+    loop = asyncio.get_running_loop()
+    replay_start = loop.time()
+    try:
+        for event in session.events:
+            if args.speed:
+                due = replay_start + event.offset / args.speed
+                await asyncio.sleep(
+                    min(max(0.0, due - loop.time()), args.max_gap_seconds)
+                )
+                # a capped gap shifts the rest of the conversation earlier
+                replay_start = min(
+                    replay_start, loop.time() - event.offset / args.speed
+                )
+            start = time.perf_counter()
+            if event.kind == "user":
+                turn += 1
+                operation = "logger.user_speech_committed"
+                model.user_said(event.text)
+            elif event.kind == "agent":
+                operation = "logger.agent_stopped_speaking"
+                model.agent_said(event.text)
+            else:
+                operation = f"tool.{event.kind}"
+                sources.set_image(event.image)
+                await REPLAYED_TOOLS[event.kind](tools, event.text)
+            rows.append(
+                {
+                    "conversation_id": session.conversation_id,
+                    "turn": turn,
+                    "operation": operation,
+                    "latency_ms": 1000 * (time.perf_counter() - start),
+                }
+            )
+    finally:
+        await logger.aclose()
+        if tools.speculator is not None:
+            await tools.speculator.aclose()
+    return rows
+
+
+def turn_rows(event_rows):
+    """
+    Sums event latencies into one row per turn.
+
+    Args:
+        event_rows (List[dict]): Rows from replay_session.
+
+    Returns:
+        List[dict]: One row per (conversation, turn), with its latency_ms, events and tools called.
+    """
+    turns = {}
+    for row in event_rows:
+        key = (row["conversation_id"], row["turn"])
+        turn = turns.setdefault(
+            key,
+            {
+                "conversation_id": row["conversation_id"],
+                "turn": row["turn"],
+                "latency_ms": 0.0,
+                "events": 0,
+                "tools": [],
+            },
+        )
+        turn["latency_ms"] += row["latency_ms"]
+        turn["events"] += 1
+        if row["operation"].startswith("tool."):
+            turn["tools"].append(row["operation"][len("tool.") :])
+    return list(turns.values())
+
+
+async def run(args, sessions, work_dir):
+    """
+    Starts the stand-ins and replays every session, at most args.concurrency at a time.
+
+    Args:
+        args (argparse.Namespace): The replay parameters.
+        sessions (List[Session]): The conversations to replay.
+        work_dir (str): Directory for the scratch database and logs.
+
+    Returns:
+        List[dict]: Event rows from every session.
+    """
+    pplx = PerplexityStandIn(
+        LatencyProfile(args.pplx_median_ms, args.sigma), seed=args.seed
+    ).start()
+    openai_stand_in = OpenAIStandIn(
+        LatencyProfile(args.openai_median_ms, args.sigma), seed=args.seed + 1
+    ).start()
+    database = create_agent_database(
+        args.target_backend, os.path.join(work_dir, "replay_database")
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def replay(index, session):
+        async with semaphore:
+            return await replay_session(
+                session, index, args, pplx, openai_stand_in, database, work_dir
+            )
+
+    try:
+        results = await asyncio.gather(
+            *(replay(i, session) for i, session in enumerate(sessions))
+        )
+    finally:
+        database.close()
+        pplx.stop()
+        openai_stand_in.stop()
+    return [row for rows in results for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default=None,
+        help="Replay the conversations stored in this database",
+    )
+    parser.add_argument("--db-file", default=None)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="Replay this many synthetic records instead of a stored database",
+    )
+    parser.add_argument("--conversations", type=int, default=None)
+    parser.add_argument("--conversation-id", nargs="+", default=None)
+    parser.add_argument(
+        "--target-backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default="sqlite",
+        help="Backend of the scratch database the replay writes to",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0.0,
+        help="Pacing relative to the recording, e.g. 1 for real time or 10 for 10x; 0 replays without pauses",
+    )
+    parser.add_argument("--max-gap-seconds", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--pplx-median-ms", type=float, default=300)
+    parser.add_argument("--openai-median-ms", type=float, default=300)
+    parser.add_argument("--sigma", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="replay_benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.backend is None and not args.synthetic:
+        parser.error("pass --backend or --synthetic")
+
+    if args.backend is not None:
+        source = create_agent_database(args.backend, args.db_file)
+        try:
+            records = source.all()
+        finally:
+            source.close()
+    else:
+        records = list(
+            SyntheticConversationGenerator(seed=args.seed).generate(args.synthetic)
+        )
+    sessions = load_sessions(records, args.conversations, args.conversation_id)
+    print(
+        f"Replaying {len(sessions)} conversations with "
+        f"{sum(len(s.events) for s in sessions)} events"
+    )
+
+    work_dir = tempfile.mkdtemp(prefix="agent_replay_")
+    try:
+        event_rows = asyncio.run(run(args, sessions, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    turns = turn_rows(event_rows)
+    operations = sorted({row["operation"] for row in event_rows})
+    rows = [
+        {
+            "operation": operation,
+            **summarize_latencies(
+                [
+                    row["latency_ms"] / 1000
+                    for row in event_rows
+                    if row["operation"] == operation
+                ]
+            ),
+        }
+        for operation in operations
+    ]
+    rows.append(
+        {
+            "operation": "turn",
+            **summarize_latencies([turn["latency_ms"] / 1000 for turn in turns]),
+        }
+    )
+    for row in rows:
+        print(json.dumps(row))
+
+    results = {"meta": run_metadata(**vars(args)), "results": rows, "turns": turns}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        results["comparison"] = compare_to_baseline(
+            rows, baseline["results"], ["operation"], tolerance=args.tolerance
+        )
+        results["turn_comparison"] = compare_to_baseline(
+            turns,
+            baseline.get("turns", []),
+            ["conversation_id", "turn"],
+            metric="latency_ms",
+            tolerance=args.tolerance,
+        )
+        for row in results["comparison"]:
+            if row["regression"]:
+                print(f"REGRESSION: {row}")
+        slower = [row for row in results["turn_comparison"] if row["regression"]]
+        print(
+            f"{len(slower)} of {len(results['turn_comparison'])} turns are more than "
+            f"{args.tolerance:.0%} slower than the baseline"
+        )
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
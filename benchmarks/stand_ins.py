@@ -0,0 +1,267 @@
+"""
+Local stand-ins for the upstream HTTP APIs the tools call, so the tools can be exercised offline.
+"""
+
+import abc
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple, Union
+from urllib.parse import urlsplit
+
+
+@dataclass
+class LatencyProfile:
+    """
+    Latency and error behaviour of a stand-in endpoint.
+
+    Latencies are drawn from a log-normal distribution with the given median, which gives the
+    long right tail typical of LLM APIs.
+    """
+
+    median_ms: float = 800.0
+    """median response latency"""
+    sigma: float = 0.5
+    """log-normal shape parameter; larger values give a heavier tail"""
+    error_rate: float = 0.0
+    """fraction of requests answered with error_status"""
+    error_status: int = 500
+    """HTTP status returned for simulated errors, e.g. 429 or 500"""
+
+    def sample_seconds(self, rng: random.Random) -> float:
+        return rng.lognormvariate(0, self.sigma) * self.median_ms / 1000
+
+
+class StandInServer(abc.ABC):
+    """
+    A threaded local HTTP server that answers requests after a simulated delay, failing the profile's fraction
+    of them. Subclasses build the successful responses.
+    """
+
+    def __init__(self, profile: LatencyProfile = None, seed: int = 0):
+        """
+        Initializes the server. Call start() to begin serving.
+
+        Args:
+            profile (LatencyProfile, optional): Latency and error behaviour. Defaults to LatencyProfile().
+            seed (int, optional): Random seed for latencies and errors. Defaults to 0.
+        """
+        self.profile = profile or LatencyProfile()
+        self.requests_served = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @abc.abstractmethod
+    def build_response(
+        self, method: str, path: str, request_json: dict
+    ) -> Tuple[int, Dict[str, str], Union[dict, str]]:
+        """
+        Builds a successful response.
+
+        Args:
+            method (str): The HTTP method, e.g. "POST".
+            path (str): The request path, including any query string.
+            request_json (dict): The decoded JSON request body, empty if there is none.
+
+        Returns:
+            tuple: The status, the headers and the body: a dict, sent as JSON, or a str, sent with the
+            headers' Content-Type.
+        """
+
+    def _next_outcome(self):
+        with self._lock:
+            self.requests_served += 1
+            delay = self.profile.sample_seconds(self._rng)
+            failed = self._rng.random() < self.profile.error_rate
+        return delay, failed
+
+    def start(self) -> "StandInServer":
+        """
+        Starts serving on an ephemeral port in a daemon thread.
+
+        Returns:
+            StandInServer: self, for chaining.
+        """
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, send_body):
+                length = int(self.headers.get("Content-Length", 0))
+                request_json = json.loads(self.rfile.read(length) or b"{}")
+                delay, failed = stand_in._next_outcome()
+                time.sleep(delay)
+                if failed:
+                    status, headers = stand_in.profile.error_status, {}
+                    body = {"error": {"message": "simulated upstream error"}}
+                else:
+                    status, headers, body = stand_in.build_response(
+                        self.command, self.path, request_json
+                    )
+                if isinstance(body, dict):
+                    headers = {"Content-Type": "application/json", **headers}
+                    body = json.dumps(body)
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def do_POST(self):
+                self._respond(send_body=True)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the server."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _usage(request_json: dict, completion_tokens: int) -> dict:
+    prompt_tokens = sum(
+        len(str(m.get("content", ""))) // 4 for m in request_json.get("messages", [])
+    )
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class PerplexityStandIn(StandInServer):
+    """
+    Mimics the Perplexity chat completions endpoint, including the citations array.
+    Point PerplexityChat(base_url=stand_in.url + "/chat/completions") at it.
+    """
+
+    def build_response(self, method: str, path: str, request_json: dict):
+        query = request_json["messages"][-1]["content"]
+        return (
+            200,
+            {},
+            {
+                "id": str(uuid.uuid4()),
+                "model": request_json.get("model", "sonar"),
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "citations": [
+                    f"https://www.example-shop-{i}.com/search?q={i}" for i in range(4)
+                ],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": f"Here are a few options for '{query}' [1][2]. "
+                            "Prices range from $49 to $299 depending on the retailer [3].",
+                        },
+                    }
+                ],
+                "usage": _usage(request_json, 60),
+            },
+        )
+
+
+class OpenAIStandIn(StandInServer):
+    """
+    Mimics the OpenAI chat completions endpoint. Requests using the TinyDB snippet writer prompt get a
+    "$$$$"-delimited query back, so query_conversation_logs exercises the database too.
+    Point OpenAI(base_url=stand_in.url + "/v1") at it.
+    """
+
+    def build_response(self, method: str, path: str, request_json: dict):
+        system_text = json.dumps(request_json["messages"][0]["content"])
+        if "TinyDB" in system_text:
+            content = '$$$$db.search((tinydb.Query().data_type != "image") & (tinydb.Query().data.matches(".*chair.*")))$$$$'
+        else:
+            content = (
+                "The image shows an office chair listed at $249, which is a fair price."
+            )
+        return (
+            200,
+            {},
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request_json.get("model", "gpt-4o-mini"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "logprobs": None,
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": _usage(request_json, 40),
+            },
+        )
+
+
+class WebsiteStandIn(StandInServer):
+    """
+    A threaded local web server standing in for the retailer pages open_urls is asked to open.
+
+    Paths: /product/<n> is a page titled "Product <n> | Example Shop", /old/<n> permanently redirects to
+    /product/<n>, /gone/<n> answers 404 and /blocked/<n> answers 403, as retailers often do to automated requests.
+    Anything else is a 404. Every response is delayed by the latency profile.
+    """
+
+    def __init__(self, profile: LatencyProfile = None, seed: int = 0):
+        """
+        Initializes the server. Call start() to begin serving.
+
+        Args:
+            profile (LatencyProfile, optional): Latency and error behaviour. Defaults to 100ms and no errors.
+            seed (int, optional): Random seed for latencies and errors. Defaults to 0.
+        """
+        super().__init__(profile or LatencyProfile(median_ms=100, sigma=0.3), seed)
+
+    def build_response(self, method: str, path: str, request_json: dict):
+        kind, _, number = urlsplit(path).path.strip("/").partition("/")
+        headers = {"Content-Type": "text/html; charset=utf-8"}
+        if kind == "product":
+            return (
+                200,
+                headers,
+                f"<html><head><title>Product {number} | Example Shop</title></head>"
+                f"<body>{'<p>Product details</p>' * 200}</body></html>",
+            )
+        if kind == "old":
+            return 301, {**headers, "Location": f"/product/{number}"}, ""
+        if kind == "blocked":
+            return 403, headers, "<html><title>Access denied</title></html>"
+        return 404, headers, "<html><title>Not found</title></html>"
@@ -0,0 +1,178 @@
+import base64
+import datetime
+import random
+import uuid
+from typing import Dict, Iterator, List
+
+PRODUCTS = [
+    "Sony WH-1000XM5 headphones",
+    "Bose QuietComfort Ultra headphones",
+    "Herman Miller Aeron office chair",
+    "Steelcase Leap office chair",
+    "Dell U2723QE monitor",
+    "LG 27GP850 monitor",
+    "Hydro Flask 32oz water bottle",
+    "Canon EOS R50 digital camera",
+    "Logitech MX Master 3S mouse",
+    "Keychron K2 keyboard",
+]
+
+USER_TEMPLATES = [
+    "Can you find me a good deal on the {product}?",
+    "Is the {product} worth the money?",
+    "What do you think of the {product} on my screen?",
+    "Remind me what we said about the {product} last week",
+    "Are there cheaper alternatives to the {product}?",
+]
+
+AGENT_TEMPLATES = [
+    "Sure, let me search the web for the {product}. This may take a few seconds.",
+    "The {product} is currently around ${price}. Would you like me to open some links?",
+    "It looks like you're viewing the {product}. The listed price of ${price} seems reasonable.",
+]
+
+TOOL_SEQUENCES = {
+    "search_the_web": ["input", "output", "metadata"],
+    "question_screenshot": ["input", "image", "output", "metadata"],
+    "question_camera_image": ["input", "image", "output", "metadata"],
+    "query_conversation_logs": ["input", "output", "metadata"],
+    "open_urls": ["urls_list"],
+}
+
+
+class SyntheticConversationGenerator:
+    """
+    Generates realistic AgentDatabase records for benchmarking: user and agent text turns interleaved
+    with tool inputs, outputs, metadata and base64 images, spread across N users and M conversations.
+    """
+
+    def __init__(
+        self,
+        num_users: int = 50,
+        num_conversations: int = 500,
+        image_bytes: int = 20000,
+        tool_call_probability: float = 0.4,
+        days: int = 90,
+        seed: int = 0,
+    ):
+        """
+        Initializes the generator.
+
+        Args:
+            num_users (int, optional): Number of distinct user IDs. Defaults to 50.
+            num_conversations (int, optional): Number of distinct conversation IDs. Defaults to 500.
+            image_bytes (int, optional): Size of each raw image payload before base64 encoding. Defaults to 20000.
+            tool_call_probability (float, optional): Chance that a turn is followed by a tool call. Defaults to 0.4.
+            days (int, optional): Records are spread over this many days before now. Defaults to 90.
+            seed (int, optional): Random seed, so runs are reproducible. Defaults to 0.
+        """
+        self.random = random.Random(seed)
+        self.users = [f"user_{i}" for i in range(num_users)]
+        self.conversations = [
+            (
+                str(uuid.UUID(int=self.random.getrandbits(128))),
+                self.random.choice(self.users),
+            )
+            for _ in range(num_conversations)
+        ]
+        self.image_bytes = image_bytes
+        self.tool_call_probability = tool_call_probability
+        self.start = datetime.datetime.now() - datetime.timedelta(days=days)
+        self.days = days
+        self.image = base64.b64encode(self.random.randbytes(image_bytes)).decode(
+            "utf-8"
+        )
+
+    def _text(self, templates: List[str]) -> str:
+        return self.random.choice(templates).format(
+            product=self.random.choice(PRODUCTS),
+            price=self.random.randint(20, 1500),
+        )
+
+    def _data_for(self, tool_id: str, data_type: str) -> str:
+        if data_type == "image":
+            return self.image
+        if data_type == "input":
+            return self._text(USER_TEMPLATES)
+        if data_type == "metadata":
+            return str(
+                {
+                    "completion_tokens": self.random.randint(20, 300),
+                    "prompt_tokens": self.random.randint(200, 3000),
+                }
+            )
+        if data_type == "urls_list":
+            return str(
+                [
+                    f"https://www.example-shop-{i}.com/product/{self.random.randint(1, 10**6)}"
+                    for i in range(self.random.randint(1, 4))
+                ]
+            )
+        citations = {
+            i + 1: f"https://www.review-site-{i}.com/{self.random.randint(1, 10**6)}"
+            for i in range(self.random.randint(2, 6))
+        }
+        return (
+            " ".join(self._text(AGENT_TEMPLATES) for _ in range(3))
+            + f"\ncitations: \n{citations}"
+        )
+
+    def _record(self, timestamp, user_id, conversation_id, tool_id, data_type, data):
+        return {
+            "id": str(uuid.UUID(int=self.random.getrandbits(128))),
+            "timestamp": str(timestamp),
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "tool_id": tool_id,
+            "data_type": data_type,
+            "data": data,
+        }
+
+    def generate(self, num_records: int) -> Iterator[Dict]:
+        """
+        Yields synthetic records in the same shape AgentDatabase stores them.
+
+        Turns are emitted in chronological order within each conversation; conversations are picked at random,
+        so records for different users are interleaved as they would be on a shared worker.
+
+        Args:
+            num_records (int): Number of records to generate.
+
+        Yields:
+            Dict: One database record.
+        """
+        offsets = {
+            conversation_id: self.random.uniform(0, self.days * 86400)
+            for conversation_id, _ in self.conversations
+        }
+        emitted = 0
+        while emitted < num_records:
+            conversation_id, user_id = self.random.choice(self.conversations)
+            offsets[conversation_id] += self.random.uniform(1, 30)
+            timestamp = self.start + datetime.timedelta(
+                seconds=offsets[conversation_id]
+            )
+
+            turn = [
+                (None, "user_input_text", self._text(USER_TEMPLATES)),
+                (None, "agent_output_text", self._text(AGENT_TEMPLATES)),
+            ]
+            if self.random.random() < self.tool_call_probability:
+                tool_id = self.random.choice(list(TOOL_SEQUENCES))
+                turn += [
+                    (tool_id, data_type, self._data_for(tool_id, data_type))
+                    for data_type in TOOL_SEQUENCES[tool_id]
+                ]
+
+            for i, (tool_id, data_type, data) in enumerate(turn):
+                if emitted >= num_records:
+                    break
+                yield self._record(
+                    timestamp + datetime.timedelta(milliseconds=i),
+                    user_id,
+                    conversation_id,
+                    tool_id,
+                    data_type,
+                    data,
+                )
+                emitted += 1
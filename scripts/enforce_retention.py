@@ -0,0 +1,44 @@
+"""
+Applies the retention rules to a conversation database once and compacts it, e.g. from cron. Skips the run if a
+worker process is running them at the time.
+
+Usage:
+    python -m scripts.enforce_retention --backend sqlite --db-file agent_database.sqlite3
+"""
+
+import argparse
+import json
+import logging
+import sys
+from agent.tools.RetentionManager import RetentionManager
+from agent.utils.database_utils import create_agent_database
+from agent.config import DATABASE_BACKEND, RETENTION_BATCH_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default=DATABASE_BACKEND,
+    )
+    parser.add_argument("--db-file", default=None)
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    database = create_agent_database(args.backend, args.db_file)
+    try:
+        report = RetentionManager(database, batch_size=args.batch_size).run_if_due(
+            force=True
+        )
+    finally:
+        database.close()
+    if report is None:
+        print("Another process is running the retention rules, skipped")
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
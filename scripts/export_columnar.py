@@ -0,0 +1,75 @@
+"""
+Exports the records stored since the previous run to day-partitioned columnar files for offline analytics,
+e.g. nightly from cron. Parquet is written when pyarrow is installed, NumPy column files otherwise.
+
+Usage:
+    python -m scripts.export_columnar --backend sqlite --db-file agent_database.sqlite3 --export-dir export
+    python -m scripts.export_columnar --export-dir export --report tool-usage
+"""
+
+import argparse
+import datetime
+import json
+import logging
+from agent.utils.database_utils import create_agent_database
+from agent.utils.export_utils import export_new_records, tool_usage_per_day
+from agent.config import (
+    DATABASE_BACKEND,
+    EXPORT_DIRECTORY,
+    EXPORT_FORMAT,
+    EXPORT_IMAGES,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["tinydb", "sqlite", "sharded", "segmented"],
+        default=DATABASE_BACKEND,
+    )
+    parser.add_argument("--db-file", default=None)
+    parser.add_argument("--export-dir", default=EXPORT_DIRECTORY)
+    parser.add_argument(
+        "--format", choices=["auto", "parquet", "numpy"], default=EXPORT_FORMAT
+    )
+    parser.add_argument(
+        "--images", choices=["reference", "exclude"], default=EXPORT_IMAGES
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="Start of the first export into a new directory, e.g. 2025-01-01",
+    )
+    parser.add_argument(
+        "--report",
+        choices=["tool-usage"],
+        default=None,
+        help="Print a report from the export instead of exporting",
+    )
+    args = parser.parse_args()
+
+    if args.report == "tool-usage":
+        print(json.dumps(tool_usage_per_day(args.export_dir), indent=2))
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    since = (
+        datetime.datetime.fromisoformat(args.since) if args.since is not None else None
+    )
+    database = create_agent_database(args.backend, args.db_file)
+    try:
+        report = export_new_records(
+            database,
+            args.export_dir,
+            export_format=args.format,
+            images=args.images,
+            since=since,
+        )
+    finally:
+        database.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Migrates an existing TinyDB conversation database to the SQLite backend.
+
+Usage:
+    python -m scripts.migrate_tinydb_to_sqlite agent_database.json agent_database.sqlite3
+
+Set DATABASE_BACKEND = "sqlite" in agent/config.py afterwards. The migration skips records that are
+already present, so it can be re-run to pick up writes made while it was running.
+"""
+
+import argparse
+import logging
+from agent.tools.SQLiteAgentDatabase import migrate_tinydb_to_sqlite
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tinydb_file")
+    parser.add_argument("sqlite_file")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrated = migrate_tinydb_to_sqlite(
+        args.tinydb_file, args.sqlite_file, batch_size=args.batch_size
+    )
+    print(f"Migrated {migrated['records']} records and {migrated['usage']} usage rows")
+
+
+if __name__ == "__main__":
+    main()
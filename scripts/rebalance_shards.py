@@ -0,0 +1,37 @@
+"""
+Splits or merges a sharded conversation database into a new number of shards.
+
+Usage:
+    python -m scripts.rebalance_shards agent_database_shards 16
+
+Drain the workers first: writes made to the old shards while the copy runs are not carried over.
+"""
+
+import argparse
+import logging
+from agent.tools.ShardedAgentDatabase import rebalance_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("shard_dir")
+    parser.add_argument("shard_count", type=int)
+    parser.add_argument("--backend", choices=["tinydb", "sqlite"], default=None)
+    parser.add_argument("--keep-old", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = rebalance_shards(
+        args.shard_dir,
+        args.shard_count,
+        backend=args.backend,
+        remove_old=not args.keep_old,
+    )
+    print(
+        f"Copied {result['records']} records and {result['usage']} usage rows into "
+        f"{result['shard_count']} {result['backend']} shards (generation {result['generation']})"
+    )
+
+
+if __name__ == "__main__":
+    main()